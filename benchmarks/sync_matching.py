@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+"""
+Scaling benchmark of the file/note matching in GNSync.sync
+
+Run from the repository root:
+    python -m benchmarks.sync_matching [--max 100000] [--nested-max 5000]
+"""
+
+import argparse
+import random
+import timeit
+from types import SimpleNamespace
+
+from geeknote.gnsync import TitleIndex
+
+
+def entries(count):
+    """
+    `count` files and notes, half of them matching by title
+    and a few notes sharing a title
+    """
+    rnd = random.Random(count)
+    files = [
+        {
+            "path": "/notes/file %d.md" % i,
+            "name": "file %d" % i,
+            "mtime": rnd.randint(0, 10 ** 6),
+        }
+        for i in range(count)
+    ]
+    notes = [
+        SimpleNamespace(
+            guid="guid-%d" % i,
+            title="file %d" % (i if i % 2 else i + count),
+            updated=rnd.randint(0, 10 ** 6),
+        )
+        for i in range(count)
+    ]
+    for note in notes[: count // 100]:
+        note.title = "file 1"
+    return files, notes
+
+
+def nested(files, notes):
+    """ matching as done before TitleIndex, both directions """
+    matches = 0
+    for f in files:
+        for n in notes:
+            if f["name"] == n.title:
+                matches += 1
+                break
+    for n in notes:
+        for f in files:
+            if f["name"] == n.title:
+                matches += 1
+                break
+    return matches
+
+
+def indexed(files, notes):
+    """ matching as done by GNSync.sync, both directions """
+    matches = 0
+    notesByTitle = TitleIndex(notes, lambda n: n.title, lambda n: n.updated)
+    for f in files:
+        if notesByTitle.get(f["name"]) is not None:
+            matches += 1
+    filesByName = TitleIndex(files, lambda f: f["name"], lambda f: f["mtime"])
+    for n in notesByTitle.newest():
+        if filesByName.get_all(n.title):
+            matches += 1
+    return matches
+
+
+def measure(func, files, notes, repeat):
+    return min(timeit.repeat(lambda: func(files, notes), number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max", type=int, default=100000)
+    parser.add_argument("--nested-max", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print("%10s %12s %12s %18s" % ("entries", "nested ms", "indexed ms", "indexed us/entry"))
+    for count in (1000, 5000, 10000, 50000, 100000, 500000):
+        if count > args.max:
+            break
+        files, notes = entries(count)
+        nestedTime = "-"
+        if count <= args.nested_max:
+            nestedTime = "%.2f" % (measure(nested, files, notes, 1) * 1000)
+        indexedTime = measure(indexed, files, notes, args.repeat)
+        print(
+            "%10d %12s %12.2f %18.2f"
+            % (count, nestedTime, indexedTime * 1000, indexedTime * 10 ** 6 / count)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+"""
+asyncio facade over the NoteStore
+"""
+
+import asyncio
+
+from . import config
+from .executor import GeekNoteExecutor
+from .log import logging
+
+
+class AsyncGeekNote(object):
+    """
+    Mirrors the NoteStore part of the GeekNote API with coroutines.
+    Thrift clients are blocking, so every call runs in a GeekNoteExecutor
+    where each worker thread talks through its own transport. At most
+    `concurrency` requests are in flight at once.
+
+    usage:
+        asyncStore = AsyncGeekNote(geeknote)
+        notes = asyncStore.run(asyncStore.gather(
+            *[asyncStore.getNote(guid) for guid in guids]))
+    """
+
+    def __init__(self, geeknote, concurrency=None):
+        self.geeknote = geeknote
+        self.concurrency = concurrency or config.NOTESTORE_CONCURRENCY
+        self.executor = GeekNoteExecutor(geeknote, self.concurrency)
+        self.semaphores = {}
+
+    def getSemaphore(self):
+        # semaphores are bound to the event loop they are used in
+        loop = asyncio.get_running_loop()
+        if loop not in self.semaphores:
+            self.semaphores[loop] = asyncio.Semaphore(self.concurrency)
+        return self.semaphores[loop]
+
+    async def call(self, method, *args):
+        """
+        Call a NoteStore method in the thread pool,
+        the auth token is passed as first argument
+        """
+        async with self.getSemaphore():
+            logging.debug("NoteStore.%s", method)
+            return await asyncio.wrap_future(
+                self.executor.submitNoteStore(method, *args)
+            )
+
+    async def gather(self, *aws, return_exceptions=False):
+        return await asyncio.gather(*aws, return_exceptions=return_exceptions)
+
+    def run(self, coro):
+        """ run a coroutine from synchronous code and return its result """
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            self.semaphores.pop(loop, None)
+            loop.close()
+
+    def close(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+    async def getNote(
+        self,
+        guid,
+        withContent=False,
+        withResourcesData=False,
+        withResourcesRecognition=False,
+        withResourcesAlternateData=False,
+    ):
+        return await self.call(
+            "getNote",
+            guid,
+            withContent,
+            withResourcesData,
+            withResourcesRecognition,
+            withResourcesAlternateData,
+        )
+
+    async def findNotes(
+        self, keywords, count, createOrder=False, offset=0, deletedOnly=False
+    ):
+        """
+        Like GeekNote.findNotes, the pages after the first one
+        are requested concurrently
+        """
+        noteFilter = self.geeknote.buildNoteFilter(keywords, createOrder, deletedOnly)
+        meta = self.geeknote.buildResultSpec()
+
+        result = await self.call("findNotesMetadata", noteFilter, offset, count, meta)
+        if not result.notes:
+            return result
+
+        pageSize = len(result.notes)
+        last = min(offset + count, result.totalNotes)
+        offsets = range(offset + pageSize, last, pageSize)
+        pages = await self.gather(
+            *[
+                self.call(
+                    "findNotesMetadata",
+                    noteFilter,
+                    start,
+                    min(pageSize, last - start),
+                    meta,
+                )
+                for start in offsets
+            ]
+        )
+        for page in pages:
+            if page.notes:
+                result.notes += page.notes
+
+        return result
+
+    async def loadNoteContent(self, note):
+        """ Like GeekNote.loadNoteContent, the lookups run concurrently """
+        tagGuids = []
+        if note.tagGuids and not getattr(note, "tagNames", None):
+            tagGuids = note.tagGuids
+
+        results = await self.gather(
+            self.call("getNoteContent", note.guid),
+            self.call("getNotebook", note.notebookGuid),
+            *[self.call("getTag", guid) for guid in tagGuids]
+        )
+
+        note.content = results[0]
+        note.notebookName = results[1].name
+        if tagGuids:
+            note.tagNames = [tag.name for tag in results[2:]]
+
+    async def createNote(self, title, content, **kwargs):
+        note = self.geeknote.buildNote(title, content, **kwargs)
+        return await self.call("createNote", note)
+
+    async def updateNote(self, guid, **kwargs):
+        note = self.geeknote.buildNoteUpdate(guid, **kwargs)
+        return await self.call("updateNote", note)
+
+    async def saveMedia(self, guid, mediaHash, filename):
+        """
+        Like GeekNote.saveMedia, the body is streamed to disk
+        by a worker and replaces filename once it is complete
+        """
+        async with self.getSemaphore():
+            return await asyncio.wrap_future(
+                self.executor.submit("saveMedia", guid, mediaHash, filename)
+            )
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+
+"""
+Record Thrift traffic of a session and replay it offline.
+
+    GEEKNOTE_CASSETTE=find.cassette GEEKNOTE_CASSETTE_MODE=record geeknote find ...
+    GEEKNOTE_CASSETTE=find.cassette geeknote find ...
+
+GEEKNOTE_CASSETTE_LATENCY scales the recorded response times on replay
+(0 replays as fast as possible). Auth tokens, share keys and personal
+details of users are blanked before they are recorded and cassettes
+hold data only (gzipped JSON), so they can be shared. Calls per method
+of a cassette:
+
+    python -m geeknote.cassette find.cassette
+"""
+
+import argparse
+import atexit
+import base64
+import collections
+import gzip
+import json
+import threading
+import time
+import urllib.parse
+from io import BytesIO
+
+import thrift.protocol.TBinaryProtocol as TBinaryProtocol
+from thrift.transport import TTransport
+import evernote.edam.notestore.NoteStore as NoteStore
+import evernote.edam.userstore.UserStore as UserStore
+import evernote.edam.type.ttypes as Types
+
+from . import config
+from .transport import THttpPooledClient, TBytesBuffer, methodName
+from .log import logging
+
+VERSION = 2
+
+# fields blanked in every recorded struct
+SECRET_FIELDS = ("authenticationToken", "shareKey", "username", "email", "password")
+
+# what is kept of the accounting of a User, geeknote user shows it
+ACCOUNTING_FIELDS = ("uploadLimit", "uploadLimitEnd", "uploadLimitNextMonth")
+
+Interaction = collections.namedtuple(
+    "Interaction", ["uri", "method", "request", "response", "elapsed"]
+)
+
+
+def scrubStruct(struct):
+    """
+    Blank the secrets of a Thrift struct and of the structs it holds,
+    see SECRET_FIELDS. Of a User only the account details are kept.
+    returns True if anything was blanked
+    """
+    scrubbed = False
+    if isinstance(struct, Types.User):
+        if struct.name:
+            struct.name = ""
+            scrubbed = True
+        for field in ("attributes", "premiumInfo", "businessUserInfo"):
+            if getattr(struct, field) is not None:
+                setattr(struct, field, None)
+                scrubbed = True
+        if struct.accounting is not None:
+            struct.accounting = Types.Accounting(
+                **dict((f, getattr(struct.accounting, f)) for f in ACCOUNTING_FIELDS)
+            )
+            scrubbed = True
+
+    for spec in struct.thrift_spec or ():
+        if spec is None:
+            continue
+        name = spec[2]
+        value = getattr(struct, name, None)
+        if value is None:
+            continue
+        if name in SECRET_FIELDS:
+            if value:
+                setattr(struct, name, "")
+                scrubbed = True
+            continue
+        if isinstance(value, dict):
+            value = value.values()
+        elif not isinstance(value, (list, set)):
+            value = [value]
+        for item in value:
+            if hasattr(item, "thrift_spec"):
+                scrubbed = scrubStruct(item) or scrubbed
+    return scrubbed
+
+
+def scrub(message, suffix="_args"):
+    """
+    message without secrets: the Thrift call arguments (suffix "_args")
+    or reply ("_result") through scrubStruct, the auth field of form
+    bodies
+    """
+    try:
+        protocol = TBinaryProtocol.TBinaryProtocol(TBytesBuffer(message))
+        name, messageType, seqid = protocol.readMessageBegin()
+    except Exception:
+        return scrubForm(message)
+    if isinstance(name, bytes):
+        name = name.decode("utf-8")
+
+    structClass = getattr(NoteStore, name + suffix, None) or getattr(
+        UserStore, name + suffix, None
+    )
+    if structClass is None:
+        return message
+    struct = structClass()
+    struct.read(protocol)
+    if not scrubStruct(struct):
+        return message
+
+    buf = TBytesBuffer()
+    protocol = TBinaryProtocol.TBinaryProtocol(buf)
+    protocol.writeMessageBegin(name, messageType, seqid)
+    struct.write(protocol)
+    protocol.writeMessageEnd()
+    return buf.getvalue()
+
+
+def scrubForm(body):
+    """ form body with its auth field blanked """
+    try:
+        fields = urllib.parse.parse_qsl(body.decode("ascii"), keep_blank_values=True)
+    except (UnicodeDecodeError, ValueError):
+        return body
+    if not any(key == "auth" for key, value in fields):
+        return body
+    fields = [(key, "" if key == "auth" else value) for key, value in fields]
+    return urllib.parse.urlencode(fields).encode("ascii")
+
+
+class Cassette(object):
+    """
+    Recorded request/response pairs, stored as gzipped JSON with the
+    Thrift messages in base64 and without secrets. On replay a request
+    gets the response recorded for the same bytes (secrets aside), or
+    else the next unused response of the same method.
+    """
+
+    def __init__(self, path=None, interactions=None):
+        self.path = path
+        self.interactions = interactions or []
+        self.lock = threading.Lock()
+        self.unused = None
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            try:
+                data = json.load(f)
+            except (ValueError, OSError, EOFError):
+                data = None
+        if not isinstance(data, dict) or data.get("version") != VERSION:
+            raise ValueError("Unsupported cassette version in %s" % path)
+        return cls(
+            path,
+            [
+                Interaction(
+                    i["uri"],
+                    i["method"],
+                    base64.b64decode(i["request"]),
+                    base64.b64decode(i["response"]),
+                    i["elapsed"],
+                )
+                for i in data["interactions"]
+            ],
+        )
+
+    def save(self, path=None):
+        path = path or self.path
+        with self.lock:
+            data = {
+                "version": VERSION,
+                "interactions": [
+                    {
+                        "uri": i.uri,
+                        "method": i.method,
+                        "request": base64.b64encode(i.request).decode("ascii"),
+                        "response": base64.b64encode(i.response).decode("ascii"),
+                        "elapsed": i.elapsed,
+                    }
+                    for i in self.interactions
+                ],
+            }
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            json.dump(data, f)
+        logging.debug("Saved %d interactions to %s", len(self.interactions), path)
+
+    def record(self, uri, request, response, elapsed):
+        interaction = Interaction(
+            uri,
+            methodName(request),
+            scrub(request),
+            scrub(response, "_result"),
+            elapsed,
+        )
+        with self.lock:
+            self.interactions.append(interaction)
+
+    def replay(self, request):
+        """ recorded Interaction for request, None if there is none left """
+        method = methodName(request)
+        request = scrub(request)
+        with self.lock:
+            if self.unused is None:
+                self.unused = collections.defaultdict(list)
+                for interaction in self.interactions:
+                    self.unused[interaction.method].append(interaction)
+
+            candidates = self.unused[method]
+            for i, interaction in enumerate(candidates):
+                if interaction.request == request:
+                    return candidates.pop(i)
+            if candidates:
+                return candidates.pop(0)
+
+    def getStats(self):
+        """ {method: {"calls", "elapsed", "bytes"}} """
+        stats = collections.OrderedDict()
+        with self.lock:
+            for interaction in self.interactions:
+                item = stats.setdefault(
+                    interaction.method, {"calls": 0, "elapsed": 0.0, "bytes": 0}
+                )
+                item["calls"] += 1
+                item["elapsed"] += interaction.elapsed
+                item["bytes"] += len(interaction.request) + len(interaction.response)
+        return stats
+
+
+class TRecordingClient(THttpPooledClient):
+    """
+    THttpPooledClient saving every exchange to a cassette
+    """
+
+    def __init__(self, uri, cassette, connectionPool=None):
+        THttpPooledClient.__init__(self, uri, connectionPool)
+        self.uri = uri
+        self.cassette = cassette
+
+    def flush(self):
+        request = self.wbuf.getvalue()
+        start = time.time()
+        THttpPooledClient.flush(self)
+        self.cassette.record(
+            self.uri, request, self.rbuf.getvalue(), time.time() - start
+        )
+
+
+class TReplayClient(TBytesBuffer):
+    """
+    Transport answering requests from a cassette instead of the network
+    """
+
+    def __init__(self, uri, cassette, latency=1.0):
+        TBytesBuffer.__init__(self)
+        self.uri = uri
+        self.cassette = cassette
+        self.latency = latency
+        self.wbuf = BytesIO()
+
+    def write(self, buf):
+        self.wbuf.write(buf)
+
+    def flush(self):
+        request = self.wbuf.getvalue()
+        self.wbuf = BytesIO()
+
+        interaction = self.cassette.replay(request)
+        if interaction is None:
+            raise TTransport.TTransportException(
+                message="No recorded response for %s to %s"
+                % (methodName(request), self.uri)
+            )
+        if self.latency:
+            time.sleep(interaction.elapsed * self.latency)
+        self.buffer = BytesIO(interaction.response)
+
+    def setTimeout(self, ms):
+        pass
+
+    def setCustomHeaders(self, headers):
+        pass
+
+
+# cassette used by transport.createClient
+active = None
+mode = None
+latency = 1.0
+
+
+def activate(cassette, cassetteMode="replay", cassetteLatency=1.0):
+    """ route every new Thrift client through cassette """
+    global active, mode, latency
+    active = cassette
+    mode = cassetteMode
+    latency = cassetteLatency
+
+
+def deactivate():
+    activate(None, None)
+
+
+def getActive():
+    """ the active cassette, set up from config on first use """
+    if active is None and config.CASSETTE:
+        if config.CASSETTE_MODE == "record":
+            cassette = Cassette(config.CASSETTE)
+            atexit.register(cassette.save)
+        else:
+            cassette = Cassette.load(config.CASSETTE)
+        activate(cassette, config.CASSETTE_MODE, config.CASSETTE_LATENCY)
+    return active
+
+
+def createTransport(uri):
+    """ recording or replaying transport for uri, None without a cassette """
+    cassette = getActive()
+    if cassette is None:
+        return None
+    if mode == "record":
+        return TRecordingClient(uri, cassette)
+    return TReplayClient(uri, cassette, latency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show calls recorded in a cassette")
+    parser.add_argument("path")
+    args = parser.parse_args()
+
+    stats = Cassette.load(args.path).getStats()
+    print("%-32s %8s %10s %12s" % ("method", "calls", "seconds", "bytes"))
+    for method, item in stats.items():
+        print("%-32s %8d %10.3f %12d"
+              % (method, item["calls"], item["elapsed"], item["bytes"]))
+    print("%-32s %8d %10.3f %12d" % (
+        "total",
+        sum(i["calls"] for i in stats.values()),
+        sum(i["elapsed"] for i in stats.values()),
+        sum(i["bytes"] for i in stats.values()),
+    ))
+
+
+if __name__ == "__main__":
+    main()
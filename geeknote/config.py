@@ -33,6 +33,41 @@ CONSUMER_SECRET_SANDBOX = "ed0fcc0c97c032a5"
 # can be one of: UPDATED, CREATED, RELEVANCE, TITLE, UPDATE_SEQUENCE_NUMBER
 NOTE_SORT_ORDER = "UPDATED"
 
+# How long (in seconds) the note store URL, shard info and
+# version check stay cached between invocations
+CACHE_TTL = 24 * 60 * 60
+
+# How many NoteStore requests may be in flight at once
+NOTESTORE_CONCURRENCY = 8
+
+# How many files and notes gnsync converts and transfers at once
+GNSYNC_JOBS = os.cpu_count() or 1
+
+# Most sync actions of a kind gnsync runs at once, within GNSYNC_JOBS;
+# kinds which are not listed use all jobs
+GNSYNC_ACTION_JOBS = {"create-note": 4, "update-note": 4}
+
+# gnsync --watch pushes a changed file once it was not written for
+# WATCH_DEBOUNCE seconds and asks for the sync state every WATCH_INTERVAL
+WATCH_DEBOUNCE = 1.0
+WATCH_INTERVAL = 60
+
+# How long (in seconds) notebooks, tags and user info
+# are remembered within one process
+MEMO_TTL = 60
+
+# Evernote counts API requests per account over this many seconds
+RATELIMIT_WINDOW = 60 * 60
+
+# Most entries requested in one getFilteredSyncChunk call
+SYNC_CHUNK_SIZE = 1000
+
+# Record Thrift traffic to this file (CASSETTE_MODE "record") or replay
+# it offline ("replay"), recorded response times scaled by CASSETTE_LATENCY
+CASSETTE = os.getenv("GEEKNOTE_CASSETTE")
+CASSETTE_MODE = os.getenv("GEEKNOTE_CASSETTE_MODE", "replay")
+CASSETTE_LATENCY = float(os.getenv("GEEKNOTE_CASSETTE_LATENCY", "1.0"))
+
 # Evernote config
 
 try:
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+"""
+Resource bodies streamed to disk from the resource endpoint of the shard,
+in chunks, so that large attachments never sit in memory
+"""
+
+import hashlib
+import http.client
+import os
+import socket
+import urllib.parse
+
+from . import transport
+from .log import logging
+
+CHUNK_SIZE = 64 * 1024
+
+
+class DownloadError(Exception):
+    """ the endpoint refused the download or sent a broken body """
+
+
+def getResourceUrl(noteStoreUrl, guid):
+    """
+    URL of the resource guid, next to the NoteStore of the shard:
+    https://www.evernote.com/shard/s1/notestore -> .../shard/s1/res/<guid>
+    """
+    return noteStoreUrl.rsplit("/", 1)[0] + "/res/" + guid
+
+
+def getPartialPath(filename):
+    """ where the body of filename is collected, hidden from gnsync masks """
+    directory, name = os.path.split(filename)
+    return os.path.join(directory, "." + name + ".part")
+
+
+def hashFile(path, md5):
+    """ feeds the content of path into md5, returns its size """
+    size = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+            md5.update(block)
+            size += len(block)
+    return size
+
+
+def downloadResource(
+    url, authToken, filename, bodyHash, size=None, retries=2, connectionPool=None
+):
+    """
+    Stream the resource at url into filename. The body is collected in a
+    partial file and verified against bodyHash (MD5 digest) before it
+    replaces filename. A partial file left by an interrupted download is
+    resumed with a Range request, which is retried `retries` times.
+    raises DownloadError, or socket and HTTP errors once retries are spent
+    """
+    pool = connectionPool or transport.pool
+    parsed = urllib.parse.urlparse(url)
+    if parsed.scheme == "https":
+        port = parsed.port or http.client.HTTPS_PORT
+    else:
+        port = parsed.port or http.client.HTTP_PORT
+    partial = getPartialPath(filename)
+
+    while True:
+        md5 = hashlib.md5()
+        offset = 0
+        if os.path.exists(partial):
+            offset = hashFile(partial, md5)
+            if size is not None and offset >= size:
+                # complete or longer than the resource, check it as it is
+                if offset == size and md5.digest() == bodyHash:
+                    os.replace(partial, filename)
+                    return
+                os.unlink(partial)
+                md5, offset = hashlib.md5(), 0
+
+        try:
+            md5 = _stream(pool, parsed, port, authToken, partial, md5, offset)
+        except (socket.error, http.client.HTTPException) as e:
+            if retries <= 0:
+                raise
+            retries -= 1
+            logging.debug("Resuming download of %s: %s", url, str(e))
+            continue
+
+        if md5.digest() != bodyHash:
+            os.unlink(partial)
+            raise DownloadError("MD5 mismatch for %s" % url)
+        os.replace(partial, filename)
+        return
+
+
+def _stream(pool, parsed, port, authToken, partial, md5, offset):
+    """
+    One request of downloadResource, appends to partial from offset
+    returns the MD5 of the partial file
+    """
+    connection, reused = pool.acquire(parsed.scheme, parsed.hostname, port)
+    try:
+        data = urllib.parse.urlencode({"auth": authToken}).encode("ascii")
+        headers = {
+            "Content-Type": "application/x-www-form-urlencoded",
+            "Content-Length": str(len(data)),
+        }
+        if offset:
+            headers["Range"] = "bytes=%d-" % offset
+        connection.request("POST", parsed.path, data, headers)
+        response = connection.getresponse()
+
+        if response.status == 200 and offset:
+            # the endpoint ignored the range, start over
+            md5, offset = hashlib.md5(), 0
+        elif response.status not in (200, 206):
+            response.read()
+            raise DownloadError(
+                "HTTP %d %s from %s" % (response.status, response.reason, parsed.path)
+            )
+
+        with open(partial, "ab" if offset else "wb") as f:
+            for block in iter(lambda: response.read(CHUNK_SIZE), b""):
+                md5.update(block)
+                f.write(block)
+    except BaseException:
+        connection.close()
+        raise
+
+    if response.will_close:
+        connection.close()
+    else:
+        pool.release(parsed.scheme, parsed.hostname, port, connection)
+    return md5
@@ -55,7 +55,9 @@ class Editor(object):
         Creates a list of image resources to save.
         Each has a hash and extension attribute.
         """
-        soup = BeautifulSoup(contentENML.decode("utf-8"), features='lxml')
+        if isinstance(contentENML, bytes):
+            contentENML = contentENML.decode("utf-8")
+        soup = BeautifulSoup(contentENML, features='lxml')
         imageList = []
         for section in soup.findAll("en-media"):
             if "type" in section.attrs and "hash" in section.attrs:
@@ -254,7 +256,7 @@ class Editor(object):
                     else:
                         tmpstr = tmpstr + "<div>" + l + "</div>"
 
-                contentHTML = tmpstr.encode("utf-8")
+                contentHTML = tmpstr
                 contentHTML = contentHTML.replace(
                     "[x]", '<en-todo checked="true"></en-todo>'
                 )
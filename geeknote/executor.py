@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+"""
+Thread pool for GeekNote calls
+"""
+
+import re
+import threading
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+
+import evernote.edam.notestore.NoteStore as NoteStore
+
+from . import config
+from . import tools
+from . import transport
+from . import memo
+from .geeknote import GeekNote
+from .storage import Storage
+from .log import logging
+
+# seconds before it expires that the auth token of a shared notebook
+# is no longer used
+SHARED_AUTH_MARGIN = 10 * 60
+
+
+class GeekNoteWorker(GeekNote):
+    """
+    GeekNote owned by a single thread: it has its own NoteStore
+    transport and Storage session instead of the shared class attributes
+    """
+
+    def __init__(self, authToken, noteStoreUrl, sleepOnRateLimit=False):
+        self.authToken = authToken
+        self.noteStoreUrl = noteStoreUrl
+        self.sleepOnRateLimit = sleepOnRateLimit
+        self.storage = Storage()
+        self.noteStore = None
+
+    def getStorage(self):
+        return self.storage
+
+    def getNoteStoreUrl(self):
+        return self.noteStoreUrl
+
+    def getNoteStore(self):
+        if self.noteStore:
+            return self.noteStore
+
+        self.noteStore = memo.MemoizedClient(
+            transport.createClient(NoteStore.Client, self.noteStoreUrl)
+        )
+
+        return self.noteStore
+
+    def invalidateCache(self):
+        GeekNote.invalidateCache(self)
+        self.noteStore = None
+
+
+class LinkedNotebookWorker(GeekNoteWorker):
+    """
+    GeekNoteWorker on the shard of a notebook another user shared
+    (a linked notebook). Notes are read and written with the auth token
+    of the share, searches are limited to the notebook and the sync
+    state is the one of the notebook. The shared auth token is cached
+    per shareKey until shortly before it expires.
+    """
+
+    def __init__(self, linkedNotebook, userToken, sleepOnRateLimit=False):
+        GeekNoteWorker.__init__(
+            self, None, linkedNotebook.noteStoreUrl, sleepOnRateLimit
+        )
+        self.linkedNotebook = linkedNotebook
+        self.userToken = userToken
+        self.notebookGuid = None
+
+    @GeekNote.EdamException
+    def authenticate(self):
+        """ returns the guid of the shared notebook """
+        key = "sharedAuth:" + self.linkedNotebook.shareKey
+        cached = self.getStorage().getCache(key)
+        if cached is None:
+            noteStore = self.getNoteStore()
+            result = noteStore.authenticateToSharedNotebook(
+                self.linkedNotebook.shareKey, self.userToken
+            )
+            shared = noteStore.getSharedNotebookByAuth(result.authenticationToken)
+            cached = (result.authenticationToken, shared.notebookGuid)
+            ttl = (result.expiration - result.currentTime) / 1000.0
+            if ttl > SHARED_AUTH_MARGIN:
+                self.getStorage().setCache(key, cached, ttl - SHARED_AUTH_MARGIN)
+        self.authToken, self.notebookGuid = cached
+        return self.notebookGuid
+
+    def buildNoteFilter(self, keywords, createOrder=False, deletedOnly=False):
+        # the notebook is searched by guid, its name is the owner's one
+        keywords = re.sub(r'notebook:"[^"]*"\s*', "", keywords or "").strip()
+        noteFilter = GeekNote.buildNoteFilter(
+            self, keywords or None, createOrder, deletedOnly
+        )
+        noteFilter.notebookGuid = self.notebookGuid
+        return noteFilter
+
+    @GeekNote.EdamException
+    def getSyncState(self):
+        return self.getNoteStore().getLinkedNotebookSyncState(
+            self.userToken, self.linkedNotebook
+        )
+
+    @GeekNote.EdamException
+    def getSyncChunk(self, afterUSN, maxEntries=None, withExpunged=True):
+        """ notes of the notebook changed after afterUSN """
+        return self.getNoteStore().getLinkedNotebookSyncChunk(
+            self.userToken,
+            self.linkedNotebook,
+            afterUSN,
+            maxEntries or config.SYNC_CHUNK_SIZE,
+            not withExpunged,
+        )
+
+
+class GeekNoteExecutor(object):
+    """
+    Runs GeekNote methods in a pool of threads, each with its own
+    GeekNoteWorker. Every call keeps the EdamException handling of the
+    GeekNote method: errors it handles give the same result, and an exit
+    is raised again as tools.ExitException from Future.result().
+
+    usage:
+        with GeekNoteExecutor(GeekNote()) as executor:
+            notes = list(executor.map("getNote", guids))
+    """
+
+    def __init__(self, geeknote, workers=None):
+        self.authToken = geeknote.authToken
+        self.noteStoreUrl = geeknote.getNoteStoreUrl()
+        self.sleepOnRateLimit = getattr(geeknote, "sleepOnRateLimit", False)
+        self.workers = workers or config.NOTESTORE_CONCURRENCY
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="geeknote"
+        )
+        self.local = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    def getWorker(self):
+        """ GeekNoteWorker of the current thread """
+        worker = getattr(self.local, "worker", None)
+        if worker is None:
+            logging.debug("New worker in %s", threading.current_thread().name)
+            worker = GeekNoteWorker(
+                self.authToken, self.noteStoreUrl, self.sleepOnRateLimit
+            )
+            self.local.worker = worker
+        return worker
+
+    def _call(self, method, args, kwargs):
+        return self._callFunc(getattr(self.getWorker(), method), args, kwargs)
+
+    def _callFunc(self, func, args, kwargs):
+        try:
+            return func(*args, **kwargs)
+        except SystemExit:
+            # tools.exitErr ends worker threads with SystemExit,
+            # hand the exit over to the thread waiting for the result
+            raise tools.ExitException(1)
+
+    def _callNoteStore(self, method, args):
+        worker = self.getWorker()
+        return getattr(worker.getNoteStore(), method)(worker.authToken, *args)
+
+    def submit(self, method, *args, **kwargs):
+        """ call a GeekNote method, returns a Future """
+        return self.executor.submit(self._call, method, args, kwargs)
+
+    def submitCall(self, func, *args, **kwargs):
+        """
+        call func in a pool thread, returns a Future
+        func gets the GeekNote of its thread from getWorker()
+        """
+        return self.executor.submit(self._callFunc, func, args, kwargs)
+
+    def submitNoteStore(self, method, *args):
+        """
+        call a NoteStore method with the auth token, returns a Future
+        errors are not handled by EdamException
+        """
+        return self.executor.submit(self._callNoteStore, method, args)
+
+    def map(self, method, *iterables):
+        """ like Executor.map, for a GeekNote method """
+        futures = [self.submit(method, *args) for args in zip(*iterables)]
+        return (future.result() for future in futures)
+
+    def getNote(self, guid, *args, **kwargs):
+        return self.submit("getNote", guid, *args, **kwargs)
+
+    def getNoteContent(self, guid):
+        return self.submit("getNoteContent", guid)
+
+    def getResourceByHash(self, guid, mediaHash, *args, **kwargs):
+        return self.submit("getResourceByHash", guid, mediaHash, *args, **kwargs)
+
+    def createNote(self, *args, **kwargs):
+        return self.submit("createNote", *args, **kwargs)
+
+    def updateNote(self, *args, **kwargs):
+        return self.submit("updateNote", *args, **kwargs)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+class InlineExecutor(Executor):
+    """
+    Executor running every call at once in the calling thread,
+    stands in for a pool of one worker. An exit is raised again as
+    tools.ExitException from Future.result(), as in GeekNoteExecutor.
+    """
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(func(*args, **kwargs))
+        except SystemExit:
+            # like GeekNoteExecutor, the exit is raised from result()
+            future.set_exception(tools.ExitException(1))
+        except Exception as e:
+            future.set_exception(e)
+        return future
@@ -3,6 +3,7 @@
 
 import traceback
 import time
+import http.client
 import sys
 import os
 import mimetypes
@@ -10,9 +11,6 @@ import hashlib
 import re
 import traceback
 
-import thrift.protocol.TBinaryProtocol as TBinaryProtocol
-import thrift.transport.THttpClient as THttpClient
-
 import evernote.edam.userstore.constants as UserStoreConstants
 import evernote.edam.notestore.NoteStore as NoteStore
 from evernote.edam.notestore.ttypes import NotesMetadataResultSpec
@@ -24,6 +22,11 @@ from .__init__ import __version__
 from . import config
 from . import tools
 from . import out
+from . import transport
+from . import download
+from . import cassette
+from . import memo
+from . import ratelimit
 from .editor import Editor, EditorThread
 from .gclient import GUserStore as UserStore
 from .argparser import argparser
@@ -86,6 +89,7 @@ class GeekNote(object):
     skipInitConnection = False
     sharedAuthToken = None
     sharedNoteStore = None
+    asyncStore = None
 
     def __init__(self, skipInitConnection=False, sleepOnRateLimit=False):
         if skipInitConnection:
@@ -115,6 +119,11 @@ class GeekNote(object):
                     if hasattr(e, "errorCode"):
                         errorCode = int(e.errorCode)
 
+                        # permission and auth errors, the cached
+                        # note store and shard may be stale
+                        if errorCode in (3, 8, 9):
+                            wrapped_object.invalidateCache()
+
                         # auth-token error, re-auth
                         if errorCode == 9:
                             storage = Storage()
@@ -134,11 +143,18 @@ class GeekNote(object):
                         # hammering the server on scripts
                         elif errorCode == 19:
                             if sleepOnRateLimit:
+                                # the retry waits in the rate limiter, which
+                                # then paces requests to the learned budget
+                                ratelimit.limiter.limited(
+                                    e.rateLimitDuration, wrapped_object.getStorage()
+                                )
+                                rate = ratelimit.limiter.getStats()["rate"]
                                 print(
-                                    "\nRate Limit Hit: Sleeping %s seconds before continuing"
-                                    % str(e.rateLimitDuration)
+                                    "\nRate Limit Hit: Pausing %s seconds, then continuing%s"
+                                    % (str(e.rateLimitDuration),
+                                       " at %.1f requests per minute" % rate
+                                       if rate else "")
                                 )
-                                time.sleep(e.rateLimitDuration)
                             else:
                                 print(
                                     "\nRate Limit Hit: Please wait %s seconds before continuing"
@@ -150,6 +166,7 @@ class GeekNote(object):
                             tools.exitErr()
 
                     elif isinstance(e, EDAMNotFoundException):
+                        wrapped_object.invalidateCache()
                         out.failureMessage("EDAMNotFoundException on %s with key %s"
                                            % (e.identifier, e.key))
                         return None
@@ -175,9 +192,9 @@ class GeekNote(object):
         if GeekNote.userStore:
             return GeekNote.userStore
 
-        userStoreHttpClient = THttpClient.THttpClient(self.userStoreUri)
-        userStoreProtocol = TBinaryProtocol.TBinaryProtocol(userStoreHttpClient)
-        GeekNote.userStore = UserStore.Client(userStoreProtocol)
+        GeekNote.userStore = memo.MemoizedClient(
+            transport.createClient(UserStore.Client, self.userStoreUri)
+        )
 
         self.checkVersion()
 
@@ -187,14 +204,63 @@ class GeekNote(object):
         if GeekNote.noteStore:
             return GeekNote.noteStore
 
-        noteStoreUrl = str(self.getUserStore().getNoteStoreUrl(self.authToken),'utf-8')
-        noteStoreHttpClient = THttpClient.THttpClient(noteStoreUrl)
-        noteStoreProtocol = TBinaryProtocol.TBinaryProtocol(noteStoreHttpClient)
-        GeekNote.noteStore = NoteStore.Client(noteStoreProtocol)
+        noteStoreUrl = self.getNoteStoreUrl()
+        ratelimit.limiter.load(self.getStorage())
+        GeekNote.noteStore = memo.MemoizedClient(
+            transport.createClient(NoteStore.Client, noteStoreUrl)
+        )
 
         return GeekNote.noteStore
 
+    def getAsyncStore(self):
+        if GeekNote.asyncStore:
+            return GeekNote.asyncStore
+
+        from .aio import AsyncGeekNote
+
+        GeekNote.asyncStore = AsyncGeekNote(self)
+
+        return GeekNote.asyncStore
+
+    def getNoteStoreUrl(self):
+        noteStoreUrl = self.getStorage().getCache("noteStoreUrl")
+        if noteStoreUrl:
+            return noteStoreUrl
+
+        noteStoreUrl = str(self.getUserStore().getNoteStoreUrl(self.authToken),'utf-8')
+        self.getStorage().setCache("noteStoreUrl", noteStoreUrl)
+
+        return noteStoreUrl
+
+    def invalidateCache(self):
+        """ forget the cached note store, shard info and memoized results """
+        logging.debug("Invalidating note store cache")
+        storage = self.getStorage()
+        storage.delCache("noteStoreUrl")
+        storage.delCache("shardInfo")
+        storage.delCache(prefix="versionOK:")
+        memo.memo.invalidate()
+        GeekNote.noteStore = None
+        self.closeAsyncStore()
+
+    def closeAsyncStore(self):
+        """
+        drop the async store, its workers hold the auth token and
+        note store URL they were created with
+        """
+        asyncStore, GeekNote.asyncStore = GeekNote.asyncStore, None
+        if asyncStore:
+            # may run in one of its workers, which must not wait for itself
+            asyncStore.close(wait=False)
+
     def checkVersion(self):
+        cacheKey = "versionOK:%d.%d" % (
+            UserStoreConstants.EDAM_VERSION_MAJOR,
+            UserStoreConstants.EDAM_VERSION_MINOR,
+        )
+        if self.getStorage().getCache(cacheKey):
+            return
+
         versionOK = self.getUserStore().checkVersion(
             "Python EDAMTest",
             UserStoreConstants.EDAM_VERSION_MAJOR,
@@ -204,6 +270,8 @@ class GeekNote(object):
             logging.error("Old EDAM version")
             return tools.exitErr()
 
+        self.getStorage().setCache(cacheKey, True)
+
     def checkAuth(self):
         self.authToken = self.getStorage().getUserToken()
         logging.debug("oauth token : %s", self.authToken)
@@ -248,13 +316,28 @@ class GeekNote(object):
             return False
 
         self.getStorage().createUser(self.authToken, userInfo)
+        self.closeAsyncStore()
         return True
 
     def getUserInfo(self):
         return self.getUserStore().getUser(self.authToken)
 
+    def getShardInfo(self):
+        """ returns (user id, shard id) of the logged in user """
+        shardInfo = self.getStorage().getCache("shardInfo")
+        if shardInfo:
+            return shardInfo
+
+        userInfo = self.getUserInfo()
+        shardInfo = (userInfo.id, userInfo.shardId)
+        self.getStorage().setCache("shardInfo", shardInfo)
+
+        return shardInfo
+
     def removeUser(self):
-        return self.getStorage().removeUser()
+        """ log out, a re-authentication keeps the sync state, this drops it """
+        storage = self.getStorage()
+        return storage.removeUser() and storage.delSyncState()
 
     @EdamException
     def getNote(
@@ -277,31 +360,48 @@ class GeekNote(object):
         )
 
     @EdamException
-    def findNotes(
-        self, keywords, count, createOrder=False, offset=0, deletedOnly=False
+    def getNoteContent(self, guid):
+        return self.getNoteStore().getNoteContent(self.authToken, guid)
+
+    @EdamException
+    def getResourceByHash(
+        self,
+        guid,
+        mediaHash,
+        withData=True,
+        withRecognition=False,
+        withAlternateData=False,
     ):
-        """ WORK WITH NOTES """
-        noteFilter = NoteStore.NoteFilter(order=Types.NoteSortOrder.RELEVANCE)
-        noteFilter.order = getattr(Types.NoteSortOrder, self.noteSortOrder)
-        if createOrder:
-            noteFilter.order = Types.NoteSortOrder.CREATED
+        return self.getNoteStore().getResourceByHash(
+            self.authToken,
+            guid,
+            mediaHash,
+            withData,
+            withRecognition,
+            withAlternateData,
+        )
 
-        if keywords:
-            noteFilter.words = keywords
+    @EdamException
+    def getSyncState(self):
+        return self.getNoteStore().getSyncState(self.authToken)
 
-        if deletedOnly:
-            noteFilter.inactive = True
+    @EdamException
+    def getSyncChunk(self, afterUSN, maxEntries=None, withExpunged=True):
+        """ notes (without content) changed after afterUSN """
+        syncFilter = NoteStore.SyncChunkFilter()
+        syncFilter.includeNotes = True
+        syncFilter.includeExpunged = withExpunged
+        return self.getNoteStore().getFilteredSyncChunk(
+            self.authToken, afterUSN, maxEntries or config.SYNC_CHUNK_SIZE, syncFilter
+        )
 
-        meta = NotesMetadataResultSpec()
-        meta.includeTitle = True
-        meta.includeContentLength = True
-        meta.includeCreated = True
-        meta.includeUpdated = True
-        meta.includeNotebookGuid = True
-        meta.includeAttributes = True
-        meta.includeTagGuids = True
-        meta.includeLargestResourceMime = True
-        meta.includeLargestResourceSize = True
+    @EdamException
+    def findNotes(
+        self, keywords, count, createOrder=False, offset=0, deletedOnly=False
+    ):
+        """ WORK WITH NOTES """
+        noteFilter = self.buildNoteFilter(keywords, createOrder, deletedOnly)
+        meta = self.buildResultSpec()
 
         result = self.getNoteStore().findNotesMetadata(
             self.authToken, noteFilter, offset, count, meta
@@ -329,6 +429,35 @@ class GeekNote(object):
 
         return result
 
+    def buildNoteFilter(self, keywords, createOrder=False, deletedOnly=False):
+        noteFilter = NoteStore.NoteFilter(order=Types.NoteSortOrder.RELEVANCE)
+        noteFilter.order = getattr(Types.NoteSortOrder, self.noteSortOrder)
+        if createOrder:
+            noteFilter.order = Types.NoteSortOrder.CREATED
+
+        if keywords:
+            noteFilter.words = keywords
+
+        if deletedOnly:
+            noteFilter.inactive = True
+
+        return noteFilter
+
+    def buildResultSpec(self):
+        meta = NotesMetadataResultSpec()
+        meta.includeTitle = True
+        meta.includeContentLength = True
+        meta.includeCreated = True
+        meta.includeUpdated = True
+        meta.includeUpdateSequenceNum = True
+        meta.includeNotebookGuid = True
+        meta.includeAttributes = True
+        meta.includeTagGuids = True
+        meta.includeLargestResourceMime = True
+        meta.includeLargestResourceSize = True
+
+        return meta
+
     @EdamException
     def loadNoteContent(self, note):
         """ modify Note object """
@@ -337,17 +466,9 @@ class GeekNote(object):
                 "Note content must be an " "instance of Note, '%s' given." % type(note)
             )
 
-        note.content = self.getNoteStore().getNoteContent(self.authToken, note.guid)
-        # fill the tags in
-        if note.tagGuids and not getattr(note, "tagNames", None):
-            note.tagNames = []
-            for guid in note.tagGuids:
-                tag = self.getNoteStore().getTag(self.authToken, guid)
-                note.tagNames.append(tag.name)
-
-        note.notebookName = (
-            self.getNoteStore().getNotebook(self.authToken, note.notebookGuid).name
-        )
+        # content, tags and notebook are fetched concurrently
+        asyncStore = self.getAsyncStore()
+        asyncStore.run(asyncStore.loadNoteContent(note))
 
     @EdamException
     def loadLinkedNoteContent(self, note):
@@ -374,6 +495,23 @@ class GeekNote(object):
         reminder=None,
         url=None,
     ):
+        note = self.buildNote(
+            title, content, tags, created, notebook, resources, reminder, url
+        )
+        return self.getNoteStore().createNote(self.authToken, note)
+
+    def buildNote(
+        self,
+        title,
+        content,
+        tags=None,
+        created=None,
+        notebook=None,
+        resources=None,
+        reminder=None,
+        url=None,
+    ):
+        """ make a new Note object for createNote """
         note = Types.Note()
         note.title = title
         try:
@@ -436,7 +574,7 @@ class GeekNote(object):
             pass
         logging.debug("New note : %s", note)
 
-        return self.getNoteStore().createNote(self.authToken, note)
+        return note
 
     @EdamException
     def updateNote(
@@ -452,6 +590,27 @@ class GeekNote(object):
         url=None,
         shared=False,
     ):
+        note = self.buildNoteUpdate(
+            guid, title, content, tags, created, notebook, resources, reminder, url
+        )
+        if not shared:
+            return self.getNoteStore().updateNote(self.authToken, note)
+        else:
+            return self.sharedNoteStore.updateNote(self.sharedAuthToken, note)
+
+    def buildNoteUpdate(
+        self,
+        guid,
+        title=None,
+        content=None,
+        tags=None,
+        created=None,
+        notebook=None,
+        resources=None,
+        reminder=None,
+        url=None,
+    ):
+        """ make a Note object with the changes for updateNote """
         note = Types.Note()
         note.guid = guid
         if title:
@@ -533,11 +692,7 @@ class GeekNote(object):
             pass
         logging.debug("Update note : %s", note)
 
-        if not shared:
-            self.getNoteStore().updateNote(self.authToken, note)
-        else:
-            self.sharedNoteStore.updateNote(self.sharedAuthToken, note)
-        return True
+        return note
 
     @EdamException
     def removeNote(self, guid):
@@ -555,6 +710,17 @@ class GeekNote(object):
     def findLinkedNotebooks(self):
         return self.getNoteStore().listLinkedNotebooks(self.authToken)
 
+    @EdamException
+    def findAllNotebooks(self):
+        """ returns (notebooks, linked notebooks), fetched concurrently """
+        asyncStore = self.getAsyncStore()
+        return asyncStore.run(
+            asyncStore.gather(
+                asyncStore.call("listNotebooks"),
+                asyncStore.call("listLinkedNotebooks"),
+            )
+        )
+
     @EdamException
     def createNotebook(self, name, stack=None):
         notebook = Types.Notebook()
@@ -625,12 +791,39 @@ class GeekNote(object):
             )
         )
 
+        # cassettes hold Thrift calls only, the body comes whole then
+        if cassette.getActive() is None:
+            # metadata only, the body is streamed from the resource endpoint
+            resource = self.getNoteStore().getResourceByHash(
+                self.authToken, guid, mediaHash, False, False, False
+            )
+            if resource == None:
+                return False
+
+            try:
+                download.downloadResource(
+                    download.getResourceUrl(self.getNoteStoreUrl(), resource.guid),
+                    self.authToken,
+                    filename,
+                    resource.data.bodyHash,
+                    resource.data.size,
+                )
+                return True
+            except (download.DownloadError, http.client.HTTPException) as e:
+                # socket errors are raised, the partial file is resumed later
+                logging.warning(
+                    "Streaming {} failed, fetching it whole: {}".format(filename, e)
+                )
+
         resource = self.getNoteStore().getResourceByHash(
             self.authToken, guid, mediaHash, True, False, False
         )
         if resource == None:
             return False
-        open(filename, "w").write(resource.data.body)
+        partial = download.getPartialPath(filename)
+        with open(partial, "wb") as f:
+            f.write(resource.data.body)
+        os.replace(partial, filename)
         return True
 
 
@@ -854,8 +1047,7 @@ class Tags(GeekNoteConnector):
 
 class Notebooks(GeekNoteConnector):
     def list(self, guid=None):
-        result = self.getEvernote().findNotebooks()
-        result_linked = self.getEvernote().findLinkedNotebooks()
+        result, result_linked = self.getEvernote().findAllNotebooks()
         out.printList(result, showGUID=guid)
 
         # also show linked notebooks for good measure
@@ -1084,9 +1276,9 @@ class Notes(GeekNoteConnector):
             out.failureMessage("Error: could not find specified Linked Notebook")
             return tools.exitErr()
 
-        sharedNoteStoreClient = THttpClient.THttpClient(my_shared_notebook.noteStoreUrl)
-        sharedNoteStoreProtocol = TBinaryProtocol.TBinaryProtocol(sharedNoteStoreClient)
-        sharedNoteStore = NoteStore.Client(sharedNoteStoreProtocol)
+        sharedNoteStore = transport.createClient(
+            NoteStore.Client, my_shared_notebook.noteStoreUrl
+        )
         sharedAuthResult = sharedNoteStore.authenticateToSharedNotebook(
             my_shared_notebook.shareKey, self.getEvernote().authToken
         )
@@ -1121,9 +1313,9 @@ class Notes(GeekNoteConnector):
             out.failureMessage("Error: could not find specified Linked Notebook")
             return tools.exitErr()
 
-        sharedNoteStoreClient = THttpClient.THttpClient(my_shared_notebook.noteStoreUrl)
-        sharedNoteStoreProtocol = TBinaryProtocol.TBinaryProtocol(sharedNoteStoreClient)
-        sharedNoteStore = NoteStore.Client(sharedNoteStoreProtocol)
+        sharedNoteStore = transport.createClient(
+            NoteStore.Client, my_shared_notebook.noteStoreUrl
+        )
         sharedAuthResult = sharedNoteStore.authenticateToSharedNotebook(
             my_shared_notebook.shareKey, self.getEvernote().authToken
         )
@@ -1217,11 +1409,7 @@ class Notes(GeekNoteConnector):
         if note:
             out.preloader.setMessage("Loading note...")
             self.getEvernote().loadNoteContent(note)
-            out.showNote(
-                note,
-                self.getEvernote().getUserInfo().id,
-                self.getEvernote().getUserInfo().shardId,
-            )
+            out.showNote(note, *self.getEvernote().getShardInfo())
 
         if not force and not out.confirm(
             "Are you sure you want to " 'delete this note: "%s"?' % note.title
@@ -1248,11 +1436,7 @@ class Notes(GeekNoteConnector):
         if raw:
             out.showNoteRaw(note)
         else:
-            out.showNote(
-                note,
-                self.getEvernote().getUserInfo().id,
-                self.getEvernote().getUserInfo().shardId,
-            )
+            out.showNote(note, *self.getEvernote().getShardInfo())
 
     def _parseInput(
         self,
@@ -2,13 +2,24 @@
 # -*- coding: utf-8 -*-
 
 import codecs
+import collections
+import functools
 import os
 import argparse
 import binascii
-import glob
+import tempfile
 import logging
 import re
 import hashlib
+import threading
+import time
+import unicodedata
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    as_completed,
+    wait,
+)
 import binascii
 import mimetypes
 
@@ -19,15 +30,15 @@ from bs4 import BeautifulSoup
 from . import config
 from .geeknote import GeekNote
 from .storage import Storage
+from .executor import GeekNoteExecutor, InlineExecutor, LinkedNotebookWorker
 from .editor import Editor
+from .journal import Journal
 from . import tools
-
-# for prototyping...
-# refactor should move code depending on these modules elsewhere
-import thrift.protocol.TBinaryProtocol as TBinaryProtocol
-import thrift.transport.THttpClient as THttpClient
-import urllib.parse
-import evernote.edam.notestore.NoteStore as NoteStore
+from . import transport
+from . import memo
+from . import ratelimit
+from . import scanner
+from . import watcher
 
 # set default logger (write log to file)
 def_logpath = os.path.join(config.APP_DIR, "gnsync.log")
@@ -42,15 +53,62 @@ logger.addHandler(handler)
 # http://en.wikipedia.org/wiki/Unicode_control_characters
 CONTROL_CHARS_RE = re.compile("[\x00-\x08\x0e-\x1f\x7f-\x9f]")
 
+# what the sync journal keeps of a note to write or read it again
+JOURNAL_NOTE_FIELDS = ("guid", "title", "updated", "updateSequenceNum")
+
 
 def remove_control_characters(s):
     return CONTROL_CHARS_RE.sub("", s)
 
 
+def normalize_title(title):
+    """
+    Key files and notes are matched by: NFC-normalized, stripped title
+    """
+    return unicodedata.normalize("NFC", title or "").strip()
+
+
+class TitleIndex(object):
+    """
+    Items indexed by normalized title. Items sharing a title
+    are kept newest first.
+    """
+
+    def __init__(self, items, title, updated):
+        self.index = collections.OrderedDict()
+        for item in items:
+            self.index.setdefault(normalize_title(title(item)), []).append(item)
+        for group in self.index.values():
+            if len(group) > 1:
+                group.sort(key=updated, reverse=True)
+
+    def __len__(self):
+        return len(self.index)
+
+    def get(self, title):
+        """ newest item titled title, None if there is none """
+        group = self.index.get(normalize_title(title))
+        return group[0] if group else None
+
+    def get_all(self, title):
+        return self.index.get(normalize_title(title), [])
+
+    def newest(self):
+        """ the newest item of every title """
+        return [group[0] for group in self.index.values()]
+
+    def duplicates(self):
+        """ (title, items) of titles shared by several items """
+        return [(key, group) for key, group in self.index.items() if len(group) > 1]
+
+
 def log(func):
     def wrapper(*args, **kwargs):
         try:
             return func(*args, **kwargs)
+        except tools.ExitException:
+            # an exit from a worker thread ends the run
+            raise
         except Exception as e:
             logger.exception("%s", str(e))
 
@@ -90,9 +148,193 @@ def all_notebooks(sleep_on_ratelimit=False):
     return [notebook.name for notebook in geeknote.findNotebooks()]
 
 
-def all_linked_notebooks():
-    geeknote = GeekNote()
-    return geeknote.findLinkedNotebooks()
+def split_masks(mask):
+    """
+    Masks from a comma separated string or a list of them,
+    "*.*" if there are none
+    """
+    if isinstance(mask, str):
+        mask = [mask]
+    masks = [m.strip() for value in mask or [] for m in value.split(",")]
+    return [m for m in masks if m] or ["*.*"]
+
+
+def get_file_content(path, format):
+    """
+    Get file content as ENML.
+    """
+    with codecs.open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+
+    # strip unprintable characters
+    content = content.encode("ascii", errors="xmlcharrefreplace").decode("ascii")
+    content = Editor.textToENML(content=content, raise_ex=True, format=format)
+
+    if content is None:
+        logger.warning("File {0}. Content must be " "an UTF-8 encode.".format(path))
+        return None
+
+    return content
+
+
+def parse_meta(content):
+    """
+    Parse jekyll metadata of note, eg:
+    ---
+    layout: post
+    title: draw uml with emacs
+    tags: [uml, emacs]
+    categories: [dev]
+    ---
+    and substitute meta from content.
+
+    Caution: meta data will only work in one way
+    mode! And I will never use two way mode, so
+    two way sync will need your additional work!
+    """
+    metaBlock = re.compile("---(.*?)---", re.DOTALL)
+    metaInfo = re.compile(r"(\w+):\s*?(.*)")
+    block = metaBlock.search(content)
+    if block is not None:
+        info = metaInfo.findall(block.group(0))
+        ret = dict(info)
+        ret["content"] = metaBlock.sub("", content)
+        return ret
+    else:
+        return {"content": content}
+
+
+def convert_file(path, format):
+    """
+    Metadata and ENML content of a file, runs in the conversion processes
+    returns None if the file could not be converted
+    """
+    content = get_file_content(path, format)
+    if content is None:
+        return None
+    return parse_meta(content)
+
+
+def convert_note(content, imageOptions):
+    """
+    Text of a note from its ENML, runs in the conversion processes
+    """
+    if imageOptions:
+        return Editor.ENMLtoText(content, imageOptions=imageOptions)
+    return Editor.ENMLtoText(content)
+
+
+def write_atomic(path, data, mtime=None):
+    """
+    Replace path with data, readers see either the old or the new file
+    """
+    directory, name = os.path.split(path)
+    fd, tmp = tempfile.mkstemp(prefix="." + name, suffix=".tmp", dir=directory or ".")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        if mtime is not None:
+            os.utime(tmp, (mtime, mtime))
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class Progress(object):
+    """
+    Logs how many of total items are done and how fast, at most
+    once a second
+    """
+
+    def __init__(self, total, action):
+        self.total = total
+        self.action = action
+        self.count = 0
+        self.start = self.reported = time.time()
+
+    def step(self):
+        self.count += 1
+        if time.time() - self.reported >= 1:
+            self.report()
+
+    def done(self):
+        if self.count:
+            self.report()
+
+    def report(self):
+        self.reported = time.time()
+        elapsed = max(self.reported - self.start, 1e-6)
+        logger.info(
+            "{0} {1}/{2} notes, {3:.1f} notes/s".format(
+                self.action, self.count, self.total, self.count / elapsed
+            )
+        )
+
+
+class SyncAction(object):
+    """
+    One step of a sync plan, method(*args) runs it
+    """
+
+    CREATE_NOTE = "create-note"
+    UPDATE_NOTE = "update-note"
+    CREATE_FILE = "create-file"
+    UPDATE_FILE = "update-file"
+    FETCH_IMAGE = "fetch-image"
+    RECORD_FILE = "record-file"
+
+    FILE_KINDS = (CREATE_FILE, UPDATE_FILE)
+
+    # local edits are pushed before notes are pulled, images come last
+    # as they are found in the fetched contents
+    ORDER = (
+        RECORD_FILE,
+        UPDATE_NOTE,
+        CREATE_NOTE,
+        UPDATE_FILE,
+        CREATE_FILE,
+        FETCH_IMAGE,
+    )
+
+    def __init__(self, kind, title, path, method, args=(), note=None):
+        self.kind = kind
+        self.title = title
+        self.path = path
+        self.method = method
+        self.args = args
+        # the note written or read, and the place in the journal
+        self.note = note
+        self.index = None
+
+    @property
+    def priority(self):
+        return SyncAction.ORDER.index(self.kind)
+
+    def __repr__(self):
+        return "<SyncAction('{0}','{1}')>".format(self.kind, self.title)
+
+
+def format_plan(actions, notebook=None):
+    """
+    Text of a sync plan, one line per transfer and the count of each kind
+    """
+    actions = [a for a in actions if a.kind != SyncAction.RECORD_FILE]
+    lines = []
+    if notebook:
+        lines.append('Notebook "{0}":'.format(notebook))
+    for action in actions:
+        lines.append(
+            "{0:<12} {1}  ({2})".format(action.kind, action.title, action.path)
+        )
+    counts = collections.Counter(a.kind for a in actions)
+    summary = ", ".join(
+        "{0} {1}".format(counts[kind], kind)
+        for kind in SyncAction.ORDER
+        if counts[kind]
+    )
+    lines.append(summary or "Nothing to sync")
+    return "\n".join(lines)
 
 
 class GNSync:
@@ -106,6 +348,17 @@ class GNSync:
     notebook_guid = None
     all_set = False
     sleep_on_ratelimit = False
+    unchanged = False
+    probe = None
+    jobs = 1
+    workers = None
+    masks = None
+    ignore = None
+    stack = None
+    geeknote = None
+    notebooks = None
+    stats = None
+    limits = None
 
     @log
     def __init__(
@@ -119,9 +372,21 @@ class GNSync:
         nodownsync=False,
         sleep_on_ratelimit=False,
         imageOptions={"saveImages": False, "imagesInSubdir": False},
+        jobs=1,
+        notebooks=None,
+        geeknote=None,
+        ignore=None,
+        stack=None,
     ):
+        self.stats = collections.Counter()
+        self.journal = None
+        self.records = {}
+        self.notebooks = notebooks
+        self.geeknote = geeknote
+
         # check auth
-        if not Storage().getUserToken():
+        self.storage = Storage()
+        if not self.storage.getUserToken():
             raise Exception("Auth error. There is not any oAuthToken.")
 
         # set path
@@ -133,11 +398,11 @@ class GNSync:
 
         self.path = path
 
-        # set mask
-        if not mask:
-            mask = "*.*"
-
-        self.mask = mask
+        # set masks
+        self.masks = split_masks(mask)
+        self.mask = ",".join(self.masks)
+        self.ignore = ignore if ignore is not None else scanner.IgnoreRules.load(path)
+        self.stack = stack
 
         # set format
         if not format:
@@ -156,19 +421,28 @@ class GNSync:
         self.download_only = download_only
         self.nodownsync = nodownsync
 
+        # set image options
+        self.imageOptions = imageOptions
+
+        self.sleep_on_ratelimit = sleep_on_ratelimit
+
+        self.jobs = max(1, jobs or 1)
+
         logger.info("Sync Start")
 
+        # nothing changed on either side since the last sync
+        self.unchanged = self._is_unchanged(notebook_name)
+        if self.unchanged:
+            self.notebook_name = notebook_name
+            self.all_set = True
+            return
+
         # set notebook
         self.notebook_guid, self.notebook_name = self._get_notebook(notebook_name, path)
 
-        # set image options
-        self.imageOptions = imageOptions
-
         # all is Ok
         self.all_set = True
 
-        self.sleep_on_ratelimit = sleep_on_ratelimit
-
     @log
     def sync(self):
         """
@@ -179,133 +453,876 @@ class GNSync:
         if not self.all_set:
             return
 
-        files = self._get_files()
+        if self.unchanged:
+            logger.info("Nothing changed since the last sync")
+            logger.info("Sync Complete")
+            return
+
+        self._sync(self._get_files())
+
+        # a run which left anything out is not complete
+        if self.probe and not (self.stats["failed"] or self.stats["skipped"]):
+            self.storage.setSyncRun(self._get_account(), *self.probe)
+
+        logger.info("Sync Complete")
+
+    @log
+    def plan(self):
+        """
+        What sync would do, without doing it
+        returns the list of SyncAction in the order they would run
+        """
+        if not self.all_set:
+            return None
+        if self.unchanged:
+            return []
+
+        manifest = (
+            self.storage.getManifest(self._get_account(), os.path.realpath(self.path))
+            or {}
+        )
+        return self._plan(self._get_files(), manifest)
+
+    def _sync(self, files, paths=None):
+        """
+        Sync files with the notes of the notebook. With paths only the
+        files touched at those paths are uploaded and nothing is downloaded.
+        """
+        directory = os.path.realpath(self.path)
+        manifest = self.storage.getManifest(self._get_account(), directory) or {}
+
+        # full syncs are journaled, one that was interrupted is resumed
+        journal = self._get_journal() if paths is None else None
+        actions = self._resume(journal, manifest) if journal is not None else None
+        resumed = actions is not None
+        if not resumed:
+            actions = self._plan(files, manifest, paths)
+            if journal is not None:
+                journal.begin(self._get_journal_entries(actions))
+        if paths is None:
+            self._log_projection(
+                len([a for a in actions if a.kind != SyncAction.RECORD_FILE])
+            )
+
+        self.journal = journal
+        try:
+            self._execute(actions)
+        finally:
+            self.journal = None
+            if journal is not None:
+                journal.close()
+            self._flush_records(directory)
+        if journal is not None:
+            if journal.isFinished():
+                journal.discard()
+            elif resumed:
+                # failed twice, the next sync plans them again
+                logger.warning("Some actions of the interrupted sync failed again")
+                journal.discard()
+            else:
+                logger.info("Actions failed, the next sync resumes them")
+
+        # forget files which are gone
+        keys = manifest if paths is None else [os.path.realpath(p) for p in paths]
+        for key in keys:
+            if key in manifest and not os.path.exists(key):
+                self.records[key] = None
+        self._flush_records(directory)
+
+        logger.info(
+            "Connections: %(requests)d requests, %(opened)d opened, "
+            "%(reused)d reused, %(reconnects)d reconnects",
+            transport.pool.getStats(),
+        )
+        logger.info(
+            "Lookups: %(hits)d memoized, %(coalesced)d coalesced, %(misses)d fetched",
+            memo.memo.getStats(),
+        )
+
+    def _plan(self, files, manifest, paths=None):
+        """
+        Compare files and the manifest with the notes of the notebook,
+        files which changed are converted to ENML on the way
+        returns the list of SyncAction, sorted by priority
+        """
         notes = self._get_notes()
 
+        notes_by_title = TitleIndex(notes, lambda n: n.title, lambda n: n.updated)
+        for title, duplicates in notes_by_title.duplicates():
+            logger.warning(
+                'There are {0} notes titled "{1}", only the most recently '
+                "updated one is synced".format(len(duplicates), title)
+            )
+        notes_by_guid = dict((n.guid, n) for n in notes)
+
+        actions = []
         if not self.download_only:
-            for f in files:
-                has_note = False
-                meta = self._parse_meta(self._get_file_content(f["path"]))
-                title = f["name"] if "title" not in meta else meta["title"].strip()
-                tags = (
-                    None
-                    if "tags" not in meta
-                    else meta["tags"].replace("[", "").replace("]", "").split(",")
+            actions.extend(
+                self._plan_uploads(files, notes_by_title, notes_by_guid, manifest)
+            )
+
+        if paths is None and (self.twoway or self.download_only):
+            actions.extend(self._plan_downloads(files, notes_by_title, manifest))
+
+        actions.sort(key=lambda a: a.priority)
+        return actions
+
+    def _get_journal(self):
+        """
+        Journal of the full syncs of the directory with these options
+        """
+        return Journal.forSync(
+            os.path.realpath(self.path),
+            self.notebook_guid,
+            self.mask,
+            self.format,
+            self.twoway,
+            self.download_only,
+        )
+
+    def _get_journal_entries(self, actions):
+        """
+        What the journal needs to run actions again without listing
+        the notebook, numbers the actions by their place in it
+        """
+        entries = []
+        for index, action in enumerate(actions):
+            action.index = index
+            entry = {"kind": action.kind, "title": action.title, "path": action.path}
+            if action.note is not None:
+                entry["note"] = dict(
+                    (name, getattr(action.note, name)) for name in JOURNAL_NOTE_FIELDS
                 )
-                tags = None if not tags else [x.strip() for x in tags]
-                meta["tags"] = tags
-                meta["title"] = title
-                note = None
-
-                if self.format == "html":
-                    meta["mtime"] = f["mtime"]
-                    note = self._html2note(meta)
-
-                for n in notes:
-                    if title == n.title:
-                        has_note = True
-                        if f["mtime"] > n.updated:
-                            if self.format == "html":
-                                gn = GeekNote(sleepOnRateLimit=self.sleep_on_ratelimit)
-                                note.guid = n.guid
-                                gn.getNoteStore().updateNote(gn.authToken, note)
-                                logger.info('Note "{0}" was updated'.format(note.title))
-                            else:
-                                self._update_note(f, n, title, meta["content"], tags)
-                            break
-
-                if not has_note:
-                    if self.format == "html":
-                        gn = GeekNote(sleepOnRateLimit=self.sleep_on_ratelimit)
-                        gn.getNoteStore().createNote(gn.authToken, note)
-                        logger.info('Note "{0}" was created'.format(note.title))
-                    else:
-                        self._create_note(f, title, meta["content"], tags)
-
-        if self.twoway or self.download_only:
-            for n in notes:
-                has_file = False
-                for f in files:
-                    if f["name"] == n.title:
-                        has_file = True
-                        if f["mtime"] < n.updated:
-                            self._update_file(f, n)
-                            break
-
-                if not self.nodownsync:
-                    if not has_file:
-                        self._create_file(n)
+            if action.kind == SyncAction.RECORD_FILE:
+                entry["record"] = action.method.keywords
+            entries.append(entry)
+        return entries
 
-        logger.info("Sync Complete")
+    def _resume(self, journal, manifest):
+        """
+        Actions an interrupted sync left, None if there was none.
+        Uploads are decided again against the journaled notes, a note
+        whose creation was sent but not recorded is looked up by title
+        """
+        loaded = journal.load()
+        if loaded is None:
+            return None
+        entries, started, done = loaded
+
+        actions = []
+        skipped = []
+        pending = collections.OrderedDict()
+        for index, entry in enumerate(entries):
+            if index in done:
+                continue
+            kind = entry["kind"]
+            note = Types.Note(**entry["note"]) if entry.get("note") else None
+            if kind == SyncAction.RECORD_FILE:
+                action = SyncAction(
+                    kind,
+                    entry["title"],
+                    entry["path"],
+                    functools.partial(self._record_file, **entry["record"]),
+                )
+            elif kind in SyncAction.FILE_KINDS:
+                file_note = None
+                if kind == SyncAction.UPDATE_FILE:
+                    file_note = {"path": entry["path"]}
+                action = self._get_file_action(note, file_note)
+            else:
+                f = self._get_file(entry["path"])
+                if f is None:
+                    skipped.append(index)
+                    continue
+                if kind == SyncAction.CREATE_NOTE and index in started:
+                    note = self._find_created_note(entry["title"])
+                pending[f["path"]] = (f, index, note)
+                continue
+            action.index = index
+            actions.append(action)
+
+        uploaded = set()
+        by_content = self._index_by_content(manifest)
+        for f, meta in self._convert_files([f for f, _, _ in pending.values()]):
+            _, index, note = pending[f["path"]]
+            notes = [note] if note is not None else []
+            action = self._plan_upload(
+                f,
+                meta,
+                manifest,
+                TitleIndex(notes, lambda n: n.title, lambda n: n.updated),
+                dict((n.guid, n) for n in notes),
+                uploaded,
+                by_content,
+            )
+            if action is None:
+                skipped.append(index)
+                continue
+            action.index = index
+            actions.append(action)
+
+        logger.info(
+            "Resuming an interrupted sync, {0} of {1} actions left".format(
+                len(entries) - len(done), len(entries)
+            )
+        )
+        journal.resume(set(range(len(entries))) - done)
+        for index in skipped:
+            journal.completed(index)
+        actions.sort(key=lambda a: a.priority)
+        return actions
 
     @log
-    def _parse_meta(self, content):
+    def _find_created_note(self, title):
+        """
+        Note titled title in the notebook, with its contentHash
+        """
+        gn = self._get_geeknote()
+        keywords = 'notebook:"{0}" intitle:"{1}"'.format(
+            tools.strip(self.notebook_name), title.replace('"', "")
+        )
+        result = gn.findNotes(keywords, EDAM_USER_NOTES_MAX)
+        for n in result.notes if result else []:
+            if normalize_title(n.title) == normalize_title(title):
+                return gn.getNote(n.guid)
+        return None
+
+    def watch(self, stop=None, interval=None, debounce=None):
+        """
+        Sync, then keep the notebook in sync until stop is set: changed
+        files are pushed as their writes settle and the notes are pulled
+        when the account update count moves
+        """
+        interval = config.WATCH_INTERVAL if interval is None else interval
+        debounce = config.WATCH_DEBOUNCE if debounce is None else debounce
+        stop = stop or threading.Event()
+        if not self.all_set:
+            return
+
+        state = self._get_geeknote().getSyncState()
+        update_count = state.updateCount if state else None
+        polled = time.time()
+        if self.unchanged:
+            # nothing to sync yet, the notebook is needed later on
+            self.notebook_guid, self.notebook_name = self._get_notebook(
+                self.notebook_name, self.path
+            )
+            self.unchanged = False
+        else:
+            self.sync()
+
+        logger.info('Watching "{0}"'.format(self.path))
+        with watcher.createWatcher(self.path) as events:
+            while not stop.is_set():
+                timeout = max(0, min(interval - (time.time() - polled), 1.0))
+                names = events.wait(timeout, debounce)
+                if names is None:
+                    logger.info("Changes were lost, syncing everything")
+                    self._sync(self._get_files())
+                elif names and not self.download_only:
+                    self._sync_paths(names)
+
+                if time.time() - polled < interval:
+                    continue
+                polled = time.time()
+                if not (self.twoway or self.download_only):
+                    continue
+                state = self._get_geeknote().getSyncState()
+                if state and state.updateCount != update_count:
+                    logger.info("Notes changed, syncing")
+                    self._sync(self._get_files())
+                    update_count = state.updateCount
+        logger.info("Watch Complete")
+
+    @log
+    def _sync_paths(self, names):
+        """
+        Upload the files of the sync directory with the given names
+        """
+        paths = [
+            os.path.join(self.path, name)
+            for name in sorted(names)
+            if scanner.matchesMasks(name, self.masks)
+            and not name.startswith(".")
+            and not self.ignore.isIgnored(name)
+        ]
+        if not paths:
+            return
+        files = [f for f in map(self._get_file, paths) if f is not None]
+        logger.info("{0} files changed".format(len(paths)))
+        self._sync(files, paths)
+
+    def _is_unchanged(self, notebook_name):
+        """
+        Cheap check before a sync: compare the account updateCount and
+        the fingerprint of the directory with the last completed sync
+        """
+        self.probe = None
+        state = self._get_geeknote().getSyncState()
+        if not state:
+            return False
+
+        path = os.path.realpath(self.path)
+        fingerprint = self._get_fingerprint(notebook_name)
+        self.probe = (path, state.updateCount, fingerprint)
+
+        last = self.storage.getSyncRun(self._get_account(), path)
+        return last == (state.updateCount, fingerprint)
+
+    def _get_fingerprint(self, notebook_name):
+        """
+        Hash of the sync options and of the names, sizes and
+        mtimes of the entries in the sync directory
+        """
+        fingerprint = hashlib.sha1()
+        options = (
+            notebook_name,
+            self.mask,
+            self.format,
+            self.twoway,
+            self.download_only,
+            self.nodownsync,
+            self.imageOptions.get("saveImages"),
+            self.imageOptions.get("imagesInSubdir"),
+        )
+        fingerprint.update(repr(options).encode("utf-8"))
+
+        entries = []
+        for entry in os.scandir(self.path):
+            stat = entry.stat()
+            entries.append((entry.name, stat.st_size, stat.st_mtime_ns))
+        for entry in sorted(entries):
+            fingerprint.update(repr(entry).encode("utf-8"))
+
+        return fingerprint.hexdigest()
+
+    def _log_projection(self, requests):
+        """
+        Report when the sync should be done if requests are rate limited
+        """
+        finish = ratelimit.limiter.projectCompletion(requests)
+        if finish:
+            logger.info(
+                "Rate limited to %.1f requests/min, up to %d requests "
+                "projected to finish at %s",
+                ratelimit.limiter.getStats()["rate"],
+                requests,
+                time.strftime("%H:%M:%S", time.localtime(finish)),
+            )
+
+    def _plan_uploads(self, files, notes_by_title, notes_by_guid, manifest):
+        """
+        Actions for the files which changed since the last sync, the
+        newest of several files with the same title wins. With more than
+        one job files are converted to ENML by a pool of processes
+        """
+        titled = []
+        pending = []
+        actions = []
+        for f in sorted(files, key=lambda f: f["mtime"], reverse=True):
+            entry = manifest.get(f["key"])
+            if self._is_file_synced(f, entry, notes_by_guid):
+                titled.append((f, entry["title"], None))
+                if (entry["size"], entry["mtime"]) != (f["size"], f["mtime"]):
+                    # touched, the same content is on the server
+                    record = {
+                        "path": f["path"],
+                        "guid": entry["guid"],
+                        "usn": entry["usn"],
+                        "upload_hash": entry["upload_hash"],
+                        "title": entry["title"],
+                        "content_hash": f.get("content_hash"),
+                    }
+                    actions.append(self._get_upload_record(entry["title"], record))
+            else:
+                pending.append(f)
+
+        # the titles of changed files are known once they are converted,
+        # then synced and changed files claim their titles newest first
+        for f, meta in self._convert_files(pending):
+            titled.append((f, self._get_title(f, meta), meta))
+        titled.sort(key=lambda t: t[0]["mtime"], reverse=True)
+
+        uploaded = set()
+        by_content = self._index_by_content(manifest)
+        for f, title, meta in titled:
+            if meta is None:
+                uploaded.add(normalize_title(title))
+                continue
+            action = self._plan_upload(
+                f, meta, manifest, notes_by_title, notes_by_guid, uploaded, by_content
+            )
+            if action is not None:
+                actions.append(action)
+        return actions
+
+    def _get_title(self, f, meta):
+        """ Title of the note of a converted file """
+        return f["name"] if "title" not in meta else meta["title"].strip()
+
+    def _convert_files(self, files):
+        """
+        Convert files to ENML, with more than one job in a pool of
+        processes
+        yields (file, metadata) of the files which were converted
         """
-        Parse jekyll metadata of note, eg:
-        ---
-        layout: post
-        title: draw uml with emacs
-        tags: [uml, emacs]
-        categories: [dev]
-        ---
-        and substitute meta from content.
-
-        Caution: meta data will only work in one way
-        mode! And I will never use two way mode, so
-        two way sync will need your additional work!
-        """
-        metaBlock = re.compile("---(.*?)---", re.DOTALL)
-        metaInfo = re.compile("(\w+):\s*?(.*)")
-        block = metaBlock.search(content)
-        if block is not None:
-            info = metaInfo.findall(block.group(0))
-            ret = dict(info)
-            ret["content"] = metaBlock.sub("", content)
-            return ret
+        converter = self._start_converter(len(files))
+        try:
+            converted = [
+                converter.submit(convert_file, f["path"], self.format) for f in files
+            ]
+            for f, future in zip(files, converted):
+                try:
+                    meta = future.result()
+                except tools.ExitException:
+                    raise
+                except Exception as e:
+                    logger.exception("%s", str(e))
+                    meta = None
+                if meta is None:
+                    logger.warning('File "{0}" was not converted'.format(f["path"]))
+                    self.stats["failed"] += 1
+                    continue
+                yield f, meta
+        finally:
+            converter.shutdown()
+
+    def _plan_upload(
+        self, f, meta, manifest, notes_by_title, notes_by_guid, uploaded, by_content
+    ):
+        """
+        Decide how a converted file is uploaded, by_content is the
+        manifest indexed by _index_by_content
+        returns a SyncAction or None
+        """
+        entry = manifest.get(f["key"])
+        title = self._get_title(f, meta)
+        tags = (
+            None
+            if "tags" not in meta
+            else meta["tags"].replace("[", "").replace("]", "").split(",")
+        )
+        tags = None if not tags else [x.strip() for x in tags]
+        meta["tags"] = tags
+        meta["title"] = title
+        note = None
+
+        key = normalize_title(title)
+        if key in uploaded:
+            logger.warning(
+                'File "{0}" has the same title as a newer file, '
+                "skipped".format(f["path"])
+            )
+            self.stats["skipped"] += 1
+            return None
+        uploaded.add(key)
+
+        if self.format == "html":
+            meta["mtime"] = f["mtime"]
+            converted = self._html2note(meta)
+            if converted is None:
+                self.stats["failed"] += 1
+                return None
+            note, paths = converted
+            upload_hash = self._get_upload_hash(
+                title, tags, note.content, note.resources
+            )
         else:
-            return {"content": content}
+            upload_hash = self._get_upload_hash(title, tags, meta["content"])
+
+        record = {
+            "path": f["path"],
+            "guid": None,
+            "usn": None,
+            "upload_hash": upload_hash,
+            "title": title,
+            "content_hash": f.get("content_hash") or self._get_file_hash(f["path"]),
+        }
+
+        n = notes_by_title.get(title)
+        renamed = False
+        if n is None:
+            n = self._get_renamed_note(
+                record["content_hash"], by_content, notes_by_guid
+            )
+            renamed = n is not None
+
+        if n is None:
+            if self.format == "html":
+                write = self._write_html_note, (note, paths)
+            else:
+                write = self._create_note, (f, title, meta["content"], tags)
+            return SyncAction(
+                SyncAction.CREATE_NOTE, title, f["path"], self._write, (record,) + write
+            )
+
+        record["guid"] = n.guid
+        content = note.content if self.format == "html" else meta["content"]
+        if not renamed:
+            recorded = entry is not None and entry["guid"] == n.guid
+            if recorded and entry["upload_hash"] == upload_hash:
+                logger.info('Note "{0}" is up to date'.format(title))
+                record["usn"] = entry["usn"]
+                return self._get_upload_record(title, record)
+            if self._is_same_content(n, content):
+                logger.info('Note "{0}" has the content of the file'.format(title))
+                record["usn"] = n.updateSequenceNum
+                return self._get_upload_record(title, record)
+            if not self._is_file_newer(f, n, entry):
+                # the note wins, it is downloaded with --two-way
+                return None
+
+        if self.format == "html":
+            write = self._write_html_note, (note, paths, n.guid)
+        else:
+            write = self._update_note, (f, n, title, meta["content"], tags)
+        return SyncAction(
+            SyncAction.UPDATE_NOTE,
+            title,
+            f["path"],
+            self._write,
+            (record,) + write,
+            note=n,
+        )
+
+    def _get_upload_record(self, title, record):
+        """ Action recording a file whose note needs no upload """
+        return SyncAction(
+            SyncAction.RECORD_FILE,
+            title,
+            record["path"],
+            functools.partial(self._record_file, **record),
+        )
+
+    def _plan_downloads(self, files, notes_by_title, manifest):
+        """
+        Actions for the notes which are newer than their files
+        or have none
+        """
+        files_by_name = TitleIndex(files, lambda f: f["name"], lambda f: f["mtime"])
+        actions = []
+        for n in notes_by_title.newest():
+            has_file = False
+            for f in files_by_name.get_all(n.title):
+                has_file = True
+                if self._is_note_newer(f, n, manifest.get(f["key"])):
+                    actions.append(self._get_file_action(n, f))
+                    break
+
+            if not self.nodownsync:
+                if not has_file:
+                    actions.append(self._get_file_action(n, None))
+        return actions
+
+    def _start_converter(self, count):
+        """
+        The conversion processes for count items,
+        or an inline executor if they are not worth it
+        """
+        if self.jobs < 2 or count < 2:
+            return InlineExecutor()
+
+        converter = ProcessPoolExecutor(min(self.jobs, count))
+        converter.submit(os.getpid).result()
+        return converter
+
+    def _start_pools(self, count):
+        """
+        Start the conversion processes and the NoteStore threads for
+        count items, processes are forked before any thread starts
+        returns the executor of conversions
+        """
+        converter = self._start_converter(count)
+        if isinstance(converter, InlineExecutor):
+            return converter
+
+        self.workers = GeekNoteExecutor(self._get_geeknote(), self.jobs)
+        self.limits = dict(
+            (kind, threading.BoundedSemaphore(jobs))
+            for kind, jobs in config.GNSYNC_ACTION_JOBS.items()
+            if jobs < self.jobs
+        )
+        return converter
+
+    def _stop_pools(self, converter):
+        converter.shutdown()
+        if self.workers is not None:
+            self.workers.shutdown()
+            self.workers = None
+        self.limits = None
+
+    def _submit(self, action):
+        """
+        Run action in the NoteStore threads, or at once without them
+        returns a Future
+        """
+        if self.workers is None:
+            return InlineExecutor().submit(self._run, action)
+        limit = (self.limits or {}).get(action.kind)
+        if limit is None:
+            return self.workers.submitCall(self._run, action)
+        return self.workers.submitCall(self._run_limited, limit, action)
+
+    def _run_limited(self, limit, action):
+        with limit:
+            return self._run(action)
+
+    def _run(self, action):
+        if self.journal is not None and action.index is not None:
+            if action.kind == SyncAction.CREATE_NOTE:
+                # sent but not recorded, it is looked up before a resume
+                self.journal.started(action.index)
+        return action.method(*action.args)
+
+    def _complete(self, action):
+        """ Journal that action is done """
+        if self.journal is not None and action.index is not None:
+            self.journal.completed(action.index)
+
+    def _write(self, record, method, args):
+        """
+        Write a note
+        returns the manifest record of the file or None if it failed
+        """
+        result = method(*args)
+        if not result:
+            return None
+        if isinstance(result, Types.Note):
+            record["guid"] = result.guid
+            record["usn"] = result.updateSequenceNum
+        return record
+
+    def _get_geeknote(self):
+        """
+        GeekNote of the current thread, NoteStore threads have their own
+        """
+        if self.workers is not None:
+            return self.workers.getWorker()
+        if self.geeknote is not None:
+            return self.geeknote
+        return GeekNote(sleepOnRateLimit=self.sleep_on_ratelimit)
+
+    @log
+    def _write_html_note(self, note, paths, guid=None):
+        """
+        Creates or updates note from html file, bodies are only sent
+        for the resources the note does not have yet
+        """
+        gn = self._get_geeknote()
+        stored = {}
+        if guid:
+            current = gn.getNoteStore().getNote(
+                gn.authToken, guid, False, False, False, False
+            )
+            for resource in current.resources or []:
+                stored[resource.data.bodyHash] = resource
+
+        for resource in note.resources:
+            known = stored.get(resource.data.bodyHash)
+            if known is not None:
+                resource.guid = known.guid
+            else:
+                with open(paths[resource.data.bodyHash], "rb") as f:
+                    resource.data.body = f.read()
+                resource.data.size = len(resource.data.body)
+
+        if guid:
+            note.guid = guid
+            result = gn.getNoteStore().updateNote(gn.authToken, note)
+            logger.info('Note "{0}" was updated'.format(note.title))
+        else:
+            result = gn.getNoteStore().createNote(gn.authToken, note)
+            logger.info('Note "{0}" was created'.format(note.title))
+        return result
+
+    def _is_file_synced(self, file_note, entry, notes_by_guid):
+        """
+        The file has the content it had when it was last uploaded or
+        downloaded and its note is still there
+        """
+        return (
+            entry is not None
+            and entry["guid"] in notes_by_guid
+            and not self._is_file_changed(file_note, entry)
+        )
+
+    def _is_file_changed(self, file_note, entry):
+        """
+        The content of the file differs from when it was last synced,
+        it is only hashed if its size or mtime moved
+        """
+        if entry is None:
+            return True
+        if entry["size"] == file_note["size"] and entry["mtime"] == file_note["mtime"]:
+            return False
+        if "content_hash" not in file_note:
+            file_note["content_hash"] = self._get_file_hash(file_note["path"])
+        return file_note["content_hash"] != entry["content_hash"]
+
+    def _is_note_changed(self, note, entry):
+        """
+        The note was written on the server since its file was last synced
+        """
+        if entry is None or entry["guid"] != note.guid or entry["usn"] is None:
+            return True
+        return note.updateSequenceNum != entry["usn"]
+
+    def _is_file_newer(self, file_note, note, entry):
+        """
+        The changed file is uploaded over note: unless the note changed
+        too, then the later of both wins
+        """
+        if not self._is_note_changed(note, entry):
+            return True
+        return file_note["mtime"] > note.updated
+
+    def _is_note_newer(self, file_note, note, entry):
+        """
+        The changed note is downloaded over the file: unless the file
+        changed too, then the later of both wins
+        """
+        if not self._is_note_changed(note, entry):
+            return False
+        if entry is not None and entry["guid"] == note.guid:
+            if not self._is_file_changed(file_note, entry):
+                return True
+        return file_note["mtime"] < note.updated
+
+    def _is_same_content(self, note, content):
+        """
+        The note has content, known when the listing carries contentHash
+        """
+        content_hash = getattr(note, "contentHash", None)
+        if not content_hash or content is None:
+            return False
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        return hashlib.md5(content).digest() == content_hash
+
+    def _index_by_content(self, manifest):
+        """
+        (path, entry) of the manifest by content hash
+        """
+        by_content = collections.defaultdict(list)
+        for key, entry in manifest.items():
+            by_content[entry["content_hash"]].append((key, entry))
+        return by_content
+
+    def _get_renamed_note(self, content_hash, by_content, notes_by_guid):
+        """
+        Note of a file which is gone and had the same content,
+        the file was renamed
+        """
+        for key, entry in by_content.get(content_hash, ()):
+            if entry["guid"] in notes_by_guid and not os.path.exists(key):
+                logger.info('File "{0}" was renamed'.format(key))
+                return notes_by_guid[entry["guid"]]
+        return None
+
+    def _get_file_hash(self, path):
+        md5 = hashlib.md5()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(65536), b""):
+                md5.update(block)
+        return md5.hexdigest()
+
+    def _get_upload_hash(self, title, tags, content, resources=None):
+        """
+        Hash of what is uploaded for a file
+        """
+        md5 = hashlib.md5()
+        md5.update(repr((title, tags)).encode("utf-8"))
+        md5.update((content or "").encode("utf-8"))
+        for resource in resources or []:
+            md5.update(resource.data.bodyHash)
+        return md5.hexdigest()
+
+    def _record_file(self, path, guid, usn, upload_hash, title, content_hash=None):
+        """
+        Remember the state of a synced file in the manifest,
+        it is written by _flush_records
+        """
+        stat = os.stat(path)
+        self.records[os.path.realpath(path)] = {
+            "size": stat.st_size,
+            "mtime": int(stat.st_mtime * 1000),
+            "content_hash": content_hash or self._get_file_hash(path),
+            "guid": guid,
+            "usn": usn,
+            "upload_hash": upload_hash,
+            "title": title,
+        }
+
+    def _flush_records(self, directory):
+        """
+        Write the manifest entries of the run in one commit
+        """
+        if self.records:
+            records, self.records = self.records, {}
+            self.storage.setManifestEntries(self._get_account(), directory, records)
+
+    @log
+    def _parse_meta(self, content):
+        """
+        Parse jekyll metadata of note, see parse_meta
+        """
+        return parse_meta(content)
 
     @log
     def _html2note(self, meta):
         """
-        parse html to note
-        TODO: check if evernote need upload media evertime when update
+        parse html to note, resources are described by their hash and
+        read later by _write_html_note if the service needs them
+        returns (note, dict of resource hash : path)
         """
         note = Types.Note()
         note.title = meta["title"].strip() if "title" in meta else None
         note.tagNames = meta["tags"]
         note.created = meta["mtime"]
         note.resources = []
+        paths = {}
         soup = BeautifulSoup(meta["content"], "html.parser")
         for tag in soup.findAll("img"):  # image support is enough
             if "src" in tag.attrs and len(tag.attrs["src"]) > 0:
-                img = None
-                with open(tag.attrs["src"], "rb") as f:
-                    img = f.read()
-                md5 = hashlib.md5()
-                md5.update(img)
-                hash = md5.digest()
-                hexHash = binascii.hexlify(hash)
-                mime = mimetypes.guess_type(tag["src"])[0]
+                path = os.path.abspath(tag.attrs["src"])
+                hexHash, mime = self._get_resource_hash(path)
+                hash = binascii.unhexlify(hexHash)
+
+                tag.name = "en-media"
+                tag.attrs["type"] = mime
+                tag.attrs["hash"] = hexHash
+                tag.attrs.pop("src", None)
+
+                if hash in paths:
+                    continue
+                paths[hash] = path
 
                 data = Types.Data()
-                data.size = len(img)
+                data.size = os.path.getsize(path)
                 data.bodyHash = hash
-                data.body = img
 
                 resource = Types.Resource()
                 resource.mime = mime
                 resource.data = data
 
-                tag.name = "en-media"
-                tag.attrs["type"] = mime
-                tag.attrs["hash"] = hexHash
-                tag.attrs.pop("src", None)
-
                 note.resources.append(resource)
         note.notebookGuid = self.notebook_guid
         note.content = str(soup)
-        return note
+        return note, paths
+
+    def _get_resource_hash(self, path):
+        """
+        MD5 and mime type of a resource file, it is hashed again
+        only when its size or mtime changed
+        returns (hex md5, mime)
+        """
+        stat = os.stat(path)
+        cached = self.storage.getResourceHash(path, stat.st_size, stat.st_mtime_ns)
+        if cached:
+            return cached
+        result = (self._get_file_hash(path), mimetypes.guess_type(path)[0])
+        self.storage.setResourceHash(path, stat.st_size, stat.st_mtime_ns, *result)
+        return result
 
     @log
     def _update_note(self, file_note, note, title=None, content=None, tags=None):
@@ -318,7 +1335,7 @@ class GNSync:
         except AttributeError:
             tags = None
 
-        result = GeekNote(sleepOnRateLimit=self.sleep_on_ratelimit).updateNote(
+        result = self._get_geeknote().updateNote(
             guid=note.guid,
             title=title or note.title,
             content=content or self._get_file_content(file_note["path"]),
@@ -338,11 +1355,8 @@ class GNSync:
         """
         Updates file from note
         """
-        GeekNote(sleepOnRateLimit=self.sleep_on_ratelimit).loadNoteContent(note)
-        content = Editor.ENMLtoText(note.content)
-        open(file_note["path"], "w").write(content)
-        updated_seconds = note.updated / 1000.0
-        os.utime(file_note["path"], (updated_seconds, updated_seconds))
+        self._execute([self._get_file_action(note, file_note)])
+        self._flush_records(os.path.realpath(self.path))
 
     @log
     def _create_note(self, file_note, title=None, content=None, tags=None):
@@ -355,7 +1369,7 @@ class GNSync:
         if content is None:
             return
 
-        result = GeekNote(sleepOnRateLimit=self.sleep_on_ratelimit).createNote(
+        result = self._get_geeknote().createNote(
             title=title or file_note["name"],
             content=content,
             notebook=self.notebook_guid,
@@ -377,67 +1391,272 @@ class GNSync:
         """
         Creates file from note
         """
-        GeekNote(sleepOnRateLimit=self.sleep_on_ratelimit).loadNoteContent(note)
+        self._execute([self._get_file_action(note, None)])
+        self._flush_records(os.path.realpath(self.path))
+        return True
 
-        escaped_title = re.sub(os.sep, "-", note.title)
+    def _execute(self, actions):
+        """
+        Run the actions of a plan in their order. With more than one job
+        notes are written and contents and images are fetched by a pool
+        of threads, at most config.GNSYNC_ACTION_JOBS of a kind at once,
+        and ENML is converted by a pool of processes. The images of a
+        note are queued as its content arrives. Files are replaced
+        atomically and the throughput is logged as actions finish
+        """
+        for action in actions:
+            if action.kind == SyncAction.RECORD_FILE:
+                action.method(*action.args)
+                self._complete(action)
+        actions = [a for a in actions if a.kind != SyncAction.RECORD_FILE]
+        if not actions:
+            return
 
-        # Save images
-        if "saveImages" in self.imageOptions and self.imageOptions["saveImages"]:
-            imageList = Editor.getImages(note.content)
-            if imageList:
-                if (
-                    "imagesInSubdir" in self.imageOptions
-                    and self.imageOptions["imagesInSubdir"]
-                ):
+        images = {}
+        if self.imageOptions.get("saveImages"):
+            images = self.storage.getResourceHashes(os.path.abspath(self.path)) or {}
+
+        converter = self._start_pools(len(actions))
+        exit = None
+        try:
+            running = {}
+            for action in actions:
+                future = self._submit(action)
+                running[future] = (action, None)
+                if self._is_exit(future):
+                    # with one job the actions run as they are submitted
+                    break
+            progress = Progress(len(actions), "Synced")
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    action, image_options = running.pop(future)
+                    if future.cancelled():
+                        continue
                     try:
-                        os.mkdir(os.path.join(self.path, escaped_title + "_images"))
-                    except OSError:
-                        # Folder already exists
-                        pass
-                    imagePath = os.path.join(
-                        self.path, escaped_title + "_images", escaped_title
-                    )
-                    self.imageOptions["baseFilename"] = (
-                        escaped_title + "_images/" + escaped_title
-                    )
-                else:
-                    imagePath = os.path.join(self.path, escaped_title)
-                    self.imageOptions["baseFilename"] = escaped_title
-                for imageInfo in imageList:
-                    filename = "{}-{}.{}".format(
-                        imagePath, imageInfo["hash"], imageInfo["extension"]
-                    )
-                    logger.info("Saving image to {}".format(filename))
-                    binaryHash = binascii.unhexlify(imageInfo["hash"])
-                    if not GeekNote(sleepOnRateLimit=self.sleep_on_ratelimit).saveMedia(
-                        note.guid, binaryHash, filename
-                    ):
-                        logger.warning("Failed to save image {}".format(filename))
-
-        content = Editor.ENMLtoText(note.content, self.imageOptions)
-        path = os.path.join(self.path, escaped_title + self.extension)
-        open(path, "w").write(content)
-        updated_seconds = note.updated / 1000.0
-        os.utime(path, (updated_seconds, updated_seconds))
+                        result = future.result()
+                    except tools.ExitException as e:
+                        # rate limited or failed for good: actions which
+                        # did not start are dropped, what the server did
+                        # is still recorded before the exit is raised
+                        if exit is None:
+                            exit = e
+                            for pending in running:
+                                pending.cancel()
+                        continue
+                    except Exception as e:
+                        logger.exception("%s", str(e))
+                        result = None
+
+                    if action.kind == SyncAction.FETCH_IMAGE:
+                        self._index_image(result)
+                    elif exit is not None and action.kind in SyncAction.FILE_KINDS:
+                        # downloads are left to the next run, with their images
+                        continue
+                    elif image_options is not None:
+                        # content converted to text
+                        if self._write_file(action, result):
+                            self._complete(action)
+                            progress.step()
+                    elif action.kind in SyncAction.FILE_KINDS:
+                        if not result:
+                            self.stats["failed"] += 1
+                            continue
+                        content, image_options, found = result
+                        conversion = converter.submit(
+                            convert_note, content, image_options
+                        )
+                        running[conversion] = (action, image_options)
+                        for image in self._get_image_actions(action, found, images):
+                            running[self._submit(image)] = (image, None)
+                    elif result:
+                        self._record_file(**result)
+                        self._complete(action)
+                        self.stats["uploaded"] += 1
+                        progress.step()
+                    else:
+                        self.stats["failed"] += 1
+            progress.done()
+        finally:
+            self._stop_pools(converter)
+        if exit is not None:
+            raise exit
+
+    def _is_exit(self, future):
+        """ True if the action of future ended the run """
+        return (
+            future.done()
+            and not future.cancelled()
+            and isinstance(future.exception(), tools.ExitException)
+        )
+
+    def _write_file(self, action, content):
+        """
+        Write the text of a downloaded note
+        returns True if it was written
+        """
+        if content is None:
+            self.stats["failed"] += 1
+            return False
+        note = action.args[0]
+        data = content.encode("utf-8")
+        content_hash = hashlib.md5(data).hexdigest()
+        if os.path.exists(action.path) and (
+            self._get_file_hash(action.path) == content_hash
+        ):
+            logger.info('File "{0}" is up to date'.format(action.path))
+        else:
+            write_atomic(action.path, data, note.updated / 1000.0)
+            logger.info('File "{0}" was written'.format(action.path))
+        self._record_file(
+            action.path,
+            note.guid,
+            note.updateSequenceNum,
+            None,
+            note.title,
+            content_hash,
+        )
+        self.stats["downloaded"] += 1
         return True
 
+    def _get_file_action(self, note, file_note):
+        """
+        Action writing note to file_note, or to a new file if it is None
+        """
+        if file_note is None:
+            path, image_options, image_path = self._get_new_file(note)
+            kind = SyncAction.CREATE_FILE
+        else:
+            path, image_options, image_path = file_note["path"], {}, None
+            kind = SyncAction.UPDATE_FILE
+        return SyncAction(
+            kind,
+            note.title,
+            path,
+            self._fetch_note,
+            (note, image_options, image_path),
+            note=note,
+        )
+
+    def _get_new_file(self, note):
+        """
+        Path of a new file for note and where its images go
+        returns (path, image options, image path)
+        """
+        escaped_title = re.sub(os.sep, "-", note.title)
+        path = os.path.join(self.path, escaped_title + self.extension)
+        if not self.imageOptions.get("saveImages"):
+            return path, {}, None
+
+        image_options = dict(self.imageOptions)
+        if self.imageOptions.get("imagesInSubdir"):
+            image_path = os.path.join(
+                self.path, escaped_title + "_images", escaped_title
+            )
+            image_options["baseFilename"] = escaped_title + "_images/" + escaped_title
+        else:
+            image_path = os.path.join(self.path, escaped_title)
+            image_options["baseFilename"] = escaped_title
+        return path, image_options, image_path
+
     @log
-    def _get_file_content(self, path):
+    def _fetch_note(self, note, image_options, image_path):
         """
-        Get file content.
+        Get the content of note and find its images
+        returns (content, image options, list of (image file, hash))
         """
-        with codecs.open(path, "r", encoding="utf-8") as f:
-            content = f.read()
+        content = self._get_geeknote().getNoteContent(note.guid)
+
+        found = []
+        if image_path is not None:
+            for imageInfo in Editor.getImages(content) or []:
+                filename = os.path.abspath(
+                    "{}-{}.{}".format(
+                        image_path, imageInfo["hash"], imageInfo["extension"]
+                    )
+                )
+                found.append((filename, imageInfo["hash"]))
 
-        # strip unprintable characters
-        content = content.encode("ascii", errors="xmlcharrefreplace")
-        content = Editor.textToENML(content=content, raise_ex=True, format=self.format)
+        return content, image_options, found
 
-        if content is None:
-            logger.warning("File {0}. Content must be " "an UTF-8 encode.".format(path))
+    def _get_image_actions(self, action, found, images):
+        """
+        Actions saving the images found in the content of a note
+        """
+        note = action.args[0]
+        return [
+            SyncAction(
+                SyncAction.FETCH_IMAGE,
+                note.title,
+                filename,
+                self._save_image,
+                (note, filename, hexHash, images),
+            )
+            for filename, hexHash in found
+        ]
+
+    @log
+    def _save_image(self, note, filename, hexHash, images):
+        """
+        Save an image of note, unless it was saved with the same hash.
+        images is the index of saved images, see Storage.getResourceHashes
+        returns (image file, hash, mime) to index or None
+        """
+        mime = "image/" + filename.rsplit(".", 1)[-1]
+        indexed = self._is_image_saved(filename, hexHash, images)
+        if indexed is not None:
+            logger.debug("Image {} is up to date".format(filename))
+            return None if indexed else (filename, hexHash, mime)
+
+        logger.info("Saving image to {}".format(filename))
+        directory = os.path.dirname(filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        if not self._get_geeknote().saveMedia(
+            note.guid, binascii.unhexlify(hexHash), filename
+        ):
+            logger.warning("Failed to save image {}".format(filename))
+            return None
+        return filename, hexHash, mime
+
+    def _index_image(self, saved):
+        """
+        Remember the hash of a saved image, see _save_image
+        """
+        if saved:
+            filename, hexHash, mime = saved
+            stat = os.stat(filename)
+            self.storage.setResourceHash(
+                filename, stat.st_size, stat.st_mtime_ns, hexHash, mime
+            )
+
+    def _is_image_saved(self, filename, hexHash, images):
+        """
+        Whether filename holds the image with hexHash
+        returns True if the index says so, False if the file had to be
+        hashed to know it and None if it does not hold the image
+        """
+        try:
+            stat = os.stat(filename)
+        except OSError:
             return None
+        known = images.get(filename)
+        if known is not None and tuple(known[:3]) == (
+            stat.st_size,
+            stat.st_mtime_ns,
+            hexHash,
+        ):
+            return True
+        if self._get_file_hash(filename) == hexHash:
+            return False
+        return None
 
-        return content
+    @log
+    def _get_file_content(self, path):
+        """
+        Get file content.
+        """
+        return get_file_content(path, self.format)
 
     @log
     def _get_notebook(self, notebook_name, path):
@@ -445,7 +1664,9 @@ class GNSync:
         Get notebook guid and name.
         Takes default notebook if notebook's name does not select.
         """
-        notebooks = GeekNote(sleepOnRateLimit=self.sleep_on_ratelimit).findNotebooks()
+        notebooks = self.notebooks
+        if notebooks is None:
+            notebooks = self._get_geeknote().findNotebooks()
 
         if not notebook_name:
             notebook_name = os.path.basename(os.path.realpath(path))
@@ -456,9 +1677,7 @@ class GNSync:
             guid = notebook[0].guid
 
         if not guid:
-            notebook = GeekNote(
-                sleepOnRateLimit=self.sleep_on_ratelimit
-            ).createNotebook(notebook_name)
+            notebook = self._get_geeknote().createNotebook(notebook_name, self.stack)
 
             if notebook:
                 logger.info('Notebook "{0}" was' " created".format(notebook_name))
@@ -474,37 +1693,347 @@ class GNSync:
     @log
     def _get_files(self):
         """
-        Get files by self.mask from self.path dir.
+        Get files by self.masks from self.path dir.
         """
-
-        file_paths = glob.glob(os.path.join(self.path, self.mask))
-
+        directory = os.path.realpath(self.path)
         files = []
-        for f in file_paths:
-            if os.path.isfile(f):
-                file_name = os.path.basename(f)
-                file_name = os.path.splitext(file_name)[0]
-
-                mtime = int(os.path.getmtime(f) * 1000)
-
-                files.append({"path": f, "name": file_name, "mtime": mtime})
+        for entry in scanner.scanFiles(self.path, self.masks, self.ignore):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            files.append(
+                self._get_file(entry.path, stat, os.path.join(directory, entry.name))
+            )
 
         return files
 
+    def _get_file(self, path, stat=None, key=None):
+        """
+        Get a file of the sync directory, None if it is not a file.
+        """
+        if stat is None:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+            if not os.path.isfile(path):
+                return None
+
+        file_name = os.path.basename(path)
+        file_name = os.path.splitext(file_name)[0]
+
+        return {
+            "path": path,
+            "key": key or os.path.realpath(path),
+            "name": file_name,
+            "mtime": int(stat.st_mtime * 1000),
+            "size": stat.st_size,
+        }
+
     @log
     def _get_notes(self):
         """
         Get notes from evernote.
+        When the notebook was synced before, only the notes changed
+        since then are fetched and merged into the stored ones.
         """
-        keywords = 'notebook:"{0}"'.format(
-            tools.strip(self.notebook_name.encode("utf-8"))
+        gn = self._get_geeknote()
+        account = self._get_account()
+        state = gn.getSyncState()
+        stored = self.storage.getNotebookSync(account, self.notebook_guid)
+
+        notes = None
+        updateCount = state.updateCount if state else None
+        if state and stored:
+            stored_count, stored_notes, timestamp = stored
+            synced = int(time.mktime(timestamp.timetuple()) * 1000)
+            if stored_count > state.updateCount or state.fullSyncBefore > synced:
+                logger.info("Stored notes are stale, listing the notebook")
+            elif stored_count == state.updateCount:
+                notes = stored_notes
+            else:
+                result = self._get_changed_notes(gn, stored_count, stored_notes)
+                if result:
+                    notes, updateCount = result
+
+        if notes is None:
+            keywords = 'notebook:"{0}"'.format(tools.strip(self.notebook_name))
+            found = gn.findNotes(keywords, EDAM_USER_NOTES_MAX).notes
+            notes = collections.OrderedDict((n.guid, n) for n in found)
+
+        if updateCount is not None:
+            self.storage.setNotebookSync(
+                account, self.notebook_guid, updateCount, notes
+            )
+
+        return list(notes.values())
+
+    def _get_changed_notes(self, gn, after_usn, notes):
+        """
+        Apply the sync chunks after after_usn to the stored notes
+        returns (notes, updateCount), None if a chunk could not be fetched
+        """
+        notes = collections.OrderedDict(notes)
+        changed = 0
+        while True:
+            chunk = gn.getSyncChunk(after_usn)
+            if chunk is None:
+                return None
+
+            for note in chunk.notes or []:
+                changed += 1
+                if note.notebookGuid == self.notebook_guid and note.active:
+                    notes[note.guid] = note
+                else:
+                    notes.pop(note.guid, None)
+            for guid in chunk.expungedNotes or []:
+                changed += 1
+                notes.pop(guid, None)
+
+            if not chunk.chunkHighUSN or chunk.chunkHighUSN >= chunk.updateCount:
+                break
+            after_usn = chunk.chunkHighUSN
+
+        logger.info("%d notes changed in the account since the last sync", changed)
+        return notes, chunk.updateCount
+
+    def _get_account(self):
+        """
+        Key the stored sync state by user
+        """
+        info = self.storage.getUserInfo()
+        return str(getattr(info, "id", None) or "default")
+
+
+class LinkedGNSync(GNSync):
+    """
+    Sync of a notebook another user shared (a linked notebook), with the
+    manifest and the incremental listing of owned notebooks. Its notes
+    are reached on the shard of the share, see LinkedNotebookWorker.
+    """
+
+    def __init__(self, linked_notebook, path, mask=None, format=None, **options):
+        self.linked_notebook = linked_notebook
+        options.pop("notebooks", None)
+        options["geeknote"] = LinkedNotebookWorker(
+            linked_notebook,
+            Storage().getUserToken(),
+            options.get("sleep_on_ratelimit", False),
         )
-        return (
-            GeekNote(sleepOnRateLimit=self.sleep_on_ratelimit)
-            .findNotes(keywords, EDAM_USER_NOTES_MAX)
-            .notes
+        GNSync.__init__(
+            self, linked_notebook.shareName, path, mask, format, **options
         )
 
+    def _get_notebook(self, notebook_name, path):
+        """
+        Guid of the shared notebook, its name is the share name
+        """
+        guid = self.geeknote.authenticate()
+        if not guid:
+            raise Exception(
+                'Linked notebook "{0}" could not be opened'.format(notebook_name)
+            )
+        return (guid, notebook_name)
+
+
+def sync_notebook(executor, notebook, path, options, plan=False):
+    """
+    Sync the directory path with notebook, runs in a thread of executor.
+    With the option linked, a LinkedNotebook, notebook is its share name.
+    With plan the actions are printed instead of run.
+    returns the stats of the sync, None if it could not start
+    """
+    logger.info("Syncing notebook %s", notebook)
+    if not os.path.exists(path):
+        os.mkdir(path)
+    linked = options.pop("linked", None)
+    if linked is not None:
+        GNS = LinkedGNSync(linked, path, **options)
+    else:
+        GNS = GNSync(notebook, path, geeknote=executor.getWorker(), **options)
+    if not GNS.all_set:
+        return None
+    if plan:
+        actions = GNS.plan()
+        if actions is None:
+            return None
+        print(format_plan(actions, notebook))
+        return collections.Counter(
+            a.kind for a in actions if a.kind != SyncAction.RECORD_FILE
+        )
+    GNS.sync()
+    return GNS.stats
+
+
+def sync_notebooks(geeknote, syncs, jobs=1, plan=False, **options):
+    """
+    Sync every (notebook, path, options) of syncs, `jobs` at once.
+    The jobs are shared out among the notebooks synced at once, each
+    converts and transfers its files and notes with its share.
+    All syncs draw on the process-wide rate limit.
+    returns the combined stats
+    """
+    start = time.time()
+    summary = collections.Counter()
+    syncs = list(syncs)
+    jobs = max(1, jobs or 1)
+    share = max(1, jobs // max(1, min(jobs, len(syncs))))
+    with GeekNoteExecutor(geeknote, jobs) as executor:
+        futures = {}
+        for notebook, path, extra in syncs:
+            syncOptions = dict(options, jobs=share, **extra)
+            future = executor.submitCall(
+                sync_notebook, executor, notebook, path, syncOptions, plan
+            )
+            futures[future] = notebook
+        exit = None
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            try:
+                stats = future.result()
+            except tools.ExitException as e:
+                # no other notebook is started once one exits
+                exit = exit or e
+                for pending in futures:
+                    pending.cancel()
+                continue
+            except Exception as e:
+                logger.exception("%s", str(e))
+                stats = None
+            if stats is None:
+                logger.error('Notebook "%s" was not synced', futures[future])
+                summary["notebooks failed"] += 1
+            else:
+                summary.update(stats)
+                summary["notebooks"] += 1
+
+    logger.info(
+        "Synced %d of %d notebooks in %.1fs: %d uploaded, %d downloaded, "
+        "%d failed",
+        summary["notebooks"],
+        len(futures),
+        time.time() - start,
+        summary["uploaded"],
+        summary["downloaded"],
+        summary["failed"],
+    )
+    if exit is not None:
+        raise exit
+    return summary
+
+
+def sync_all(path, mask=None, format=None, jobs=1, sleep_on_ratelimit=False,
+             geeknote=None, **options):
+    """
+    Sync every notebook into subdirectories of path, `jobs` notebooks
+    at once. The notebook list is fetched once and shared.
+    returns the combined stats
+    """
+    geeknote = geeknote or GeekNote(sleepOnRateLimit=sleep_on_ratelimit)
+    notebooks = geeknote.findNotebooks()
+    syncs = [
+        (notebook.name, os.path.join(path, re.sub(os.sep, "-", notebook.name)), {})
+        for notebook in notebooks
+    ]
+    return sync_notebooks(
+        geeknote,
+        syncs,
+        jobs,
+        mask=mask,
+        format=format,
+        notebooks=notebooks,
+        sleep_on_ratelimit=sleep_on_ratelimit,
+        **options
+    )
+
+
+def sync_linked(path, mask=None, format=None, jobs=1, sleep_on_ratelimit=False,
+                geeknote=None, **options):
+    """
+    Sync every linked notebook into a subdirectory of path named after
+    its share name, `jobs` notebooks at once
+    returns the combined stats
+    """
+    geeknote = geeknote or GeekNote(sleepOnRateLimit=sleep_on_ratelimit)
+    syncs = []
+    for linked in geeknote.findLinkedNotebooks() or []:
+        if not linked.shareKey:
+            logger.warning(
+                'Linked notebook "%s" is not shared by a key, skipped',
+                linked.shareName,
+            )
+            continue
+        name = linked.shareName
+        syncs.append(
+            (name, os.path.join(path, re.sub(os.sep, "-", name)), {"linked": linked})
+        )
+    return sync_notebooks(
+        geeknote,
+        syncs,
+        jobs,
+        mask=mask,
+        format=format,
+        sleep_on_ratelimit=sleep_on_ratelimit,
+        **options
+    )
+
+
+def tree_notebooks(path, notebook=None, ignore=None):
+    """
+    Notebooks of the directory tree at path: its own files go to notebook,
+    a subdirectory is a notebook of its name, a directory below that is a
+    notebook in the stack named after the subdirectory. Deeper directories
+    are notebooks of that stack too, named by their path joined with "-".
+    yields (notebook, directory, options) lazily
+    raises Exception when two directories map to the same notebook,
+    notebook names are unique in an account whatever the stack
+    """
+    ignore = ignore if ignore is not None else scanner.IgnoreRules.load(path)
+    yield notebook, path, {"ignore": ignore}
+    seen = {}
+    if notebook:
+        seen[normalize_title(notebook).lower()] = path
+    for relPath, depth, rules in scanner.walkDirectories(path, rules=ignore):
+        parts = relPath.split(os.sep)
+        options = {"ignore": rules}
+        if depth > 1:
+            options["stack"] = parts[0]
+            parts = parts[1:]
+        name = "-".join(parts)
+        directory = os.path.join(path, relPath)
+        other = seen.setdefault(normalize_title(name).lower(), directory)
+        if other != directory:
+            raise Exception(
+                'Directories "{0}" and "{1}" both sync to notebook "{2}"'.format(
+                    other, directory, name
+                )
+            )
+        yield name, directory, options
+
+
+def sync_tree(path, notebook=None, mask=None, format=None, jobs=1,
+              sleep_on_ratelimit=False, geeknote=None, **options):
+    """
+    Sync the directory tree at path, see tree_notebooks, `jobs`
+    notebooks at once. The notebook list is fetched once and shared.
+    Nothing is synced if two directories map to the same notebook.
+    returns the combined stats
+    """
+    geeknote = geeknote or GeekNote(sleepOnRateLimit=sleep_on_ratelimit)
+    syncs = list(tree_notebooks(path, notebook))
+    return sync_notebooks(
+        geeknote,
+        syncs,
+        jobs,
+        mask=mask,
+        format=format,
+        notebooks=geeknote.findNotebooks(),
+        sleep_on_ratelimit=sleep_on_ratelimit,
+        **options
+    )
+
 
 def main():
     try:
@@ -515,8 +2044,8 @@ def main():
         parser.add_argument(
             "--mask",
             "-m",
-            action="store",
-            help='Mask of files to synchronize. Default is "*.*"',
+            action="append",
+            help='Mask of files to synchronize, may be given more than once or comma separated. Default is "*.*"',
         )
         parser.add_argument(
             "--format",
@@ -542,6 +2071,12 @@ def main():
         parser.add_argument(
             "--all-linked", action="store_true", help="Get all linked notebooks"
         )
+        parser.add_argument(
+            "--recursive",
+            "-r",
+            action="store_true",
+            help="Synchronize subdirectories too, each with a notebook of its name; directories below them become notebooks of a stack",
+        )
         parser.add_argument(
             "--logpath",
             "-l",
@@ -580,8 +2115,35 @@ def main():
             action="store_true",
             help="save images in a subdirectory (instead of same directory as file)",
         )
+        parser.add_argument(
+            "--watch",
+            "-w",
+            action="store_true",
+            help="Keep running and sync files as they change and notes when they change on the server",
+        )
+        parser.add_argument(
+            "--plan",
+            action="store_true",
+            help="Print the notes and files which would be written, without writing them",
+        )
+        parser.add_argument(
+            "--jobs",
+            "-j",
+            action="store",
+            type=int,
+            default=config.GNSYNC_JOBS,
+            help="How many files and notes are converted and transferred at once. Default is the number of CPUs",
+        )
 
         args = parser.parse_args()
+        if args.watch and (args.all or args.all_linked or args.recursive):
+            parser.error("--watch syncs a single notebook")
+        if args.watch and args.plan:
+            parser.error("--plan and --watch can not be combined")
+        if args.recursive and args.all:
+            parser.error("--recursive and --all can not be combined")
+        if args.all_linked and (args.all or args.recursive):
+            parser.error("--all-linked syncs the linked notebooks only")
 
         path = args.path if args.path else "."
         mask = args.mask if args.mask else None
@@ -599,68 +2161,51 @@ def main():
 
         reset_logpath(logpath)
 
-        geeknote = GeekNote()
+        geeknote = GeekNote(sleepOnRateLimit=args.sleep_on_ratelimit)
 
         if args.all_linked:
-            my_map = {}
-            for notebook in all_linked_notebooks():
-                print("Syncing notebook: " + notebook.shareName)
-                notebook_url = urllib.parse.urlparse(notebook.noteStoreUrl)
-                sharedNoteStoreClient = THttpClient.THttpClient(notebook.noteStoreUrl)
-                sharedNoteStoreProtocol = TBinaryProtocol.TBinaryProtocol(
-                    sharedNoteStoreClient
-                )
-                sharedNoteStore = NoteStore.Client(sharedNoteStoreProtocol)
-
-                sharedAuthResult = sharedNoteStore.authenticateToSharedNotebook(
-                    notebook.shareKey, geeknote.authToken
-                )
-                sharedAuthToken = sharedAuthResult.authenticationToken
-                sharedNotebook = sharedNoteStore.getSharedNotebookByAuth(
-                    sharedAuthToken
-                )
-
-                my_filter = NoteStore.NoteFilter(
-                    notebookGuid=sharedNotebook.notebookGuid
-                )
-
-                noteList = sharedNoteStore.findNotes(sharedAuthToken, my_filter, 0, 10)
-
-                print("Found " + str(noteList.totalNotes) + " shared notes.")
-
-                print(noteList.notes)
-
-                filename = notebook.shareName + "-" + noteList.notes[0].title + ".html"
-
-                filename = filename.replace(" ", "-").replace("/", "-")
-
-                content = sharedNoteStore.getNoteContent(
-                    sharedAuthToken, noteList.notes[0].guid
-                )
-
-                with open(filename, "w") as f:
-                    f.write(content)
-            return
-
-        if args.all:
-            for notebook in all_notebooks(sleep_on_ratelimit=args.sleep_on_ratelimit):
-                logger.info("Syncing notebook %s", notebook)
-                escaped_notebook_path = re.sub(os.sep, "-", notebook)
-                notebook_path = os.path.join(path, escaped_notebook_path)
-                if not os.path.exists(notebook_path):
-                    os.mkdir(notebook_path)
-                GNS = GNSync(
-                    notebook,
-                    notebook_path,
-                    mask,
-                    format,
-                    twoway,
-                    download_only,
-                    nodownsync,
-                    sleep_on_ratelimit=args.sleep_on_ratelimit,
-                    imageOptions=imageOptions,
-                )
-                GNS.sync()
+            sync_linked(
+                path,
+                jobs=args.jobs,
+                sleep_on_ratelimit=args.sleep_on_ratelimit,
+                geeknote=geeknote,
+                mask=mask,
+                format=format,
+                twoway=twoway,
+                download_only=download_only,
+                nodownsync=nodownsync,
+                imageOptions=imageOptions,
+                plan=args.plan,
+            )
+        elif args.all:
+            sync_all(
+                path,
+                jobs=args.jobs,
+                sleep_on_ratelimit=args.sleep_on_ratelimit,
+                geeknote=geeknote,
+                mask=mask,
+                format=format,
+                twoway=twoway,
+                download_only=download_only,
+                nodownsync=nodownsync,
+                imageOptions=imageOptions,
+                plan=args.plan,
+            )
+        elif args.recursive:
+            sync_tree(
+                path,
+                notebook,
+                jobs=args.jobs,
+                sleep_on_ratelimit=args.sleep_on_ratelimit,
+                geeknote=geeknote,
+                mask=mask,
+                format=format,
+                twoway=twoway,
+                download_only=download_only,
+                nodownsync=nodownsync,
+                imageOptions=imageOptions,
+                plan=args.plan,
+            )
         else:
             GNS = GNSync(
                 notebook,
@@ -672,8 +2217,17 @@ def main():
                 nodownsync,
                 sleep_on_ratelimit=args.sleep_on_ratelimit,
                 imageOptions=imageOptions,
+                jobs=args.jobs,
+                geeknote=geeknote,
             )
-            GNS.sync()
+            if args.plan:
+                actions = GNS.plan()
+                if actions is not None:
+                    print(format_plan(actions))
+            elif args.watch:
+                GNS.watch()
+            else:
+                GNS.sync()
 
     except (KeyboardInterrupt, SystemExit, tools.ExitException):
         pass
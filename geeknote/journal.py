@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+"""
+Write-ahead journal of a gnsync run, so that a run which was killed or
+stopped by a rate limit resumes where it was instead of starting over
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+from . import config
+from .log import logging
+
+JOURNAL_DIR = os.path.join(config.APP_DIR, "journal")
+
+
+class Journal(object):
+    """
+    The planned actions of a run and the progress on them, one JSON
+    record per line:
+
+        {"plan": [entry, ...]}    written at once before anything runs
+        {"start": index}          before an action which is not
+                                  safe to repeat is sent
+        {"done": index}           once an action finished
+
+    Records are flushed to disk as they are written. A record torn by
+    a crash is ignored, as is everything after it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.remaining = set()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def forSync(cls, *key):
+        """ journal of the runs with the same key, e.g. directory and options """
+        digest = hashlib.md5(json.dumps(key).encode("utf-8")).hexdigest()
+        return cls(os.path.join(JOURNAL_DIR, digest + ".jsonl"))
+
+    def load(self):
+        """
+        the run left unfinished as (entries, started, done),
+        started and done being sets of indexes; None if there is none
+        """
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                lines = f.read().split("\n")
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logging.warning("Can not read %s: %s", self.path, e)
+            return None
+
+        entries, started, done = None, set(), set()
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if entries is None:
+                entries = record.get("plan")
+                if entries is None:
+                    break
+            elif "start" in record:
+                started.add(record["start"])
+            elif "done" in record:
+                done.add(record["done"])
+
+        if entries is None:
+            return None
+        return entries, started, done
+
+    def begin(self, entries):
+        """ journal a new run of entries, replacing any earlier one """
+        self.close()
+        directory = os.path.dirname(self.path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        temporary = self.path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"plan": entries}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+        self.resume(range(len(entries)))
+
+    def resume(self, remaining):
+        """
+        continue journaling the run found by load,
+        remaining are the indexes of the entries not done
+        """
+        self.close()
+        self.remaining = set(remaining)
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def started(self, index):
+        self._append({"start": index})
+
+    def completed(self, index):
+        with self.lock:
+            self.remaining.discard(index)
+        self._append({"done": index})
+
+    def isFinished(self):
+        """ True once every entry of the run is done """
+        return not self.remaining
+
+    def _append(self, record):
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def discard(self):
+        """ the run finished, forget it """
+        self.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
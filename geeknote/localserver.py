@@ -0,0 +1,738 @@
+# -*- coding: utf-8 -*-
+
+"""
+Local stand-in for the Evernote UserStore and NoteStore services.
+
+Serves an in-memory corpus over HTTP with the same Thrift protocol as
+Evernote, so geeknote can be benchmarked and tested without an account:
+
+    with LocalServer(Corpus.generate(notes=1000), latency=0.05) as server:
+        GeekNote.userStoreUri = server.userStoreUri
+        ...
+
+or from a shell:
+
+    python -m geeknote.localserver --notes 1000 --latency 0.05
+"""
+
+import argparse
+import collections
+import copy
+import hashlib
+import math
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import thrift.protocol.TBinaryProtocol as TBinaryProtocol
+from thrift.Thrift import TApplicationException, TMessageType, TType
+import evernote.edam.userstore.UserStore as UserStore
+import evernote.edam.userstore.ttypes as UserStoreTypes
+import evernote.edam.notestore.NoteStore as NoteStore
+import evernote.edam.type.ttypes as Types
+from evernote.edam.error.ttypes import (
+    EDAMErrorCode,
+    EDAMNotFoundException,
+    EDAMSystemException,
+)
+
+from .transport import TBytesBuffer
+
+SHARD_ID = "s1"
+RESOURCE_PATH = "/shard/%s/res/" % SHARD_ID
+USER_ID = 1
+
+# most notes findNotesMetadata returns in one call
+PAGE_SIZE = 250
+
+# note fields set by the service on every update
+SERVICE_FIELDS = ("updated", "updateSequenceNum", "contentHash", "contentLength")
+
+# how long (in seconds) the auth token of a shared notebook is valid
+SHARED_AUTH_TTL = 60 * 60
+
+
+def text(value):
+    """ Thrift strings arrive as bytes """
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return value
+
+
+def now():
+    return int(time.time() * 1000)
+
+
+class Corpus(object):
+    """
+    Notebooks, tags and notes of the local account
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.updateCount = 0
+        self.notebooks = collections.OrderedDict()
+        self.tags = collections.OrderedDict()
+        self.notes = collections.OrderedDict()
+        self.expunged = {}
+        self.shared = collections.OrderedDict()
+        self.addNotebook("Default", default=True)
+
+    @classmethod
+    def generate(cls, notes=100, notebooks=5, tags=10, resources=0, size=1024):
+        """ corpus of synthetic notes, `resources` of `size` bytes each """
+        corpus = cls()
+        notebookGuids = [corpus.addNotebook("Notebook %d" % i).guid
+                         for i in range(notebooks)]
+        tagGuids = [corpus.addTag("tag%d" % i).guid for i in range(tags)]
+
+        for i in range(notes):
+            body = ("Note %d " % i * (size // 8 + 1))[:size]
+            content = (
+                '<?xml version="1.0" encoding="UTF-8"?>'
+                '<!DOCTYPE en-note SYSTEM "http://xml.evernote.com/pub/enml2.dtd">'
+                "<en-note>%s</en-note>" % body
+            )
+            data = [("resource %d-%d " % (i, r) * (size // 12 + 1))[:size].encode()
+                    for r in range(resources)]
+            corpus.addNote(
+                "Note %d" % i,
+                content,
+                notebookGuid=notebookGuids[i % notebooks] if notebooks else None,
+                tagGuids=tagGuids[i % tags:i % tags + 2] if tags else None,
+                resources=[(body, "application/octet-stream") for body in data],
+            )
+        return corpus
+
+    def nextUSN(self):
+        self.updateCount += 1
+        return self.updateCount
+
+    def addNotebook(self, name, default=False, stack=None):
+        with self.lock:
+            notebook = Types.Notebook(
+                guid=str(uuid.uuid4()),
+                name=name,
+                stack=stack,
+                defaultNotebook=default,
+                updateSequenceNum=self.nextUSN(),
+                serviceCreated=now(),
+                serviceUpdated=now(),
+            )
+            self.notebooks[notebook.guid] = notebook
+            return notebook
+
+    def addTag(self, name):
+        with self.lock:
+            tag = Types.Tag(
+                guid=str(uuid.uuid4()), name=name, updateSequenceNum=self.nextUSN()
+            )
+            self.tags[tag.guid] = tag
+            return tag
+
+    def addNote(self, title, content, notebookGuid=None, tagGuids=None,
+                resources=None):
+        """ resources is a list of (body, mime) """
+        note = Types.Note(
+            title=title,
+            content=content,
+            notebookGuid=notebookGuid,
+            tagGuids=tagGuids,
+            resources=[
+                Types.Resource(mime=mime, data=Types.Data(body=body))
+                for body, mime in resources or []
+            ],
+        )
+        return self.storeNote(note)
+
+    def shareNotebook(self, notebookGuid, shareName=None):
+        """
+        notebookGuid as a notebook another user shared with the local
+        one, its notes stay in the corpus
+        returns the LinkedNotebook
+        """
+        with self.lock:
+            notebook = self.notebooks[notebookGuid]
+            linked = Types.LinkedNotebook(
+                guid=str(uuid.uuid4()),
+                shareName=shareName or notebook.name,
+                shareKey=str(uuid.uuid4()),
+                shardId=SHARD_ID,
+                updateSequenceNum=self.nextUSN(),
+            )
+            self.shared[linked.shareKey] = (linked, notebookGuid)
+            return linked
+
+    def getSharedNotebook(self, shareKey):
+        """ guid of the notebook shared with shareKey """
+        shared = self.shared.get(text(shareKey))
+        if shared is None:
+            raise EDAMNotFoundException(identifier="SharedNotebook.shareKey",
+                                        key=text(shareKey))
+        return shared[1]
+
+    def getDefaultNotebook(self):
+        for notebook in self.notebooks.values():
+            if notebook.defaultNotebook:
+                return notebook
+
+    def findTag(self, name):
+        for tag in self.tags.values():
+            if tag.name == name:
+                return tag
+
+    def storeNote(self, note, existing=None):
+        """ create or update a note as the service would """
+        with self.lock:
+            if existing is None:
+                note.guid = str(uuid.uuid4())
+                note.created = note.created or now()
+                note.active = True
+            else:
+                for name, value in note.__dict__.items():
+                    if value is None and name not in SERVICE_FIELDS:
+                        setattr(note, name, getattr(existing, name))
+
+            note.title = text(note.title)
+            note.content = text(note.content)
+            note.notebookGuid = (
+                text(note.notebookGuid) or self.getDefaultNotebook().guid
+            )
+            note.tagGuids = [text(guid) for guid in note.tagGuids or []]
+            for name in note.tagNames or []:
+                tag = self.findTag(text(name)) or self.addTag(text(name))
+                note.tagGuids.append(tag.guid)
+            note.tagNames = None
+            note.tagGuids = note.tagGuids or None
+
+            content = (note.content or "").encode("utf-8")
+            note.contentHash = hashlib.md5(content).digest()
+            note.contentLength = len(content)
+
+            stored = {}
+            previous = existing.resources if existing is not None else None
+            for resource in previous or []:
+                stored[resource.guid] = stored[resource.data.bodyHash] = resource
+            for resource in note.resources or []:
+                body = resource.data.body
+                known = stored.get(text(resource.guid)) or stored.get(
+                    resource.data.bodyHash)
+                if body is None and known is not None:
+                    # kept as stored, the client sent no body again
+                    resource.data.body = known.data.body
+                    resource.data.bodyHash = known.data.bodyHash
+                    resource.data.size = known.data.size
+                elif body is not None:
+                    resource.data.bodyHash = hashlib.md5(body).digest()
+                    resource.data.size = len(body)
+                resource.guid = text(resource.guid) or str(uuid.uuid4())
+                resource.noteGuid = note.guid
+                resource.updateSequenceNum = self.nextUSN()
+
+            note.updated = note.updated or now()
+            note.updateSequenceNum = self.nextUSN()
+            self.notes[note.guid] = note
+            return note
+
+    def getResource(self, guid):
+        """ returns the resource guid or None """
+        with self.lock:
+            for note in self.notes.values():
+                for resource in note.resources or []:
+                    if resource.guid == guid:
+                        return resource
+        return None
+
+    def getNote(self, guid):
+        note = self.notes.get(text(guid))
+        if note is None:
+            raise EDAMNotFoundException(identifier="Note.guid", key=text(guid))
+        return note
+
+
+class NoteStoreHandler(object):
+    """
+    NoteStore methods used by geeknote
+    """
+
+    def __init__(self, corpus, server=None):
+        self.corpus = corpus
+        self.server = server
+
+    def _matches(self, note, noteFilter):
+        if bool(noteFilter.inactive) == note.active:
+            return False
+        if noteFilter.notebookGuid and note.notebookGuid != text(noteFilter.notebookGuid):
+            return False
+        if noteFilter.tagGuids:
+            if not set(map(text, noteFilter.tagGuids)) <= set(note.tagGuids or []):
+                return False
+        words = text(noteFilter.words)
+        if words:
+            haystack = ("%s %s" % (note.title, note.content)).lower()
+            for field, word in re.findall(r'(\w+:)?("[^"]*"|\S+)', words.lower()):
+                word = word.strip('"*')
+                if field == "intitle:":
+                    if word not in note.title.lower():
+                        return False
+                elif field == "notebook:":
+                    notebook = self.corpus.notebooks.get(note.notebookGuid)
+                    if notebook is None or notebook.name.lower() != word:
+                        return False
+                elif word not in haystack:
+                    return False
+        return True
+
+    def findNotesMetadata(self, authToken, noteFilter, offset, maxNotes, resultSpec):
+        with self.corpus.lock:
+            notes = [n for n in self.corpus.notes.values()
+                     if self._matches(n, noteFilter)]
+
+        order = noteFilter.order or Types.NoteSortOrder.UPDATED
+        key = {
+            Types.NoteSortOrder.CREATED: lambda n: n.created,
+            Types.NoteSortOrder.TITLE: lambda n: n.title.lower(),
+            Types.NoteSortOrder.UPDATE_SEQUENCE_NUMBER: lambda n: n.updateSequenceNum,
+        }.get(order, lambda n: n.updated)
+        notes.sort(key=key, reverse=not noteFilter.ascending)
+
+        page = notes[offset:offset + min(maxNotes, PAGE_SIZE)]
+        spec = resultSpec or NoteStore.NotesMetadataResultSpec()
+        metadata = []
+        for note in page:
+            meta = NoteStore.NoteMetadata(guid=note.guid)
+            for name in ("title", "contentLength", "created", "updated",
+                         "deleted", "updateSequenceNum", "notebookGuid",
+                         "tagGuids", "attributes"):
+                if getattr(spec, "include" + name[0].upper() + name[1:]):
+                    setattr(meta, name, getattr(note, name))
+            metadata.append(meta)
+
+        return NoteStore.NotesMetadataList(
+            startIndex=offset,
+            totalNotes=len(notes),
+            notes=metadata,
+            updateCount=self.corpus.updateCount,
+        )
+
+    def getNote(self, authToken, guid, withContent, withResourcesData,
+                withResourcesRecognition, withResourcesAlternateData):
+        note = copy.deepcopy(self.corpus.getNote(guid))
+        if not withContent:
+            note.content = None
+        if not withResourcesData:
+            for resource in note.resources or []:
+                resource.data.body = None
+        return note
+
+    def getNoteContent(self, authToken, guid):
+        return self.corpus.getNote(guid).content
+
+    def createNote(self, authToken, note):
+        note = copy.deepcopy(note)
+        note.guid = None
+        return copy.deepcopy(self.corpus.storeNote(note))
+
+    def updateNote(self, authToken, note):
+        existing = self.corpus.getNote(note.guid)
+        note = copy.deepcopy(note)
+        note.guid = existing.guid
+        return copy.deepcopy(self.corpus.storeNote(note, existing))
+
+    def deleteNote(self, authToken, guid):
+        note = self.corpus.getNote(guid)
+        with self.corpus.lock:
+            note.active = False
+            note.deleted = now()
+            note.updateSequenceNum = self.corpus.nextUSN()
+            return note.updateSequenceNum
+
+    def expungeNote(self, authToken, guid):
+        note = self.corpus.getNote(guid)
+        with self.corpus.lock:
+            del self.corpus.notes[note.guid]
+            usn = self.corpus.nextUSN()
+            self.corpus.expunged[note.guid] = usn
+            return usn
+
+    def getResourceByHash(self, authToken, noteGuid, contentHash, withData,
+                          withRecognition, withAlternateData):
+        for resource in self.corpus.getNote(noteGuid).resources or []:
+            if resource.data.bodyHash == contentHash:
+                resource = copy.deepcopy(resource)
+                if not withData:
+                    resource.data.body = None
+                return resource
+        raise EDAMNotFoundException(identifier="Resource.hash")
+
+    def listNotebooks(self, authToken):
+        return list(self.corpus.notebooks.values())
+
+    def getNotebook(self, authToken, guid):
+        notebook = self.corpus.notebooks.get(text(guid))
+        if notebook is None:
+            raise EDAMNotFoundException(identifier="Notebook.guid", key=text(guid))
+        return notebook
+
+    def getDefaultNotebook(self, authToken):
+        return self.corpus.getDefaultNotebook()
+
+    def createNotebook(self, authToken, notebook):
+        return self.corpus.addNotebook(
+            text(notebook.name), stack=text(notebook.stack) or None
+        )
+
+    def listLinkedNotebooks(self, authToken):
+        with self.corpus.lock:
+            result = []
+            for linked, _ in self.corpus.shared.values():
+                linked = copy.deepcopy(linked)
+                if self.server is not None:
+                    linked.noteStoreUrl = self.server.noteStoreUrl
+                result.append(linked)
+            return result
+
+    def authenticateToSharedNotebook(self, shareKey, authToken):
+        self.corpus.getSharedNotebook(shareKey)
+        current = now()
+        return UserStoreTypes.AuthenticationResult(
+            currentTime=current,
+            authenticationToken="shared:" + text(shareKey),
+            expiration=current + SHARED_AUTH_TTL * 1000,
+        )
+
+    def getSharedNotebookByAuth(self, authToken):
+        shareKey = text(authToken)[len("shared:"):]
+        return Types.SharedNotebook(
+            notebookGuid=self.corpus.getSharedNotebook(shareKey),
+            shareKey=shareKey,
+            userId=USER_ID,
+        )
+
+    def getLinkedNotebookSyncState(self, authToken, linkedNotebook):
+        self.corpus.getSharedNotebook(linkedNotebook.shareKey)
+        return self.getSyncState(authToken)
+
+    def getLinkedNotebookSyncChunk(self, authToken, linkedNotebook, afterUSN,
+                                   maxEntries, fullSyncOnly):
+        guid = self.corpus.getSharedNotebook(linkedNotebook.shareKey)
+        syncFilter = NoteStore.SyncChunkFilter(
+            includeNotes=True, includeExpunged=not fullSyncOnly
+        )
+        return self._getSyncChunk(afterUSN, maxEntries, syncFilter, guid)
+
+    def listTags(self, authToken):
+        return list(self.corpus.tags.values())
+
+    def getTag(self, authToken, guid):
+        tag = self.corpus.tags.get(text(guid))
+        if tag is None:
+            raise EDAMNotFoundException(identifier="Tag.guid", key=text(guid))
+        return tag
+
+    def createTag(self, authToken, tag):
+        return self.corpus.addTag(text(tag.name))
+
+    def getSyncState(self, authToken):
+        with self.corpus.lock:
+            uploaded = sum(n.contentLength for n in self.corpus.notes.values())
+            return NoteStore.SyncState(
+                currentTime=now(),
+                fullSyncBefore=0,
+                updateCount=self.corpus.updateCount,
+                uploaded=uploaded,
+            )
+
+    def getFilteredSyncChunk(self, authToken, afterUSN, maxEntries, syncFilter):
+        return self._getSyncChunk(afterUSN, maxEntries, syncFilter)
+
+    def _getSyncChunk(self, afterUSN, maxEntries, syncFilter, notebookGuid=None):
+        """ chunk of the account, or of the notes of notebookGuid only """
+        with self.corpus.lock:
+            entries = []
+            if syncFilter.includeNotebooks:
+                entries += [("notebooks", n.updateSequenceNum, n)
+                            for n in self.corpus.notebooks.values()]
+            if syncFilter.includeTags:
+                entries += [("tags", t.updateSequenceNum, t)
+                            for t in self.corpus.tags.values()]
+            if syncFilter.includeNotes:
+                entries += [("notes", n.updateSequenceNum, n)
+                            for n in self.corpus.notes.values()
+                            if notebookGuid in (None, n.notebookGuid)]
+            if syncFilter.includeExpunged:
+                entries += [("expungedNotes", usn, guid)
+                            for guid, usn in self.corpus.expunged.items()]
+            entries = sorted(
+                (e for e in entries if e[1] > afterUSN), key=lambda e: e[1]
+            )[:maxEntries]
+
+            chunk = NoteStore.SyncChunk(
+                currentTime=now(),
+                updateCount=self.corpus.updateCount,
+                chunkHighUSN=entries[-1][1] if entries else None,
+            )
+            for kind, usn, entry in entries:
+                if kind == "notes":
+                    entry = copy.deepcopy(entry)
+                    entry.content = None
+                    for resource in entry.resources or []:
+                        resource.data.body = None
+                    if not syncFilter.includeNoteResources:
+                        entry.resources = None
+                if getattr(chunk, kind) is None:
+                    setattr(chunk, kind, [])
+                getattr(chunk, kind).append(entry)
+            return chunk
+
+
+class UserStoreHandler(object):
+    """
+    UserStore methods used by geeknote
+    """
+
+    def __init__(self, server):
+        self.server = server
+
+    def checkVersion(self, clientName, edamVersionMajor, edamVersionMinor):
+        return True
+
+    def getUser(self, authToken):
+        return Types.User(
+            id=USER_ID,
+            username="local",
+            name="Local User",
+            shardId=SHARD_ID,
+            privilege=Types.PrivilegeLevel.NORMAL,
+        )
+
+    def getNoteStoreUrl(self, authToken):
+        return self.server.noteStoreUrl
+
+
+class Throttled(object):
+    """
+    Handler wrapper adding latency and rate limits to every call
+    """
+
+    def __init__(self, handler, server):
+        self.handler = handler
+        self.server = server
+
+    def __getattr__(self, name):
+        method = getattr(self.handler, name)
+
+        def call(*args):
+            self.server.throttle(name)
+            return method(*args)
+
+        return call
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        if self.path.startswith(RESOURCE_PATH):
+            self.sendResource()
+            return
+
+        processor = self.server.owner.getProcessor(self.path)
+        if processor is None:
+            self.send_error(404)
+            return
+
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        with self.server.owner.lock:
+            self.server.owner.received += len(body)
+        otrans = TBytesBuffer()
+        dispatch(
+            processor,
+            TBinaryProtocol.TBinaryProtocol(TBytesBuffer(body)),
+            TBinaryProtocol.TBinaryProtocol(otrans),
+        )
+        response = otrans.getvalue()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-thrift")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def sendResource(self):
+        """ resource body for the auth token in the form, with Range support """
+        owner = self.server.owner
+        form = urllib.parse.parse_qs(
+            self.rfile.read(int(self.headers["Content-Length"])).decode("ascii")
+        )
+        resource = owner.corpus.getResource(self.path[len(RESOURCE_PATH):])
+        if not form.get("auth"):
+            self.send_error(401)
+            return
+        if resource is None:
+            self.send_error(404)
+            return
+
+        body = resource.data.body
+        match = re.match(r"bytes=(\d+)-$", self.headers.get("Range") or "")
+        start = int(match.group(1)) if match else 0
+        if start > len(body):
+            self.send_error(416)
+            return
+        with owner.lock:
+            owner.calls["res"] += 1
+            owner.sent += len(body) - start
+
+        self.send_response(206 if match else 200)
+        self.send_header("Content-Type", resource.mime or "application/octet-stream")
+        self.send_header("Content-Length", str(len(body) - start))
+        if match:
+            self.send_header(
+                "Content-Range", "bytes %d-%d/%d" % (start, len(body) - 1, len(body))
+            )
+        self.end_headers()
+        self.wfile.write(body[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+def dispatch(processor, iprot, oprot):
+    """
+    Processor.process for the bundled thrift,
+    which reads method names as bytes
+    """
+    name, mtype, seqid = iprot.readMessageBegin()
+    name = text(name)
+    if name not in processor._processMap:
+        iprot.skip(TType.STRUCT)
+        iprot.readMessageEnd()
+        x = TApplicationException(
+            TApplicationException.UNKNOWN_METHOD, "Unknown function %s" % name
+        )
+        oprot.writeMessageBegin(name, TMessageType.EXCEPTION, seqid)
+        x.write(oprot)
+        oprot.writeMessageEnd()
+        return
+    processor._processMap[name](processor, seqid, iprot, oprot)
+
+
+class LocalServer(object):
+    """
+    UserStore and NoteStore over HTTP on localhost
+
+    latency   - seconds every call takes
+    rateLimit - calls allowed per rateLimitWindow seconds, after that
+                calls fail with errorCode 19 (RATE_LIMIT_REACHED)
+
+    calls counts the calls of every method and of the resource endpoint
+    as "res", received the bytes of all requests and sent the bytes of
+    the resource bodies
+    """
+
+    def __init__(self, corpus=None, port=0, latency=0.0, rateLimit=None,
+                 rateLimitWindow=60):
+        self.corpus = corpus or Corpus()
+        self.latency = latency
+        self.rateLimit = rateLimit
+        self.rateLimitWindow = rateLimitWindow
+        self.calls = collections.Counter()
+        self.received = 0
+        self.sent = 0
+        self.recent = collections.deque()
+        self.lock = threading.Lock()
+
+        self.userProcessor = UserStore.Processor(
+            Throttled(UserStoreHandler(self), self)
+        )
+        self.noteProcessor = NoteStore.Processor(
+            Throttled(NoteStoreHandler(self.corpus, self), self)
+        )
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), RequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.owner = self
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.httpd.server_port
+
+    @property
+    def userStoreUri(self):
+        return "http://127.0.0.1:%d/edam/user" % self.port
+
+    @property
+    def noteStoreUrl(self):
+        return "http://127.0.0.1:%d/shard/%s/notestore" % (self.port, SHARD_ID)
+
+    def getProcessor(self, path):
+        if path == "/edam/user":
+            return self.userProcessor
+        if path == "/shard/%s/notestore" % SHARD_ID:
+            return self.noteProcessor
+
+    def throttle(self, method):
+        with self.lock:
+            self.calls[method] += 1
+            if self.rateLimit is not None:
+                current = time.time()
+                while self.recent and self.recent[0] <= current - self.rateLimitWindow:
+                    self.recent.popleft()
+                if len(self.recent) >= self.rateLimit:
+                    wait = self.recent[0] + self.rateLimitWindow - current
+                    raise EDAMSystemException(
+                        errorCode=EDAMErrorCode.RATE_LIMIT_REACHED,
+                        rateLimitDuration=int(math.ceil(wait)),
+                    )
+                self.recent.append(current)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--notes", type=int, default=100)
+    parser.add_argument("--notebooks", type=int, default=5)
+    parser.add_argument("--resources", type=int, default=0,
+                        help="resources per note")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds every call takes")
+    parser.add_argument("--rate-limit", type=int, default=None,
+                        help="calls allowed per minute")
+    args = parser.parse_args()
+
+    corpus = Corpus.generate(
+        notes=args.notes, notebooks=args.notebooks, resources=args.resources
+    )
+    server = LocalServer(corpus, args.port, args.latency, args.rate_limit)
+    print("UserStore: %s" % server.userStoreUri)
+    print("NoteStore: %s" % server.noteStoreUrl)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
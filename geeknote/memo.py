@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+"""
+Process wide memoization of idempotent NoteStore and UserStore calls
+"""
+
+import threading
+import time
+from concurrent.futures import Future
+
+from . import config
+from .log import logging
+
+# calls whose results can be shared until the next write
+READ_METHODS = ("getTag", "getNotebook", "getUser", "listNotebooks", "listTags")
+
+# calls which change the account and invalidate memoized results
+WRITE_PREFIXES = ("create", "update", "delete", "expunge", "copy", "untag", "set")
+
+
+class Memo(object):
+    """
+    Remembers call results for ttl seconds.
+    Identical calls made while the first one is still running
+    wait for its result instead of going to the server.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = config.MEMO_TTL if ttl is None else ttl
+        self.lock = threading.Lock()
+        self.results = {}
+        self.pending = {}
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def call(self, key, func):
+        """
+        returns the remembered result for key, or the result of func()
+        """
+        with self.lock:
+            if key in self.results:
+                expires, value = self.results[key]
+                if expires > time.time():
+                    self.hits += 1
+                    return value
+                del self.results[key]
+
+            future = self.pending.get(key)
+            if future is not None:
+                self.coalesced += 1
+                owner = False
+            else:
+                future = Future()
+                self.pending[key] = future
+                self.misses += 1
+                owner = True
+            generation = self.generation
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = func()
+        except BaseException as e:
+            with self.lock:
+                del self.pending[key]
+            future.set_exception(e)
+            raise
+
+        with self.lock:
+            del self.pending[key]
+            # don't keep results which a write made while they were fetched
+            if generation == self.generation:
+                self.results[key] = (time.time() + self.ttl, value)
+        future.set_result(value)
+        return value
+
+    def invalidate(self):
+        """ forget all remembered results """
+        with self.lock:
+            self.results.clear()
+            self.generation += 1
+
+    def getStats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+            }
+
+
+# shared by every client in this process
+memo = Memo()
+
+
+class MemoizedClient(object):
+    """
+    Wraps a Thrift service client: READ_METHODS go through the memo,
+    calls matching WRITE_PREFIXES invalidate it
+    """
+
+    def __init__(self, client, memo=memo):
+        self.client = client
+        self.memo = memo
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+
+        if name in READ_METHODS:
+
+            def memoized(*args):
+                return self.memo.call((name,) + args, lambda: attr(*args))
+
+            return memoized
+
+        if name.startswith(WRITE_PREFIXES):
+
+            def write(*args):
+                try:
+                    return attr(*args)
+                finally:
+                    logging.debug("%s invalidates memoized results", name)
+                    self.memo.invalidate()
+
+            return write
+
+        return attr
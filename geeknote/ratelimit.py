@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+"""
+Process wide pacing of Evernote API requests
+"""
+
+import collections
+import threading
+import time
+
+from . import config
+from .log import logging
+
+# share of the learned budget actually used
+SAFETY = 0.9
+
+# never pace slower than one request a minute
+MIN_RATE = 1 / 60.0
+
+# requests which may go out back to back
+BURST = 5
+
+# fewer requests in the window than this tell nothing about the budget,
+# an earlier run may have used it up
+MIN_SAMPLE = 20
+
+# once a block is over the pace grows by this share of itself
+# for every window of requests sent
+RATE_INCREASE = 0.1
+
+
+class RateLimiter(object):
+    """
+    Token bucket shared by every Thrift request of the process.
+
+    Requests are not paced until the server rate limits us (errorCode 19).
+    The number of requests sent in the last RATELIMIT_WINDOW seconds is
+    then taken as the account budget, nothing is sent until the
+    rateLimitDuration is over and afterwards requests are spread evenly
+    over the window, the pace growing slowly while the server accepts
+    it.
+    """
+
+    def __init__(self, window=None):
+        self.window = window or config.RATELIMIT_WINDOW
+        self.condition = threading.Condition()
+        self.rate = None
+        self.tokens = BURST
+        self.updated = time.time()
+        self.blockedUntil = 0
+        self.recent = collections.deque()
+        self.loaded = False
+
+    def load(self, storage):
+        """ pick up the budget learned by previous runs """
+        if self.loaded:
+            return
+        self.loaded = True
+
+        state = storage.getCache("rateLimit")
+        if not state:
+            return
+
+        with self.condition:
+            self.rate = state["rate"]
+            self.blockedUntil = max(self.blockedUntil, state["blockedUntil"])
+            self.tokens = 0
+            self.updated = time.time()
+        logging.debug("Pacing requests at %.2f/min", (self.rate or 0) * 60)
+
+    def save(self, storage):
+        """ keep the budget for the runs of the next window """
+        with self.condition:
+            state = {"rate": self.rate, "blockedUntil": self.blockedUntil}
+            ttl = max(self.blockedUntil - time.time(), self.window)
+        storage.setCache("rateLimit", state, ttl)
+
+    def _refill(self, now):
+        start = max(self.updated, self.blockedUntil)
+        if self.rate and now > start:
+            self.tokens = min(BURST, self.tokens + (now - start) * self.rate)
+        self.updated = max(self.updated, now)
+
+    def _delay(self, now):
+        if now < self.blockedUntil:
+            return self.blockedUntil - now
+        if not self.rate or self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def _record(self, now):
+        self.recent.append(now)
+        while self.recent and self.recent[0] < now - self.window:
+            self.recent.popleft()
+
+    def acquire(self):
+        """ wait until a request may be sent """
+        with self.condition:
+            while True:
+                now = time.time()
+                self._refill(now)
+                delay = self._delay(now)
+                if delay <= 0:
+                    break
+                self.condition.wait(delay)
+
+            if self.rate:
+                self.tokens -= 1
+                if now >= self.blockedUntil:
+                    # a window holds rate * window requests, together
+                    # they raise the rate by RATE_INCREASE of itself
+                    self.rate += RATE_INCREASE / self.window
+            self._record(now)
+            self.condition.notify_all()
+
+    def limited(self, duration, storage=None):
+        """
+        The server refused a request for `duration` seconds,
+        learn the budget from the requests sent so far
+        """
+        with self.condition:
+            now = time.time()
+            if now < self.blockedUntil:
+                # the other requests in flight hit the same block,
+                # one block lowers the rate once
+                pass
+            elif self.rate:
+                # still limited while pacing, slow down further
+                self.rate = max(self.rate * SAFETY, MIN_RATE)
+            elif len(self.recent) >= MIN_SAMPLE:
+                rate = len(self.recent) * SAFETY / self.window
+                self.rate = max(rate, MIN_RATE)
+            self.blockedUntil = max(self.blockedUntil, now + duration)
+            self.tokens = 0
+            self.updated = now
+            self.condition.notify_all()
+
+        logging.debug(
+            "Rate limited for %s seconds, pacing at %.2f requests/min",
+            duration,
+            (self.rate or 0) * 60,
+        )
+        if storage:
+            self.save(storage)
+
+    def projectCompletion(self, requests):
+        """
+        timestamp at which `requests` more requests will have been sent,
+        None while requests are not paced
+        """
+        with self.condition:
+            now = time.time()
+            if not self.rate:
+                return None
+            self._refill(now)
+            start = max(now, self.blockedUntil)
+            return start + max(0, requests - int(self.tokens)) / self.rate
+
+    def getStats(self):
+        with self.condition:
+            return {
+                "rate": (self.rate or 0) * 60,
+                "sent": len(self.recent),
+                "blockedUntil": self.blockedUntil,
+            }
+
+
+# shared by every transport in this process
+limiter = RateLimiter()
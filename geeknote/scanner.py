@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+"""
+Lazy scan of sync directories with include masks and .gnsyncignore rules
+"""
+
+import fnmatch
+import os
+
+from .log import logging
+
+IGNORE_FILE = ".gnsyncignore"
+
+
+class IgnoreRules(object):
+    """
+    Patterns of a .gnsyncignore file and of the ones in parent
+    directories, a subset of .gitignore:
+
+        # comment
+        *.tmp         name of a file or directory at any depth
+        drafts/       directory only
+        /todo.txt     relative to the directory of the .gnsyncignore
+        !keep.tmp     not ignored after all
+
+    The last matching pattern wins, patterns of a directory come after
+    the ones of its parents.
+    """
+
+    def __init__(self, patterns=(), parent=None, base=""):
+        self.parent = parent
+        self.base = base
+        self.patterns = []
+        for line in patterns:
+            line = line.rstrip("\n").strip()
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            dirOnly = line.endswith("/")
+            line = line.rstrip("/")
+            anchored = "/" in line
+            self.patterns.append((line.lstrip("/"), negate, dirOnly, anchored))
+
+    @classmethod
+    def load(cls, directory, parent=None, base=""):
+        """ rules of directory, base is its path relative to the parent rules """
+        path = os.path.join(directory, IGNORE_FILE)
+        try:
+            with open(path, encoding="utf-8") as f:
+                return cls(f, parent, base)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning("Can not read %s: %s", path, e)
+        return cls((), parent, base)
+
+    def child(self, name, directory):
+        """ rules for the subdirectory name, found at directory """
+        return IgnoreRules.load(directory, self, name)
+
+    def match(self, relPath, isDir):
+        """
+        True or False if a pattern decides about relPath,
+        None if no pattern does
+        """
+        result = None
+        if self.parent is not None:
+            result = self.parent.match(
+                self.base + "/" + relPath if self.base else relPath, isDir
+            )
+        name = relPath.rsplit("/", 1)[-1]
+        for pattern, negate, dirOnly, anchored in self.patterns:
+            if dirOnly and not isDir:
+                continue
+            target = relPath if anchored else name
+            if fnmatch.fnmatchcase(target, pattern):
+                result = not negate
+        return result
+
+    def isIgnored(self, relPath, isDir=False):
+        return bool(self.match(relPath, isDir))
+
+
+def matchesMasks(name, masks):
+    return any(fnmatch.fnmatch(name, mask) for mask in masks)
+
+
+def scanFiles(directory, masks, rules=None):
+    """
+    Files of directory matching any of masks and not ignored, as
+    os.DirEntry: their stat() is cached and costs no further calls on
+    most systems. Hidden files are skipped, as glob does.
+    """
+    rules = rules if rules is not None else IgnoreRules.load(directory)
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            if not matchesMasks(entry.name, masks):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+            except OSError:
+                continue
+            if rules.isIgnored(entry.name):
+                continue
+            yield entry
+
+
+def subdirectories(root, relPath, depth, rules):
+    """ visible, not ignored subdirectories of root/relPath, sorted """
+    directory = os.path.join(root, relPath) if relPath else root
+    names = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    if not entry.is_dir():
+                        continue
+                except OSError:
+                    continue
+                if rules.isIgnored(entry.name, isDir=True):
+                    continue
+                names.append(entry.name)
+    except OSError as e:
+        logging.warning("Can not scan %s: %s", directory, e)
+
+    result = []
+    for name in sorted(names):
+        childPath = os.path.join(relPath, name) if relPath else name
+        childRules = rules.child(name, os.path.join(directory, name))
+        result.append((childPath, depth + 1, childRules))
+    return result
+
+
+def walkDirectories(root, maxDepth=None, rules=None):
+    """
+    Subdirectories of root which are not hidden or ignored, lazily and
+    parents first, as (path relative to root, depth, IgnoreRules of it).
+    Only the directories on the way down are held in memory.
+    """
+    rules = rules if rules is not None else IgnoreRules.load(root)
+    pending = list(reversed(subdirectories(root, "", 0, rules)))
+    while pending:
+        relPath, depth, dirRules = pending.pop()
+        yield relPath, depth, dirRules
+        if maxDepth is None or depth < maxDepth:
+            pending.extend(reversed(subdirectories(root, relPath, depth, dirRules)))
@@ -3,6 +3,7 @@
 import os
 import datetime
 import pickle
+import threading
 
 from sqlalchemy import *
 from sqlalchemy.orm import *
@@ -16,6 +17,9 @@ db_path = os.path.join(config.APP_DIR, "database.db")
 engine = create_engine("sqlite:///" + db_path)
 Base = declarative_base()
 
+# worker threads open their own Storage, the schema is checked one at a time
+schemaLock = threading.Lock()
+
 
 class Userprop(Base):
     __tablename__ = "user_props"
@@ -113,6 +117,115 @@ class Search(Base):
         return "<Search('{0}')>".format(self.timestamp)
 
 
+class Cache(Base):
+    __tablename__ = "cache"
+
+    id = Column(Integer, primary_key=True)
+    key = Column(String(255))
+    value = Column(PickleType())
+    expires = Column(DateTime(), nullable=False)
+
+    def __init__(self, key, value, expires):
+        self.key = key
+        self.value = value
+        self.expires = expires
+
+    def __repr__(self):
+        return "<Cache('{0}','{1}')>".format(self.key, self.expires)
+
+
+class NotebookSync(Base):
+    __tablename__ = "notebook_sync"
+
+    id = Column(Integer, primary_key=True)
+    account = Column(String(255))
+    notebook = Column(String(1000))
+    update_count = Column(Integer)
+    notes = Column(PickleType())
+    timestamp = Column(DateTime(), nullable=False)
+
+    def __init__(self, account, notebook, update_count, notes):
+        self.account = account
+        self.notebook = notebook
+        self.update_count = update_count
+        self.notes = notes
+        self.timestamp = datetime.datetime.now()
+
+    def __repr__(self):
+        return "<NotebookSync('{0}','{1}')>".format(self.notebook, self.update_count)
+
+
+class SyncRun(Base):
+    __tablename__ = "sync_runs"
+
+    id = Column(Integer, primary_key=True)
+    account = Column(String(255))
+    path = Column(String(4096))
+    update_count = Column(Integer)
+    fingerprint = Column(String(255))
+    timestamp = Column(DateTime(), nullable=False)
+
+    def __init__(self, account, path, update_count, fingerprint):
+        self.account = account
+        self.path = path
+        self.update_count = update_count
+        self.fingerprint = fingerprint
+        self.timestamp = datetime.datetime.now()
+
+    def __repr__(self):
+        return "<SyncRun('{0}','{1}')>".format(self.path, self.timestamp)
+
+
+class ManifestEntry(Base):
+    __tablename__ = "sync_manifest"
+    __table_args__ = (
+        Index("ix_sync_manifest_path", "account", "directory", "path"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    account = Column(String(255))
+    directory = Column(String(4096))
+    path = Column(String(4096))
+    size = Column(Integer)
+    mtime = Column(Integer)
+    content_hash = Column(String(32))
+    guid = Column(String(36))
+    usn = Column(Integer)
+    upload_hash = Column(String(32))
+    title = Column(String(255))
+
+    FIELDS = ("size", "mtime", "content_hash", "guid", "usn", "upload_hash", "title")
+
+    def __init__(self, account, directory, path):
+        self.account = account
+        self.directory = directory
+        self.path = path
+
+    def __repr__(self):
+        return "<ManifestEntry('{0}','{1}')>".format(self.path, self.guid)
+
+
+class ResourceHash(Base):
+    __tablename__ = "resource_hashes"
+
+    id = Column(Integer, primary_key=True)
+    path = Column(String(4096), index=True)
+    size = Column(Integer)
+    mtime = Column(Integer)
+    body_hash = Column(String(32))
+    mime = Column(String(255))
+
+    def __init__(self, path, size, mtime, body_hash, mime):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.body_hash = body_hash
+        self.mime = mime
+
+    def __repr__(self):
+        return "<ResourceHash('{0}','{1}')>".format(self.path, self.body_hash)
+
+
 class Storage(object):
     """
     Class for using database
@@ -122,7 +235,12 @@ class Storage(object):
 
     def __init__(self):
         logging.debug("Storage engine : %s", engine)
-        Base.metadata.create_all(engine)
+        with schemaLock:
+            Base.metadata.create_all(engine)
+            # create_all skips the indexes of tables made by older versions
+            for table in (ManifestEntry.__table__, ResourceHash.__table__):
+                for index in table.indexes:
+                    index.create(engine, checkfirst=True)
         Session = sessionmaker(bind=engine)
         self.session = Session()
 
@@ -153,6 +271,7 @@ class Storage(object):
 
         for item in self.session.query(Userprop).all():
             self.session.delete(item)
+        self.delCache()
 
         self.setUserprop("oAuthToken", oAuthToken)
         self.setUserprop("info", info_obj)
@@ -163,10 +282,30 @@ class Storage(object):
     def removeUser(self):
         """
         Remove user
+        The sync state is kept, see delSyncState
         returns True if all done
         """
         for item in self.session.query(Userprop).all():
             self.session.delete(item)
+        for item in self.session.query(Cache).all():
+            self.session.delete(item)
+        self.session.commit()
+        return True
+
+    @logging
+    def delSyncState(self):
+        """
+        Forget the sync state of every account
+        returns True if all done
+        """
+        for item in self.session.query(NotebookSync).all():
+            self.session.delete(item)
+        for item in self.session.query(SyncRun).all():
+            self.session.delete(item)
+        for item in self.session.query(ManifestEntry).all():
+            self.session.delete(item)
+        for item in self.session.query(ResourceHash).all():
+            self.session.delete(item)
         self.session.commit()
         return True
 
@@ -244,6 +383,59 @@ class Storage(object):
             return True
         return False
 
+    @logging
+    def setCache(self, key, value, ttl=None):
+        """
+        Cache a value for ttl seconds
+        ttl defaults to config.CACHE_TTL
+        returns True if all done
+        """
+        if ttl is None:
+            ttl = config.CACHE_TTL
+        expires = datetime.datetime.now() + datetime.timedelta(seconds=ttl)
+        value = pickle.dumps(value)
+
+        instance = self.session.query(Cache).filter_by(key=key).first()
+        if instance:
+            instance.value = value
+            instance.expires = expires
+        else:
+            instance = Cache(key, value, expires)
+            self.session.add(instance)
+
+        self.session.commit()
+        return True
+
+    @logging
+    def getCache(self, key):
+        """
+        Get a cached value by key
+        returns the value if it is cached and has not expired
+        returns None otherwise
+        """
+        instance = self.session.query(Cache).filter_by(key=key).first()
+        if instance and instance.expires > datetime.datetime.now():
+            return pickle.loads(instance.value)
+        else:
+            return None
+
+    @logging
+    def delCache(self, key=None, prefix=None):
+        """
+        Delete a cached value, the values whose key starts with prefix,
+        or every cached value if neither is given
+        returns True if all done
+        """
+        query = self.session.query(Cache)
+        if key is not None:
+            query = query.filter_by(key=key)
+        if prefix is not None:
+            query = query.filter(Cache.key.startswith(prefix, autoescape=True))
+        for item in query.all():
+            self.session.delete(item)
+        self.session.commit()
+        return True
+
     @logging
     def setSettings(self, settings):
         """
@@ -444,3 +636,230 @@ class Storage(object):
             return pickle.loads(search.search_obj)
         else:
             return None
+
+    @logging
+    def setNotebookSync(self, account, notebook, updateCount, notes):
+        """
+        Remember the notes of a notebook as of the account's updateCount
+        notes must be a dict of note metadata indexed by GUID
+        returns True if all done
+        """
+        notes = pickle.dumps(notes)
+
+        instance = (
+            self.session.query(NotebookSync)
+            .filter_by(account=account, notebook=notebook)
+            .first()
+        )
+        if instance:
+            instance.update_count = updateCount
+            instance.notes = notes
+            instance.timestamp = datetime.datetime.now()
+        else:
+            instance = NotebookSync(account, notebook, updateCount, notes)
+            self.session.add(instance)
+
+        self.session.commit()
+        return True
+
+    @logging
+    def getNotebookSync(self, account, notebook):
+        """
+        Get the remembered notes of a notebook
+        returns (updateCount, notes, timestamp) if the notebook was synced
+        returns None otherwise
+        """
+        instance = (
+            self.session.query(NotebookSync)
+            .filter_by(account=account, notebook=notebook)
+            .first()
+        )
+        if instance:
+            return (
+                instance.update_count,
+                pickle.loads(instance.notes),
+                instance.timestamp,
+            )
+        else:
+            return None
+
+    @logging
+    def delNotebookSync(self, account=None):
+        """
+        Forget remembered notebooks, of every account if account is None
+        returns True if all done
+        """
+        query = self.session.query(NotebookSync)
+        if account is not None:
+            query = query.filter_by(account=account)
+        for item in query.all():
+            self.session.delete(item)
+        self.session.commit()
+        return True
+
+    @logging
+    def setSyncRun(self, account, path, updateCount, fingerprint):
+        """
+        Remember the account updateCount and the directory fingerprint
+        of the last completed sync of path
+        returns True if all done
+        """
+        instance = (
+            self.session.query(SyncRun).filter_by(account=account, path=path).first()
+        )
+        if instance:
+            instance.update_count = updateCount
+            instance.fingerprint = fingerprint
+            instance.timestamp = datetime.datetime.now()
+        else:
+            instance = SyncRun(account, path, updateCount, fingerprint)
+            self.session.add(instance)
+
+        self.session.commit()
+        return True
+
+    @logging
+    def getSyncRun(self, account, path):
+        """
+        Get the last completed sync of path
+        returns (updateCount, fingerprint) if path was synced
+        returns None otherwise
+        """
+        instance = (
+            self.session.query(SyncRun).filter_by(account=account, path=path).first()
+        )
+        if instance:
+            return (instance.update_count, instance.fingerprint)
+        else:
+            return None
+
+    @logging
+    def getManifest(self, account, directory):
+        """
+        Get the synced files of directory
+        returns dict of path : entry dict
+        """
+        result = {}
+        for instance in self.session.query(ManifestEntry).filter_by(
+            account=account, directory=directory
+        ):
+            result[instance.path] = dict(
+                (field, getattr(instance, field)) for field in ManifestEntry.FIELDS
+            )
+        return result
+
+    @logging
+    def setManifestEntry(self, account, directory, path, entry):
+        """
+        Remember a synced file of directory
+        returns True if all done
+        """
+        instance = (
+            self.session.query(ManifestEntry)
+            .filter_by(account=account, directory=directory, path=path)
+            .first()
+        )
+        if not instance:
+            instance = ManifestEntry(account, directory, path)
+            self.session.add(instance)
+        for field in ManifestEntry.FIELDS:
+            setattr(instance, field, entry.get(field))
+
+        self.session.commit()
+        return True
+
+    @logging
+    def setManifestEntries(self, account, directory, entries):
+        """
+        Remember several synced files of directory in one commit
+        entries is a dict of path : entry dict, or None to forget it
+        returns True if all done
+        """
+        instances = {}
+        for instance in self.session.query(ManifestEntry).filter_by(
+            account=account, directory=directory
+        ):
+            instances[instance.path] = instance
+        for path, entry in entries.items():
+            instance = instances.get(path)
+            if entry is None:
+                if instance:
+                    self.session.delete(instance)
+                continue
+            if not instance:
+                instance = ManifestEntry(account, directory, path)
+                self.session.add(instance)
+            for field in ManifestEntry.FIELDS:
+                setattr(instance, field, entry.get(field))
+
+        self.session.commit()
+        return True
+
+    @logging
+    def delManifestEntry(self, account, directory, path):
+        """
+        Forget a synced file of directory
+        returns True if all done
+        """
+        for instance in self.session.query(ManifestEntry).filter_by(
+            account=account, directory=directory, path=path
+        ):
+            self.session.delete(instance)
+        self.session.commit()
+        return True
+
+    @logging
+    def getResourceHash(self, path, size, mtime):
+        """
+        Get the hash of a resource file, if it did not change since
+        it was hashed
+        returns (hex md5, mime) if it did not
+        returns None otherwise
+        """
+        instance = (
+            self.session.query(ResourceHash)
+            .filter_by(path=path, size=size, mtime=mtime)
+            .first()
+        )
+        if instance:
+            return (instance.body_hash, instance.mime)
+        else:
+            return None
+
+    @logging
+    def getResourceHashes(self, directory):
+        """
+        Get the hashed resource files in directory and below
+        returns dict of path : (size, mtime, hex md5, mime)
+        """
+        result = {}
+        prefix = os.path.join(directory, "")
+        for instance in self.session.query(ResourceHash).filter(
+            ResourceHash.path.startswith(prefix, autoescape=True)
+        ):
+            result[instance.path] = (
+                instance.size,
+                instance.mtime,
+                instance.body_hash,
+                instance.mime,
+            )
+        return result
+
+    @logging
+    def setResourceHash(self, path, size, mtime, bodyHash, mime):
+        """
+        Remember the hash of a resource file
+        returns True if all done
+        """
+        instance = self.session.query(ResourceHash).filter_by(path=path).first()
+        if instance:
+            instance.size = size
+            instance.mtime = mtime
+            instance.body_hash = bodyHash
+            instance.mime = mime
+        else:
+            instance = ResourceHash(path, size, mtime, bodyHash, mime)
+            self.session.add(instance)
+
+        self.session.commit()
+        return True
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+
+"""
+Thrift HTTP transport that keeps connections alive between calls
+"""
+
+import http.client
+import os
+import socket
+import sys
+import threading
+import urllib.parse
+from io import BytesIO
+
+from thrift.transport import TTransport
+import thrift.protocol.TBinaryProtocol as TBinaryProtocol
+
+from . import ratelimit
+from .log import logging
+
+# errors raised when the server silently dropped an idle keep-alive connection
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    http.client.CannotSendRequest,
+    http.client.ResponseNotReady,
+    BrokenPipeError,
+    ConnectionResetError,
+    ConnectionAbortedError,
+)
+
+# calls which change nothing and may be sent again when the connection
+# drops after the request went out
+READ_PREFIXES = ("get", "find", "list", "check")
+
+
+def methodName(request):
+    """ name of the Thrift method a request calls """
+    protocol = TBinaryProtocol.TBinaryProtocol(TBytesBuffer(request))
+    name = protocol.readMessageBegin()[0]
+    if isinstance(name, bytes):
+        name = name.decode("utf-8")
+    return name
+
+
+def isRead(request):
+    """ the request calls a method which changes nothing """
+    try:
+        return methodName(request).startswith(READ_PREFIXES)
+    except Exception:
+        return False
+
+
+class ConnectionPool(object):
+    """
+    Keeps idle HTTP(S) connections, indexed by scheme, host and port,
+    and counts how often they are reused.
+    """
+
+    def __init__(self, maxIdle=8):
+        self.maxIdle = maxIdle
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.opened = 0
+        self.reused = 0
+        self.requests = 0
+        self.reconnects = 0
+
+    def acquire(self, scheme, host, port, timeout=None):
+        """
+        Get a connection to host:port
+        returns (connection, True) if an idle connection was reused
+        returns (connection, False) if a new connection was created
+        """
+        key = (scheme, host, port)
+        with self.lock:
+            self.requests += 1
+            connections = self.idle.get(key)
+            if connections:
+                self.reused += 1
+                return connections.pop(), True
+            self.opened += 1
+
+        if scheme == "https":
+            connection = http.client.HTTPSConnection(host, port, timeout=timeout)
+        else:
+            connection = http.client.HTTPConnection(host, port, timeout=timeout)
+        return connection, False
+
+    def release(self, scheme, host, port, connection):
+        """
+        Give a connection with a fully read response back to the pool
+        """
+        key = (scheme, host, port)
+        with self.lock:
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < self.maxIdle:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def reconnected(self):
+        with self.lock:
+            self.reconnects += 1
+
+    def clear(self):
+        """
+        Close all idle connections
+        """
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def getStats(self):
+        """
+        returns dict of connection counters
+        """
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "opened": self.opened,
+                "reused": self.reused,
+                "reconnects": self.reconnects,
+            }
+
+
+# shared by every client created in this process
+pool = ConnectionPool()
+
+
+class TBytesBuffer(TTransport.TTransportBase):
+    """
+    In-memory transport over bytes
+    """
+
+    def __init__(self, value=None):
+        self.buffer = BytesIO(value) if value is not None else BytesIO()
+
+    def isOpen(self):
+        return True
+
+    def read(self, sz):
+        return self.buffer.read(sz)
+
+    def readAll(self, sz):
+        return self.read(sz)
+
+    def write(self, buf):
+        self.buffer.write(buf)
+
+    def getvalue(self):
+        return self.buffer.getvalue()
+
+
+class THttpPooledClient(TTransport.TTransportBase):
+    """
+    Http implementation of TTransport which takes its connections
+    from a ConnectionPool instead of opening one per call.
+    The response body is read in full before it is decoded.
+    """
+
+    def __init__(self, uri, connectionPool=None):
+        parsed = urllib.parse.urlparse(uri)
+        self.scheme = parsed.scheme
+        if self.scheme not in ("http", "https"):
+            raise ValueError("Unsupported URI scheme: %s" % uri)
+        if self.scheme == "http":
+            defaultPort = http.client.HTTP_PORT
+        else:
+            defaultPort = http.client.HTTPS_PORT
+        self.port = parsed.port or defaultPort
+        self.host = parsed.hostname
+
+        # like http.client: IPv6 in brackets, the port unless it is the default
+        self.hostHeader = "[%s]" % self.host if ":" in self.host else self.host
+        if self.port != defaultPort:
+            self.hostHeader += ":%d" % self.port
+        self.path = parsed.path
+        if parsed.query:
+            self.path += "?%s" % parsed.query
+
+        self.pool = connectionPool or pool
+        self.timeout = None
+        self.customHeaders = None
+        self.wbuf = BytesIO()
+        self.rbuf = BytesIO()
+
+    def isOpen(self):
+        return True
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def setTimeout(self, ms):
+        self.timeout = None if ms is None else ms / 1000.0
+
+    def setCustomHeaders(self, headers):
+        self.customHeaders = headers
+
+    def read(self, sz):
+        return self.rbuf.read(sz)
+
+    def readAll(self, sz):
+        return self.read(sz)
+
+    def write(self, buf):
+        self.wbuf.write(buf)
+
+    def flush(self):
+        data = self.wbuf.getvalue()
+        self.wbuf = BytesIO()
+
+        ratelimit.limiter.acquire()
+
+        while True:
+            connection, reused = self.pool.acquire(
+                self.scheme, self.host, self.port, self.timeout
+            )
+            sent = False
+            try:
+                self._post(connection, data)
+                sent = True
+                response = connection.getresponse()
+                body = response.read()
+            except STALE_CONNECTION_ERRORS as e:
+                connection.close()
+                # once the request went out the server may have run it,
+                # only reads are sent again
+                if not reused or (sent and not isRead(data)):
+                    raise
+                # server closed the idle connection, retry on a fresh one
+                logging.debug("Reconnecting to %s: %s", self.host, str(e))
+                self.pool.reconnected()
+                continue
+            except (socket.error, http.client.HTTPException):
+                connection.close()
+                raise
+            break
+
+        if response.will_close:
+            connection.close()
+        else:
+            self.pool.release(self.scheme, self.host, self.port, connection)
+
+        if response.status != 200:
+            raise TTransport.TTransportException(
+                message="HTTP %d %s from %s"
+                % (response.status, response.reason, self.host)
+            )
+
+        self.rbuf = BytesIO(body)
+
+    def _post(self, connection, data):
+        connection.putrequest("POST", self.path, skip_host=True)
+        connection.putheader("Host", self.hostHeader)
+        connection.putheader("Content-Type", "application/x-thrift")
+        connection.putheader("Content-Length", str(len(data)))
+
+        if not self.customHeaders or "User-Agent" not in self.customHeaders:
+            userAgent = "Python/THttpClient"
+            script = os.path.basename(sys.argv[0])
+            if script:
+                userAgent = "%s (%s)" % (userAgent, urllib.parse.quote(script))
+            connection.putheader("User-Agent", userAgent)
+
+        if self.customHeaders:
+            for key, val in self.customHeaders.items():
+                connection.putheader(key, val)
+
+        connection.endheaders()
+        connection.send(data)
+
+
+def createClient(clientClass, uri):
+    """
+    Create a Thrift service client (UserStore.Client, NoteStore.Client)
+    talking to uri over a pooled keep-alive connection,
+    or through the cassette set up in config
+    """
+    # cassette builds on this module
+    from . import cassette
+
+    httpClient = cassette.createTransport(uri) or THttpPooledClient(uri)
+    protocol = TBinaryProtocol.TBinaryProtocol(httpClient)
+    return clientClass(protocol)
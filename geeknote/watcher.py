@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+"""
+Changes of the files in a directory, from inotify on Linux
+and from polling elsewhere
+"""
+
+import abc
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+from .log import logging
+
+# inotify(7)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+)
+EVENT = struct.Struct("iIII")
+
+
+class Watcher(abc.ABC):
+    """
+    Base of the watchers. read() returns the names of the files which
+    changed, an empty set if nothing did within the timeout and None
+    if changes were lost and the whole directory has to be looked at
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    @abc.abstractmethod
+    def read(self, timeout):
+        """ names changed within timeout, see the class """
+
+    def wait(self, timeout, debounce, maxDelay=None):
+        """
+        Wait up to timeout for a change, then collect changes until
+        none come for `debounce` seconds, so that a burst of writes
+        from an editor is seen once. Collecting ends after maxDelay.
+        """
+        changed = self.read(timeout)
+        if not changed:
+            return changed
+
+        maxDelay = debounce * 10 if maxDelay is None else maxDelay
+        end = time.time() + maxDelay
+        while time.time() < end:
+            more = self.read(min(debounce, max(end - time.time(), 0)))
+            if more is None:
+                return None
+            if not more:
+                break
+            changed |= more
+        return changed
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class InotifyWatcher(Watcher):
+    """
+    Watcher over inotify, loaded with ctypes from the C library
+    """
+
+    libc = None
+
+    @classmethod
+    def getLibc(cls):
+        if cls.libc is None:
+            libc = ctypes.CDLL(
+                ctypes.util.find_library("c") or "libc.so.6", use_errno=True
+            )
+            libc.inotify_init1.argtypes = [ctypes.c_int]
+            libc.inotify_add_watch.argtypes = [
+                ctypes.c_int,
+                ctypes.c_char_p,
+                ctypes.c_uint32,
+            ]
+            cls.libc = libc
+        return cls.libc
+
+    @classmethod
+    def isAvailable(cls):
+        try:
+            return hasattr(cls.getLibc(), "inotify_init1")
+        except (OSError, AttributeError):
+            return False
+
+    def __init__(self, path):
+        Watcher.__init__(self, path)
+        libc = self.getLibc()
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch failed for %s" % path)
+
+    def read(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changed = set()
+        offset = 0
+        while offset + EVENT.size <= len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                logging.warning("inotify queue overflowed")
+                return None
+            if name and not mask & IN_ISDIR:
+                changed.add(os.fsdecode(name))
+        return changed
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class PollingWatcher(Watcher):
+    """
+    Watcher comparing snapshots of the directory
+    """
+
+    def __init__(self, path, interval=1.0):
+        Watcher.__init__(self, path)
+        self.interval = interval
+        self.snapshot = self.scan()
+
+    def scan(self):
+        snapshot = {}
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    snapshot[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def read(self, timeout):
+        end = time.time() + timeout
+        while True:
+            snapshot = self.scan()
+            changed = set(
+                name
+                for name in set(snapshot) | set(self.snapshot)
+                if snapshot.get(name) != self.snapshot.get(name)
+            )
+            self.snapshot = snapshot
+            left = end - time.time()
+            if changed or left <= 0:
+                return changed
+            time.sleep(min(self.interval, left))
+
+
+def createWatcher(path):
+    """ the best watcher for path on this system """
+    if InotifyWatcher.isAvailable():
+        try:
+            return InotifyWatcher(path)
+        except OSError as e:
+            logging.warning("inotify is not usable, polling instead: %s", e)
+    return PollingWatcher(path)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+
+from mock import Mock, patch
+from evernote.edam.notestore.NoteStore import NotesMetadataList, NoteMetadata
+import evernote.edam.type.ttypes as Types
+from geeknote import memo
+from geeknote.aio import AsyncGeekNote
+from geeknote.geeknote import GeekNote
+
+
+class FakeNoteStore(object):
+    """ NoteStore client recording how many calls run at the same time """
+
+    def __init__(self, totalNotes=0, delay=0.0):
+        self.totalNotes = totalNotes
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.inFlight = 0
+        self.maxInFlight = 0
+
+    def _enter(self):
+        with self.lock:
+            self.inFlight += 1
+            self.maxInFlight = max(self.maxInFlight, self.inFlight)
+        time.sleep(self.delay)
+        with self.lock:
+            self.inFlight -= 1
+
+    def getNoteContent(self, authToken, guid):
+        self._enter()
+        return '<en-note>%s</en-note>' % guid
+
+    def getNotebook(self, authToken, guid):
+        self._enter()
+        return Types.Notebook(guid=guid, name='notebook ' + guid)
+
+    def getTag(self, authToken, guid):
+        self._enter()
+        return Types.Tag(guid=guid, name='tag ' + guid)
+
+    def findNotesMetadata(self, authToken, noteFilter, offset, count, meta):
+        self._enter()
+        last = min(offset + min(count, 10), self.totalNotes)
+        notes = [NoteMetadata(guid=str(i)) for i in range(offset, last)]
+        return NotesMetadataList(startIndex=offset, totalNotes=self.totalNotes,
+                                 notes=notes)
+
+
+class GeekNoteOver(GeekNote):
+    def __init__(self):
+        self.authToken = 'token'
+
+    def getNoteStoreUrl(self):
+        return 'https://www.evernote.com/shard/s1/notestore'
+
+
+class testAsyncGeekNote(unittest.TestCase):
+    def setUp(self):
+        memo.memo.invalidate()
+        self.noteStore = FakeNoteStore()
+        patcher = patch('geeknote.transport.createClient',
+                        return_value=self.noteStore)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.asyncStore = AsyncGeekNote(GeekNoteOver(), concurrency=4)
+        self.addCleanup(self.asyncStore.close)
+
+    def test_load_note_content(self):
+        note = Types.Note(guid='n1', notebookGuid='nb1', tagGuids=['t1', 't2'])
+        self.asyncStore.run(self.asyncStore.loadNoteContent(note))
+        self.assertEqual(note.content, '<en-note>n1</en-note>')
+        self.assertEqual(note.notebookName, 'notebook nb1')
+        self.assertEqual(note.tagNames, ['tag t1', 'tag t2'])
+
+    def test_find_notes_all_pages(self):
+        self.noteStore.totalNotes = 35
+        result = self.asyncStore.run(self.asyncStore.findNotes('query', 100))
+        self.assertEqual([n.guid for n in result.notes],
+                         [str(i) for i in range(35)])
+
+    def test_find_notes_respects_count(self):
+        self.noteStore.totalNotes = 35
+        result = self.asyncStore.run(self.asyncStore.findNotes('query', 25))
+        self.assertEqual(len(result.notes), 25)
+
+    def test_concurrency_cap(self):
+        self.noteStore.delay = 0.02
+        self.asyncStore.run(self.asyncStore.gather(
+            *[self.asyncStore.call('getTag', str(i)) for i in range(20)]))
+        self.assertTrue(self.noteStore.maxInFlight > 1)
+        self.assertTrue(self.noteStore.maxInFlight <= 4)
+
+
+class testAsyncStoreInvalidated(unittest.TestCase):
+    def setUp(self):
+        self.saved = (GeekNote.storage, GeekNote.asyncStore)
+        GeekNote.storage = Mock()
+        self.addCleanup(self.restore)
+
+    def restore(self):
+        GeekNote.storage, GeekNote.asyncStore = self.saved
+
+    def test_invalidate_cache_drops_async_store(self):
+        geeknote = GeekNoteOver()
+        asyncStore = geeknote.getAsyncStore()
+        geeknote.invalidateCache()
+        self.assertIsNone(GeekNote.asyncStore)
+        with self.assertRaises(RuntimeError):
+            asyncStore.executor.submitNoteStore('getTag', '1')
+        self.assertIsNot(geeknote.getAsyncStore(), asyncStore)
+        geeknote.closeAsyncStore()
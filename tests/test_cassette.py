@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import unittest
+
+from mock import Mock
+from thrift.protocol.TBinaryProtocol import TBinaryProtocol
+from thrift.Thrift import TMessageType
+from thrift.transport.TTransport import TTransportException
+import evernote.edam.notestore.NoteStore as NoteStore
+import evernote.edam.type.ttypes as Types
+import evernote.edam.userstore.UserStore as UserStore
+from geeknote import cassette, memo, transport
+from geeknote.cassette import Cassette, scrub
+from geeknote.geeknote import GeekNote
+from geeknote.localserver import Corpus, LocalServer
+from geeknote.transport import TBytesBuffer
+
+
+class GeekNoteLocal(GeekNote):
+    def __init__(self, userStoreUri):
+        self.userStoreUri = userStoreUri
+        self.authToken = "token"
+        self.sleepOnRateLimit = False
+        self.storage = Mock()
+        self.storage.getCache.return_value = None
+
+    def getStorage(self):
+        return self.storage
+
+
+class testCassette(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, "session.cassette")
+        self.addCleanup(cassette.deactivate)
+        self.reset()
+        self.addCleanup(self.reset)
+
+    def reset(self):
+        GeekNote.userStore = None
+        GeekNote.noteStore = None
+        memo.memo.invalidate()
+        transport.pool.clear()
+
+    def session(self, userStoreUri, token="token"):
+        geeknote = GeekNoteLocal(userStoreUri)
+        geeknote.authToken = token
+        notes = geeknote.findNotes("Note", 10)
+        content = geeknote.getNoteContent(notes.notes[0].guid)
+        return [n.title for n in notes.notes], content
+
+    def record(self, latency=0.0, token="token"):
+        with LocalServer(Corpus.generate(notes=20), latency=latency) as server:
+            cassette.activate(Cassette(self.path), "record")
+            result = self.session(server.userStoreUri, token)
+            cassette.active.save()
+            return server.userStoreUri, result
+
+    def test_record_and_replay(self):
+        uri, recorded = self.record()
+        self.reset()
+        # the server is gone, answers come from the cassette
+        cassette.activate(Cassette.load(self.path), "replay", 0)
+        self.assertEqual(self.session(uri), recorded)
+
+    def test_token_not_recorded(self):
+        uri, recorded = self.record(token="S=s1:U=1:E=secret")
+        with gzip.open(self.path, "rb") as f:
+            self.assertNotIn(b"secret", f.read())
+        self.reset()
+        cassette.activate(Cassette.load(self.path), "replay", 0)
+        self.assertEqual(self.session(uri, "S=s1:U=1:E=other"), recorded)
+
+    def test_form_scrubbed(self):
+        self.assertEqual(scrub(b"auth=S%3Ds1%3Asecret&data=true"),
+                         b"auth=&data=true")
+
+    def resultClass(self, name):
+        return (getattr(UserStore, name + "_result", None)
+                or getattr(NoteStore, name + "_result"))
+
+    def reply(self, name, success):
+        buf = TBytesBuffer()
+        protocol = TBinaryProtocol(buf)
+        protocol.writeMessageBegin(name, TMessageType.REPLY, 1)
+        self.resultClass(name)(success=success).write(protocol)
+        protocol.writeMessageEnd()
+        return buf.getvalue()
+
+    def read(self, name, message):
+        protocol = TBinaryProtocol(TBytesBuffer(message))
+        protocol.readMessageBegin()
+        result = self.resultClass(name)()
+        result.read(protocol)
+        return result.success
+
+    def test_user_scrubbed(self):
+        user = Types.User(id=1, shardId="s1", username="me", email="me@mail",
+                          name="Me", accounting=Types.Accounting(
+                              uploadLimit=10, premiumOrderNumber="123"))
+        user = self.read("getUser", scrub(self.reply("getUser", user), "_result"))
+        self.assertEqual((user.id, user.shardId), (1, "s1"))
+        self.assertEqual((user.username, user.email, user.name), ("", "", ""))
+        self.assertEqual(user.accounting,
+                         Types.Accounting(uploadLimit=10))
+
+    def test_share_key_scrubbed(self):
+        linked = [Types.LinkedNotebook(shareName="Team", shareKey="secret",
+                                       username="owner")]
+        message = scrub(self.reply("listLinkedNotebooks", linked), "_result")
+        self.assertNotIn(b"secret", message)
+        linked = self.read("listLinkedNotebooks", message)
+        self.assertEqual(linked[0].shareName, "Team")
+        self.assertEqual(linked[0].shareKey, "")
+
+    def test_pickle_not_loaded(self):
+        with gzip.open(self.path, "wb") as f:
+            pickle.dump({"version": cassette.VERSION, "interactions": []}, f)
+        with self.assertRaises(ValueError):
+            Cassette.load(self.path)
+
+    def test_stats(self):
+        self.record()
+        stats = Cassette.load(self.path).getStats()
+        self.assertEqual(list(stats.keys()),
+                         ["checkVersion", "getNoteStoreUrl",
+                          "findNotesMetadata", "getNoteContent"])
+        self.assertEqual(stats["findNotesMetadata"]["calls"], 1)
+
+    def test_replay_latency(self):
+        uri, recorded = self.record(latency=0.05)
+        self.reset()
+        cassette.activate(Cassette.load(self.path), "replay", 2.0)
+        start = time.time()
+        self.session(uri)
+        self.assertTrue(time.time() - start >= 0.3)
+
+    def test_unrecorded_call(self):
+        uri, recorded = self.record()
+        self.reset()
+        cassette.activate(Cassette.load(self.path), "replay", 0)
+        self.session(uri)
+        with self.assertRaises(TTransportException):
+            GeekNote.noteStore.listTags("token")
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import Mock, patch
+from geeknote import download, memo, transport
+from geeknote.aio import AsyncGeekNote
+from geeknote.download import (DownloadError, downloadResource,
+                               getPartialPath, getResourceUrl)
+from geeknote.geeknote import GeekNote
+from geeknote.localserver import Corpus, LocalServer
+from geeknote.transport import ConnectionPool
+
+
+class GeekNoteLocal(GeekNote):
+    def __init__(self, userStoreUri):
+        self.userStoreUri = userStoreUri
+        self.authToken = 'token'
+        self.sleepOnRateLimit = False
+        self.storage = Mock()
+        self.storage.getCache.return_value = None
+
+    def getStorage(self):
+        return self.storage
+
+
+class testDownload(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+        self.body = os.urandom(300 * 1024)
+        self.hash = hashlib.md5(self.body).digest()
+        self.corpus = Corpus()
+        note = self.corpus.addNote('Attachment', '<en-note/>',
+                                   resources=[(self.body, 'video/mp4')])
+        self.note = note
+        self.resource = note.resources[0]
+        self.server = LocalServer(self.corpus).start()
+        self.addCleanup(self.server.stop)
+        self.pool = ConnectionPool()
+        self.addCleanup(self.pool.clear)
+        self.url = getResourceUrl(self.server.noteStoreUrl, self.resource.guid)
+        self.filename = os.path.join(self.test_dir, 'video.mp4')
+
+    def download(self, bodyHash=None):
+        downloadResource(self.url, 'token', self.filename,
+                         bodyHash or self.hash, len(self.body),
+                         connectionPool=self.pool)
+
+    def assertDownloaded(self):
+        with open(self.filename, 'rb') as f:
+            self.assertEqual(f.read(), self.body)
+        self.assertEqual(os.listdir(self.test_dir), ['video.mp4'])
+
+    def test_resource_url(self):
+        self.assertEqual(
+            getResourceUrl('https://www.evernote.com/shard/s1/notestore', 'g'),
+            'https://www.evernote.com/shard/s1/res/g')
+
+    def test_streamed(self):
+        with patch.object(download, 'CHUNK_SIZE', 4096):
+            self.download()
+        self.assertDownloaded()
+        self.assertEqual(self.server.sent, len(self.body))
+        self.assertEqual(self.pool.getStats()['opened'], 1)
+
+    def test_partial_resumed(self):
+        with open(getPartialPath(self.filename), 'wb') as f:
+            f.write(self.body[:100000])
+        self.download()
+        self.assertDownloaded()
+        self.assertEqual(self.server.sent, len(self.body) - 100000)
+
+    def test_complete_partial_not_requested(self):
+        with open(getPartialPath(self.filename), 'wb') as f:
+            f.write(self.body)
+        self.download()
+        self.assertDownloaded()
+        self.assertNotIn('res', self.server.calls)
+
+    def test_interrupted_download_resumed(self):
+        stream = download._stream
+        calls = []
+
+        def interrupted(pool, parsed, port, authToken, partial, md5, offset):
+            calls.append(offset)
+            if len(calls) == 1:
+                with open(partial, 'wb') as f:
+                    f.write(self.body[:5000])
+                raise ConnectionResetError()
+            return stream(pool, parsed, port, authToken, partial, md5, offset)
+
+        with patch.object(download, '_stream', interrupted):
+            self.download()
+        self.assertDownloaded()
+        self.assertEqual(calls, [0, 5000])
+
+    def test_hash_mismatch(self):
+        self.assertRaises(DownloadError, self.download, b'0' * 16)
+        self.assertEqual(os.listdir(self.test_dir), [])
+
+    def test_unknown_resource(self):
+        self.url = getResourceUrl(self.server.noteStoreUrl, 'missing')
+        self.assertRaises(DownloadError, self.download)
+        self.assertEqual(os.listdir(self.test_dir), [])
+
+
+class testSaveMedia(testDownload):
+    def setUp(self):
+        super(testSaveMedia, self).setUp()
+        self.reset()
+        self.addCleanup(self.reset)
+        self.geeknote = GeekNoteLocal(self.server.userStoreUri)
+
+    def reset(self):
+        GeekNote.userStore = None
+        GeekNote.noteStore = None
+        memo.memo.invalidate()
+        transport.pool.clear()
+
+    def test_save_media_streamed(self):
+        self.assertTrue(self.geeknote.saveMedia(self.note.guid, self.hash,
+                                                self.filename))
+        self.assertDownloaded()
+        self.assertEqual(self.server.calls['res'], 1)
+        self.assertLess(self.server.calls['getResourceByHash'], 2)
+
+    def test_async_save_media_streamed(self):
+        asyncStore = AsyncGeekNote(self.geeknote, concurrency=1)
+        self.addCleanup(asyncStore.close)
+        self.assertTrue(asyncStore.run(
+            asyncStore.saveMedia(self.note.guid, self.hash, self.filename)))
+        self.assertDownloaded()
+        self.assertEqual(self.server.calls['res'], 1)
+
+    def test_save_media_fallback(self):
+        with patch('geeknote.download.downloadResource',
+                   side_effect=DownloadError('HTTP 404')):
+            self.assertTrue(self.geeknote.saveMedia(self.note.guid, self.hash,
+                                                    self.filename))
+        self.assertDownloaded()
+        self.assertEqual(self.server.calls['getResourceByHash'], 2)
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import threading
+import unittest
+from io import StringIO
+
+from mock import Mock, patch
+from evernote.edam.error.ttypes import EDAMNotFoundException, EDAMUserException
+import evernote.edam.type.ttypes as Types
+import evernote.edam.userstore.ttypes as UserStoreTypes
+from geeknote import tools
+from geeknote.executor import (SHARED_AUTH_MARGIN, GeekNoteExecutor,
+                               GeekNoteWorker, InlineExecutor,
+                               LinkedNotebookWorker)
+from geeknote.geeknote import GeekNote
+
+
+class FakeNoteStore(object):
+    """ NoteStore client remembering the thread which created it """
+
+    def __init__(self):
+        self.thread = threading.current_thread()
+
+    def _check(self):
+        assert self.thread is threading.current_thread()
+
+    def getNote(self, authToken, guid, *args):
+        self._check()
+        if guid == 'missing':
+            raise EDAMNotFoundException('Note.guid', guid)
+        if guid == 'denied':
+            raise EDAMUserException(errorCode=3)
+        return Types.Note(guid=guid, title='title ' + guid)
+
+    def getNoteContent(self, authToken, guid):
+        self._check()
+        return '<en-note>%s</en-note>' % guid
+
+
+class GeekNoteOver(GeekNote):
+    def __init__(self):
+        self.authToken = 'token'
+        self.sleepOnRateLimit = False
+
+    def getNoteStoreUrl(self):
+        return 'https://www.evernote.com/shard/s1/notestore'
+
+
+class testGeekNoteExecutor(unittest.TestCase):
+    def setUp(self):
+        self.clients = []
+
+        def createClient(clientClass, uri):
+            client = FakeNoteStore()
+            self.clients.append(client)
+            return client
+
+        patcher = patch('geeknote.transport.createClient', side_effect=createClient)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.stderr, sys.stderr = sys.stderr, StringIO()
+        self.addCleanup(setattr, sys, 'stderr', self.stderr)
+        self.executor = GeekNoteExecutor(GeekNoteOver(), workers=4)
+        self.addCleanup(self.executor.shutdown)
+
+    def test_map_get_note(self):
+        guids = [str(i) for i in range(20)]
+        notes = list(self.executor.map('getNote', guids))
+        self.assertEqual([n.guid for n in notes], guids)
+
+    def test_transport_per_thread(self):
+        list(self.executor.map('getNoteContent', [str(i) for i in range(20)]))
+        threads = [client.thread for client in self.clients]
+        self.assertEqual(len(threads), len(set(threads)))
+        self.assertTrue(len(self.clients) <= 4)
+
+    def test_worker_has_own_storage(self):
+        storage = self.executor.submit('getStorage').result()
+        self.assertIsNotNone(storage)
+        self.assertIsNot(storage, GeekNote.storage)
+
+    def test_not_found_returns_none(self):
+        self.assertIsNone(self.executor.getNote('missing').result())
+        self.assertEqual(self.executor.getNote('found').result().guid, 'found')
+
+    def test_permission_denied_exits(self):
+        future = self.executor.getNote('denied')
+        with self.assertRaises(tools.ExitException):
+            future.result()
+
+
+class testInlineExecutor(unittest.TestCase):
+    def test_result(self):
+        self.assertEqual(InlineExecutor().submit(len, 'abc').result(), 3)
+
+    def test_exit_raised_from_result(self):
+        def denied():
+            sys.exit(1)
+
+        with patch('sys.exit', side_effect=SystemExit):
+            future = InlineExecutor().submit(denied)
+        with self.assertRaises(tools.ExitException):
+            future.result()
+
+
+class testGeekNoteWorker(unittest.TestCase):
+    def test_invalidate_cache_drops_transport(self):
+        worker = GeekNoteWorker('token', 'https://www.evernote.com/shard/s1/notestore')
+        worker.noteStore = FakeNoteStore()
+        worker.invalidateCache()
+        self.assertIsNone(worker.noteStore)
+
+
+class testLinkedNotebookWorker(unittest.TestCase):
+    def setUp(self):
+        linked = Types.LinkedNotebook(
+            shareName='Team', shareKey='key',
+            noteStoreUrl='https://www.evernote.com/shard/s2/notestore')
+        with patch('geeknote.executor.Storage'):
+            self.worker = LinkedNotebookWorker(linked, 'token')
+        self.worker.sleepOnRateLimit = False
+        self.worker.storage.getCache.return_value = None
+        self.worker.noteStore = Mock()
+        self.worker.noteStore.authenticateToSharedNotebook.return_value = \
+            UserStoreTypes.AuthenticationResult(
+                currentTime=0, expiration=3600 * 1000,
+                authenticationToken='shared')
+        self.worker.noteStore.getSharedNotebookByAuth.return_value = \
+            Types.SharedNotebook(notebookGuid='guid')
+
+    def test_authenticate(self):
+        self.assertEqual(self.worker.authenticate(), 'guid')
+        self.assertEqual(self.worker.authToken, 'shared')
+        self.worker.noteStore.authenticateToSharedNotebook.assert_called_with(
+            'key', 'token')
+        self.worker.storage.setCache.assert_called_with(
+            'sharedAuth:key', ('shared', 'guid'), 3600 - SHARED_AUTH_MARGIN)
+
+    def test_cached_auth(self):
+        self.worker.storage.getCache.return_value = ('cached', 'guid')
+        self.assertEqual(self.worker.authenticate(), 'guid')
+        self.assertEqual(self.worker.authToken, 'cached')
+        self.worker.noteStore.authenticateToSharedNotebook.assert_not_called()
+
+    def test_search_in_notebook(self):
+        self.worker.notebookGuid = 'guid'
+        noteFilter = self.worker.buildNoteFilter('notebook:"Team" intitle:"a"')
+        self.assertEqual(noteFilter.notebookGuid, 'guid')
+        self.assertEqual(noteFilter.words, 'intitle:"a"')
+        self.assertIsNone(self.worker.buildNoteFilter('notebook:"Team"').words)
@@ -4,10 +4,13 @@ import sys
 import time
 import unittest
 from io import StringIO
+from mock import Mock
 from geeknote.geeknote import *
 from geeknote import tools
 from geeknote.editor import Editor
-from geeknote.storage import Storage
+from geeknote.storage import Base, Storage
+from sqlalchemy.engine import create_engine
+from sqlalchemy.orm.session import sessionmaker
 
 
 class GeekNoteOver(GeekNote):
@@ -133,3 +136,68 @@ class testNotes(unittest.TestCase):
         with self.assertRaises(tools.ExitException):
             self.notes._createSearchRequest(search="test text",
                                             date="12-31-1999")
+
+
+class testGeekNoteCache(unittest.TestCase):
+    def setUp(self):
+        self.saved = (GeekNote.storage, GeekNote.userStore, GeekNote.noteStore)
+        self.storage = Mock()
+        GeekNote.storage = self.storage
+        GeekNote.userStore = Mock()
+        GeekNote.noteStore = None
+        self.geeknote = GeekNoteOver()
+        self.geeknote.sleepOnRateLimit = False
+        self.url = 'https://www.evernote.com/shard/s1/notestore'
+
+    def tearDown(self):
+        GeekNote.storage, GeekNote.userStore, GeekNote.noteStore = self.saved
+
+    def test_note_store_url_from_cache(self):
+        self.storage.getCache.return_value = self.url
+        self.assertEqual(self.geeknote.getNoteStoreUrl(), self.url)
+        GeekNote.userStore.getNoteStoreUrl.assert_not_called()
+
+    def test_note_store_url_cached(self):
+        self.storage.getCache.return_value = None
+        GeekNote.userStore.getNoteStoreUrl.return_value = self.url.encode('utf-8')
+        self.assertEqual(self.geeknote.getNoteStoreUrl(), self.url)
+        self.storage.setCache.assert_called_with('noteStoreUrl', self.url)
+
+    def test_shard_info_cached(self):
+        self.storage.getCache.return_value = None
+        GeekNote.userStore.getUser.return_value = tools.Struct(id=1, shardId='s1')
+        self.assertEqual(self.geeknote.getShardInfo(), (1, 's1'))
+        self.storage.setCache.assert_called_with('shardInfo', (1, 's1'))
+
+    def test_version_check_cached(self):
+        self.storage.getCache.return_value = True
+        self.geeknote.checkVersion()
+        GeekNote.userStore.checkVersion.assert_not_called()
+
+    def test_not_found_invalidates_cache(self):
+        GeekNote.noteStore = Mock()
+        GeekNote.noteStore.getNote.side_effect = EDAMNotFoundException('Note.guid', 'guid')
+        self.stderr, sys.stderr = sys.stderr, StringIO()
+        try:
+            self.assertIsNone(self.geeknote.getNote('guid'))
+        finally:
+            sys.stderr = self.stderr
+        self.storage.delCache.assert_any_call('noteStoreUrl')
+        self.storage.delCache.assert_any_call('shardInfo')
+        self.storage.delCache.assert_any_call(prefix='versionOK:')
+        self.assertIsNone(GeekNote.noteStore)
+
+    def test_invalidate_keeps_other_cache(self):
+        engine = create_engine('sqlite:///:memory:', echo=False)
+        Base.metadata.create_all(engine)
+        storage = Storage.__new__(Storage)
+        storage.session = sessionmaker(bind=engine)()
+        GeekNote.storage = storage
+        for key in ('noteStoreUrl', 'shardInfo', 'versionOK:1.28',
+                    'rateLimit', 'sharedAuth:key'):
+            storage.setCache(key, key)
+        self.geeknote.invalidateCache()
+        for key in ('noteStoreUrl', 'shardInfo', 'versionOK:1.28'):
+            self.assertIsNone(storage.getCache(key))
+        for key in ('rateLimit', 'sharedAuth:key'):
+            self.assertEqual(storage.getCache(key), key)
@@ -1,10 +1,25 @@
 # -*- encoding: utf-8 -*-
 from mock import patch, ANY, Mock
+import datetime
+import hashlib
 import os
 import unittest
 import shutil
+import tempfile
+import threading
+import time
 from helpers import AnyStringWith
-from geeknote.gnsync import remove_control_characters, GNSync
+import evernote.edam.type.ttypes as Types
+from evernote.edam.notestore.NoteStore import (NoteFilter, SyncChunkFilter,
+                                               NotesMetadataResultSpec)
+from evernote.edam.error.ttypes import EDAMErrorCode, EDAMSystemException
+from geeknote.gnsync import (remove_control_characters, GNSync, SyncAction,
+                             TitleIndex, convert_file, format_plan,
+                             split_masks, sync_all, sync_linked, sync_tree,
+                             tree_notebooks, write_atomic)
+from geeknote import journal, localserver, memo, ratelimit, tools, transport
+from geeknote.geeknote import GeekNote
+from geeknote.localserver import Corpus, LocalServer, NoteStoreHandler
 
 
 class testGnsync(unittest.TestCase):
@@ -60,12 +75,9 @@ _한국어 입력입니다. 잘 되나요?_
     @patch('geeknote.gnsync.Storage', autospec=True)
     def test_create_file_with_non_ascii_chars(self, mock_storage, mock_geeknote, mock_logger):
 
-        # Mock GeekNote#loadNoteContent to provide some content with non-ascii
-        def mock_note_load(note):
-            with open('tests/fixtures/Test Note with non-ascii.xml', 'r') as f:
-                note.content = f.read()
-            note.notebookName = 'testNotebook'
-        mock_geeknote.return_value.loadNoteContent.side_effect = mock_note_load
+        # Mock GeekNote#getNoteContent to provide some content with non-ascii
+        with open('tests/fixtures/Test Note with non-ascii.xml', 'r') as f:
+            mock_geeknote.return_value.getNoteContent.return_value = f.read()
 
         # Mock Storage().getUserToken() so the GNSync constructor doesn't throw
         # an exception
@@ -77,6 +89,7 @@ _한국어 입력입니다. 잘 되나요?_
         mock_note = Mock()
         mock_note.guid = '123abc'
         mock_note.title = 'Test Note'
+        mock_note.updated = 1000
 
         subject._create_file(mock_note)
 
@@ -88,3 +101,1007 @@ _한국어 입력입니다. 잘 되나요?_
 
         with open(self.test_dir + "/Test Note.txt", 'r', encoding='utf-8') as f:
             self.assertIn("œ ž © µ ¶ å õ ý þ ß Ü", f.read())
+
+
+class LocalGeekNote(object):
+    """ GeekNote answering from a local corpus """
+
+    def __init__(self, corpus):
+        self.handler = NoteStoreHandler(corpus)
+        self.calls = []
+
+    def findNotebooks(self):
+        self.calls.append('findNotebooks')
+        return self.handler.listNotebooks('token')
+
+    def getSyncState(self):
+        self.calls.append('getSyncState')
+        return self.handler.getSyncState('token')
+
+    def getSyncChunk(self, afterUSN, maxEntries=None, withExpunged=True):
+        self.calls.append('getSyncChunk')
+        syncFilter = SyncChunkFilter(includeNotes=True,
+                                     includeExpunged=withExpunged)
+        return self.handler.getFilteredSyncChunk('token', afterUSN, 5,
+                                                 syncFilter)
+
+    def findNotes(self, keywords, count):
+        self.calls.append('findNotes')
+        notebook = [n for n in self.handler.listNotebooks('token')
+                    if keywords == 'notebook:"%s"' % n.name][0]
+        spec = NotesMetadataResultSpec(includeTitle=True, includeUpdated=True,
+                                       includeNotebookGuid=True)
+        return self.handler.findNotesMetadata(
+            'token', NoteFilter(notebookGuid=notebook.guid), 0, count, spec)
+
+    def getNoteContent(self, guid):
+        self.calls.append('getNoteContent')
+        return self.handler.getNoteContent('token', guid)
+
+    def createNote(self, title, content, tags=None, created=None,
+                   notebook=None):
+        self.calls.append('createNote')
+        note = Types.Note(title=title, content=content, notebookGuid=notebook)
+        return self.handler.createNote('token', note)
+
+    def updateNote(self, guid, title=None, content=None, tags=None,
+                   notebook=None):
+        self.calls.append('updateNote')
+        note = Types.Note(guid=guid, title=title, content=content)
+        return self.handler.updateNote('token', note)
+
+
+class FakeStorage(object):
+    def __init__(self):
+        self.synced = {}
+        self.runs = {}
+        self.manifest = {}
+        self.resources = {}
+        self.cache = {}
+
+    def getUserToken(self):
+        return 'token'
+
+    def getCache(self, key):
+        return self.cache.get(key)
+
+    def setCache(self, key, value, ttl=None):
+        self.cache[key] = value
+        return True
+
+    def getUserInfo(self):
+        return None
+
+    def getNotebookSync(self, account, notebook):
+        return self.synced.get((account, notebook))
+
+    def setNotebookSync(self, account, notebook, updateCount, notes):
+        self.synced[(account, notebook)] = (updateCount, dict(notes),
+                                            datetime.datetime.now())
+        return True
+
+    def getSyncRun(self, account, path):
+        return self.runs.get((account, path))
+
+    def setSyncRun(self, account, path, updateCount, fingerprint):
+        self.runs[(account, path)] = (updateCount, fingerprint)
+        return True
+
+    def getManifest(self, account, directory):
+        return dict(self.manifest.get(directory, {}))
+
+    def setManifestEntry(self, account, directory, path, entry):
+        self.manifest.setdefault(directory, {})[path] = dict(entry)
+        return True
+
+    def delManifestEntry(self, account, directory, path):
+        self.manifest.get(directory, {}).pop(path, None)
+        return True
+
+    def setManifestEntries(self, account, directory, entries):
+        manifest = self.manifest.setdefault(directory, {})
+        for path, entry in entries.items():
+            if entry is None:
+                manifest.pop(path, None)
+            else:
+                manifest[path] = dict(entry)
+        return True
+
+    def getResourceHash(self, path, size, mtime):
+        cached = self.resources.get(path)
+        if cached and cached[:2] == (size, mtime):
+            return cached[2:]
+
+    def getResourceHashes(self, directory):
+        return dict((path, entry) for path, entry in self.resources.items()
+                    if path.startswith(os.path.join(directory, '')))
+
+    def setResourceHash(self, path, size, mtime, bodyHash, mime):
+        self.resources[path] = (size, mtime, bodyHash, mime)
+        return True
+
+
+class testGnsyncIncremental(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+        self.corpus = Corpus.generate(notes=20, notebooks=2, tags=0)
+        self.geeknote = LocalGeekNote(self.corpus)
+        self.storage = FakeStorage()
+        for target, value in (('GeekNote', Mock(return_value=self.geeknote)),
+                              ('Storage', Mock(return_value=self.storage))):
+            patcher = patch('geeknote.gnsync.' + target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.subject = GNSync('Notebook 0', self.test_dir, '*.*', 'plain')
+
+    def titles(self):
+        return sorted(n.title for n in self.subject._get_notes())
+
+    def test_first_run_lists_notebook(self):
+        self.geeknote.calls = []
+        self.assertEqual(len(self.titles()), 10)
+        self.assertEqual(self.geeknote.calls, ['getSyncState', 'findNotes'])
+
+    def test_unchanged_account(self):
+        first = self.titles()
+        self.geeknote.calls = []
+        self.assertEqual(self.titles(), first)
+        self.assertEqual(self.geeknote.calls, ['getSyncState'])
+
+    def test_changes_merged(self):
+        self.titles()
+        notebooks = list(self.corpus.notebooks.values())
+        notes = [n for n in self.corpus.notes.values()
+                 if n.notebookGuid == self.subject.notebook_guid]
+
+        self.corpus.addNote('New', '<en-note/>', self.subject.notebook_guid)
+        self.corpus.addNote('Elsewhere', '<en-note/>', notebooks[0].guid)
+        self.geeknote.handler.expungeNote('token', notes[0].guid)
+        self.geeknote.handler.deleteNote('token', notes[1].guid)
+        moved = Types.Note(guid=notes[2].guid, notebookGuid=notebooks[2].guid)
+        self.geeknote.handler.updateNote('token', moved)
+        renamed = Types.Note(guid=notes[3].guid, title='Renamed')
+        self.geeknote.handler.updateNote('token', renamed)
+
+        self.geeknote.calls = []
+        expected = sorted([n.title for n in notes[4:]] + ['New', 'Renamed'])
+        self.assertEqual(self.titles(), expected)
+        self.assertNotIn('findNotes', self.geeknote.calls)
+        self.assertEqual(
+            self.storage.synced[('default', self.subject.notebook_guid)][0],
+            self.corpus.updateCount)
+
+    def test_stale_state_lists_notebook(self):
+        self.titles()
+        key = ('default', self.subject.notebook_guid)
+        count, notes, timestamp = self.storage.synced[key]
+        self.storage.synced[key] = (count + 100, notes, timestamp)
+        self.geeknote.calls = []
+        self.titles()
+        self.assertEqual(self.geeknote.calls, ['getSyncState', 'findNotes'])
+
+    def test_unchanged_sync_skipped(self):
+        self.subject.sync()
+        self.geeknote.calls = []
+        subject = GNSync('Notebook 0', self.test_dir, '*.*', 'plain')
+        self.assertTrue(subject.unchanged)
+        subject.sync()
+        self.assertEqual(self.geeknote.calls, ['getSyncState'])
+
+    def test_failed_sync_not_recorded(self):
+        with open(os.path.join(self.test_dir, 'note.txt'), 'w') as f:
+            f.write('text')
+        with patch.object(GNSync, '_create_note', return_value=None):
+            self.subject.sync()
+        self.assertEqual(self.subject.stats['failed'], 1)
+        subject = GNSync('Notebook 0', self.test_dir, '*.*', 'plain')
+        self.assertFalse(subject.unchanged)
+
+    def test_local_change_detected(self):
+        self.subject.sync()
+        with open(os.path.join(self.test_dir, 'note.txt'), 'w') as f:
+            f.write('text')
+        subject = GNSync('Notebook 0', self.test_dir, '*.*', 'plain')
+        self.assertFalse(subject.unchanged)
+
+    def test_remote_change_detected(self):
+        self.subject.sync()
+        self.corpus.addNote('New', '<en-note/>', self.subject.notebook_guid)
+        subject = GNSync('Notebook 0', self.test_dir, '*.*', 'plain')
+        self.assertFalse(subject.unchanged)
+
+    def test_options_change_detected(self):
+        self.subject.sync()
+        subject = GNSync('Notebook 0', self.test_dir, '*.*', 'markdown')
+        self.assertFalse(subject.unchanged)
+
+
+class testGnsyncManifest(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+        self.corpus = Corpus.generate(notes=0, notebooks=1, tags=0)
+        self.geeknote = LocalGeekNote(self.corpus)
+        self.storage = FakeStorage()
+        for target, value in (('GeekNote', Mock(return_value=self.geeknote)),
+                              ('Storage', Mock(return_value=self.storage))):
+            patcher = patch('geeknote.gnsync.' + target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.write('first.txt', 'first')
+        self.sync()
+
+    def write(self, name, content):
+        path = os.path.join(self.test_dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def sync(self, **options):
+        subject = GNSync('Notebook 0', self.test_dir, '*.*', 'plain', **options)
+        self.geeknote.calls = []
+        subject.sync()
+        return subject
+
+    def manifest(self):
+        return self.storage.manifest[os.path.realpath(self.test_dir)]
+
+    def notes(self):
+        return sorted(n.title for n in self.corpus.notes.values())
+
+    def test_uploaded_file_recorded(self):
+        entry = self.manifest()[os.path.join(os.path.realpath(self.test_dir),
+                                             'first.txt')]
+        self.assertEqual(entry['title'], 'first')
+        self.assertIn(entry['guid'], self.corpus.notes)
+        self.assertEqual(entry['size'], 5)
+
+    def test_unchanged_file_not_read(self):
+        self.write('second.txt', 'second')
+        with patch('geeknote.gnsync.convert_file',
+                   wraps=convert_file) as convert:
+            self.sync()
+        self.assertEqual([c[0][0] for c in convert.call_args_list],
+                         [os.path.join(self.test_dir, 'second.txt')])
+        self.assertEqual([c for c in self.geeknote.calls if 'Note' in c],
+                         ['createNote'])
+
+    def test_rename_updates_note(self):
+        guid = list(self.corpus.notes)[0]
+        os.rename(os.path.join(self.test_dir, 'first.txt'),
+                  os.path.join(self.test_dir, 'renamed.txt'))
+        self.sync()
+        self.assertNotIn('createNote', self.geeknote.calls)
+        self.assertEqual(self.corpus.notes[guid].title, 'renamed')
+        self.assertEqual([e['guid'] for e in self.manifest().values()], [guid])
+
+    def test_same_upload_skipped(self):
+        path = os.path.join(self.test_dir, 'first.txt')
+        later = time.time() + 60
+        os.utime(path, (later, later))
+        self.sync()
+        self.assertNotIn('updateNote', self.geeknote.calls)
+        self.assertEqual(self.notes(), ['first'])
+
+    def test_touched_file_not_uploaded(self):
+        path = os.path.join(self.test_dir, 'first.txt')
+        earlier = time.time() - 3600
+        os.utime(path, (earlier, earlier))
+        with patch.object(GNSync, '_get_file_hash',
+                          side_effect=GNSync._get_file_hash,
+                          autospec=True) as hashed:
+            self.sync()
+            self.sync()
+        self.assertNotIn('updateNote', self.geeknote.calls)
+        # hashed once, the manifest has the new mtime afterwards
+        self.assertEqual(hashed.call_count, 1)
+        entry = self.manifest()[os.path.realpath(path)]
+        self.assertEqual(entry['mtime'], int(earlier * 1000))
+
+    def test_newer_file_with_same_title_wins(self):
+        earlier = time.time() - 3600
+        path = os.path.join(self.test_dir, 'first.txt')
+        os.utime(path, (earlier, earlier))
+        self.sync()
+        self.write('first.md', 'newer')
+        subject = self.sync()
+        self.assertEqual(self.notes(), ['first'])
+        self.assertIn('newer', list(self.corpus.notes.values())[0].content)
+        self.assertEqual(subject.stats['skipped'], 0)
+
+    def test_older_changed_file_with_same_title_skipped(self):
+        path = self.write('first.md', 'older')
+        earlier = time.time() - 3600
+        os.utime(path, (earlier, earlier))
+        subject = self.sync()
+        self.assertNotIn('updateNote', self.geeknote.calls)
+        self.assertEqual(subject.stats['skipped'], 1)
+
+    def test_unchanged_note_not_downloaded(self):
+        path = os.path.join(self.test_dir, 'first.txt')
+        earlier = time.time() - 3600
+        os.utime(path, (earlier, earlier))
+        self.sync(twoway=True)
+        self.assertAlmostEqual(os.path.getmtime(path), earlier, places=2)
+        with open(path) as f:
+            self.assertEqual(f.read(), 'first')
+
+    def test_changed_note_downloaded(self):
+        guid = list(self.corpus.notes)[0]
+        path = os.path.join(self.test_dir, 'first.txt')
+        later = time.time() + 3600
+        os.utime(path, (later, later))
+        content = self.corpus.notes[guid].content.replace('first', 'changed')
+        self.geeknote.updateNote(guid, content=content)
+        self.sync(twoway=True)
+        with open(path) as f:
+            self.assertEqual(f.read().strip(), 'changed')
+        self.assertNotIn('updateNote', self.geeknote.calls)
+
+    def test_same_download_not_written(self):
+        guid = list(self.corpus.notes)[0]
+        path = os.path.join(self.test_dir, 'first.txt')
+        self.geeknote.updateNote(guid, title='first')
+        self.sync(twoway=True)
+        mtime = os.path.getmtime(path)
+        self.geeknote.updateNote(guid, title='first')
+        self.sync(twoway=True)
+        self.assertEqual(os.path.getmtime(path), mtime)
+        entry = self.manifest()[os.path.realpath(path)]
+        self.assertEqual(entry['usn'], self.corpus.notes[guid].updateSequenceNum)
+
+
+class testGnsyncWatch(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+        self.corpus = Corpus.generate(notes=0, notebooks=1, tags=0)
+        self.geeknote = LocalGeekNote(self.corpus)
+        self.storage = FakeStorage()
+        for target, value in (('GeekNote', Mock(return_value=self.geeknote)),
+                              ('Storage', Mock(return_value=self.storage))):
+            patcher = patch('geeknote.gnsync.' + target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.subject = GNSync('Notebook 0', self.test_dir, '*.txt', 'plain',
+                              twoway=True)
+        self.geeknote.calls = []
+        self.stop = threading.Event()
+        self.thread = threading.Thread(
+            target=self.subject.watch,
+            kwargs={'stop': self.stop, 'interval': 0.2, 'debounce': 0.05})
+        self.thread.start()
+        self.addCleanup(self.thread.join)
+        self.addCleanup(self.stop.set)
+
+    def waitFor(self, condition):
+        end = time.time() + 5
+        while not condition():
+            self.assertLess(time.time(), end)
+            time.sleep(0.02)
+
+    def titles(self):
+        return sorted(n.title for n in self.corpus.notes.values())
+
+    def waitForPoll(self):
+        # the state is asked for before and during the first sync,
+        # then by the watch loop
+        self.waitFor(lambda: self.geeknote.calls.count('getSyncState') >= 3)
+
+    def test_changed_file_pushed(self):
+        self.waitForPoll()
+        with open(os.path.join(self.test_dir, 'note.txt'), 'w') as f:
+            f.write('text')
+        with open(os.path.join(self.test_dir, 'ignored.md'), 'w') as f:
+            f.write('text')
+        self.waitFor(lambda: self.titles() == ['note'])
+        self.assertEqual(self.subject.stats['uploaded'], 1)
+
+    def test_remote_note_pulled(self):
+        self.waitForPoll()
+        notebook = [n.guid for n in self.corpus.notebooks.values()
+                    if n.name == 'Notebook 0'][0]
+        self.corpus.addNote('Remote', '<en-note><div>Remote</div></en-note>',
+                            notebook)
+        path = os.path.join(self.test_dir, 'Remote.txt')
+        self.waitFor(lambda: os.path.exists(path))
+
+
+class GeekNoteLocal(GeekNote):
+    def __init__(self, userStoreUri):
+        self.userStoreUri = userStoreUri
+        self.authToken = 'token'
+        self.sleepOnRateLimit = False
+        self.storage = Mock()
+        self.storage.getCache.return_value = None
+
+    def getStorage(self):
+        return self.storage
+
+
+class LocalServerCase(object):
+    """ gnsync against a LocalServer, mixed into TestCases """
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+        self.corpus = Corpus.generate(notes=0, notebooks=1, tags=0)
+        self.server = LocalServer(self.corpus).start()
+        self.addCleanup(self.server.stop)
+        self.reset()
+        self.addCleanup(self.reset)
+        self.storage = FakeStorage()
+        uri = self.server.userStoreUri
+        for target, value in (
+                ('GeekNote', Mock(side_effect=lambda **kw: GeekNoteLocal(uri))),
+                ('Storage', Mock(return_value=self.storage))):
+            patcher = patch('geeknote.gnsync.' + target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def reset(self):
+        GeekNote.userStore = None
+        GeekNote.noteStore = None
+        memo.memo.invalidate()
+        transport.pool.clear()
+
+
+class testGnsyncJobs(LocalServerCase, unittest.TestCase):
+    def test_parallel_upload(self):
+        for i in range(12):
+            with open(os.path.join(self.test_dir, 'Note %d.md' % i), 'w') as f:
+                f.write('# Heading %d\n' % i)
+        GNSync('Notebook 0', self.test_dir, '*.md', 'markdown', jobs=4).sync()
+
+        notes = dict((n.title, n) for n in self.corpus.notes.values())
+        self.assertEqual(sorted(notes),
+                         sorted('Note %d' % i for i in range(12)))
+        self.assertIn('Heading 3', notes['Note 3'].content)
+        manifest = self.storage.manifest[os.path.realpath(self.test_dir)]
+        self.assertEqual(sorted(e['guid'] for e in manifest.values()),
+                         sorted(n.guid for n in notes.values()))
+        self.assertEqual(self.server.calls['createNote'], 12)
+
+    def test_parallel_download(self):
+        notebook = [n.guid for n in self.corpus.notebooks.values()
+                    if n.name == 'Notebook 0'][0]
+        for i in range(12):
+            self.corpus.addNote('Note %d' % i,
+                                '<en-note><div>Line %d</div></en-note>' % i,
+                                notebook)
+        image = b'\x89PNG image'
+        content = ('<en-note><div>Picture</div><en-media type="image/png" '
+                   'hash="%s"/></en-note>' % hashlib.md5(image).hexdigest())
+        picture = self.corpus.addNote('Picture', content, notebook,
+                                      resources=[(image, 'image/png')])
+
+        GNSync('Notebook 0', self.test_dir, '*.txt', 'plain',
+               download_only=True, jobs=4,
+               imageOptions={'saveImages': True,
+                             'imagesInSubdir': False}).sync()
+
+        with open(os.path.join(self.test_dir, 'Note 3.txt')) as f:
+            self.assertIn('Line 3', f.read())
+        path = os.path.join(self.test_dir, 'Picture.txt')
+        self.assertEqual(int(os.path.getmtime(path) * 1000), picture.updated)
+        with open(os.path.join(self.test_dir, 'Picture-%s.png'
+                               % hashlib.md5(image).hexdigest()), 'rb') as f:
+            self.assertEqual(f.read(), image)
+        self.assertEqual(self.server.calls['getNoteContent'], 13)
+        self.assertNotIn('getNotebook', self.server.calls)
+        self.assertEqual(
+            len(self.storage.manifest[os.path.realpath(self.test_dir)]), 13)
+        self.assertEqual([name for name in os.listdir(self.test_dir)
+                          if name.endswith('.tmp')], [])
+
+
+    def test_saved_images_not_downloaded(self):
+        notebook = [n.guid for n in self.corpus.notebooks.values()
+                    if n.name == 'Notebook 0'][0]
+        image = b'\x89PNG image'
+        hexHash = hashlib.md5(image).hexdigest()
+        content = ('<en-note><en-media type="image/png" hash="%s"/>'
+                   '</en-note>' % hexHash)
+        self.corpus.addNote('Picture', content, notebook,
+                            resources=[(image, 'image/png')])
+        path = os.path.join(self.test_dir, 'Picture.txt')
+        image_path = os.path.join(os.path.realpath(self.test_dir),
+                                  'Picture-%s.png' % hexHash)
+
+        def sync():
+            if os.path.exists(path):
+                os.remove(path)
+            self.storage.manifest.clear()
+            self.storage.runs.clear()
+            GNSync('Notebook 0', os.path.realpath(self.test_dir), '*.txt',
+                   'plain', download_only=True,
+                   imageOptions={'saveImages': True,
+                                 'imagesInSubdir': False}).sync()
+            self.assertTrue(os.path.exists(path))
+
+        sync()
+        self.assertEqual(self.server.calls['getResourceByHash'], 1)
+        self.assertEqual(self.server.calls['res'], 1)
+        self.assertEqual(self.storage.resources[image_path][2:],
+                         (hexHash, 'image/png'))
+
+        sync()
+        self.assertEqual(self.server.calls['getResourceByHash'], 1)
+
+        self.storage.resources.clear()
+        sync()
+        self.assertEqual(self.server.calls['getResourceByHash'], 1)
+        self.assertIn(image_path, self.storage.resources)
+
+        with open(image_path, 'wb') as f:
+            f.write(b'broken')
+        sync()
+        self.assertEqual(self.server.calls['getResourceByHash'], 2)
+        with open(image_path, 'rb') as f:
+            self.assertEqual(f.read(), image)
+
+
+class testGnsyncPlan(LocalServerCase, unittest.TestCase):
+    def populate(self):
+        notebook = [n.guid for n in self.corpus.notebooks.values()
+                    if n.name == 'Notebook 0'][0]
+        self.corpus.addNote('Remote', '<en-note>remote</en-note>', notebook)
+        old = self.corpus.addNote('Old', '<en-note>old</en-note>', notebook)
+        for name in ('Old', 'New'):
+            path = os.path.join(self.test_dir, name + '.txt')
+            with open(path, 'w') as f:
+                f.write(name)
+            os.utime(path, (old.updated / 1000 + 10,) * 2)
+
+    def gnsync(self, **options):
+        if not self.corpus.notes:
+            self.populate()
+        return GNSync('Notebook 0', self.test_dir, '*.txt', 'plain',
+                      twoway=True, **options)
+
+    def test_plan_not_run(self):
+        actions = self.gnsync().plan()
+
+        self.assertEqual([(a.kind, a.title) for a in actions],
+                         [('update-note', 'Old'), ('create-note', 'New'),
+                          ('create-file', 'Remote')])
+        self.assertEqual(len(self.corpus.notes), 2)
+        self.assertNotIn('createNote', self.server.calls)
+        self.assertEqual(sorted(os.listdir(self.test_dir)),
+                         ['New.txt', 'Old.txt'])
+        self.assertEqual(self.storage.manifest, {})
+
+        text = format_plan(actions, 'Notebook 0')
+        self.assertTrue(text.startswith('Notebook "Notebook 0":\nupdate-note '))
+        self.assertTrue(text.endswith(
+            '1 update-note, 1 create-note, 1 create-file'))
+
+    def test_sync_runs_plan(self):
+        self.gnsync().sync()
+        self.assertEqual(sorted(n.title for n in self.corpus.notes.values()),
+                         ['New', 'Old', 'Remote'])
+        self.assertIn('Remote.txt', os.listdir(self.test_dir))
+        self.assertEqual(self.gnsync().plan(), [])
+
+    def test_action_jobs(self):
+        for i in range(8):
+            with open(os.path.join(self.test_dir, 'Note %d.txt' % i), 'w') as f:
+                f.write('text')
+        active = []
+        most = [0]
+        lock = threading.Lock()
+        write = GNSync._write
+
+        def counted(gnsync, record, method, args):
+            if method != gnsync._create_note:
+                return write(gnsync, record, method, args)
+            with lock:
+                active.append(1)
+                most[0] = max(most[0], len(active))
+            time.sleep(0.02)
+            try:
+                return write(gnsync, record, method, args)
+            finally:
+                with lock:
+                    active.pop()
+
+        with patch('geeknote.gnsync.config.GNSYNC_ACTION_JOBS',
+                   {'create-note': 1}), \
+                patch.object(GNSync, '_write', counted):
+            self.gnsync(jobs=4).sync()
+        self.assertEqual(most[0], 1)
+        self.assertEqual(self.server.calls['createNote'], 9)
+
+    def test_order(self):
+        kinds = [SyncAction(kind, 'title', 'path', None)
+                 for kind in ('fetch-image', 'create-file', 'update-note')]
+        kinds.sort(key=lambda a: a.priority)
+        self.assertEqual([a.kind for a in kinds],
+                         ['update-note', 'create-file', 'fetch-image'])
+
+
+class testGnsyncAll(LocalServerCase, unittest.TestCase):
+    def test_notebooks_in_parallel(self):
+        corpus = Corpus.generate(notes=30, notebooks=3, tags=0)
+        self.corpus.notebooks = corpus.notebooks
+        self.corpus.notes = corpus.notes
+
+        summary = sync_all(self.test_dir, jobs=3, format='plain',
+                           download_only=True)
+
+        for notebook in corpus.notebooks.values():
+            count = len([n for n in corpus.notes.values()
+                         if n.notebookGuid == notebook.guid])
+            self.assertEqual(
+                len(os.listdir(os.path.join(self.test_dir, notebook.name))),
+                count)
+        self.assertEqual(self.server.calls['listNotebooks'], 1)
+        self.assertEqual(summary['notebooks'], 4)
+        self.assertEqual(summary['downloaded'], 30)
+        self.assertEqual(summary['failed'], 0)
+
+    def test_jobs_shared_out(self):
+        shares = []
+
+        def sync(subject):
+            shares.append(subject.jobs)
+
+        with patch.object(GNSync, 'sync', sync):
+            sync_all(self.test_dir, jobs=4, format='plain')
+            # the default notebook and Notebook 0
+            self.assertEqual(shares, [2, 2])
+            self.corpus.addNotebook('Notebook 1')
+            self.corpus.addNotebook('Notebook 2')
+            self.reset()
+            del shares[:]
+            sync_all(self.test_dir, jobs=4, format='plain')
+            self.assertEqual(shares, [1, 1, 1, 1])
+
+    def test_exit_ends_run(self):
+        with patch.object(GNSync, 'sync', side_effect=tools.ExitException(1)):
+            self.assertRaises(tools.ExitException, sync_all, self.test_dir,
+                              jobs=2, format='plain', download_only=True)
+
+
+class testGnsyncLinked(LocalServerCase, unittest.TestCase):
+    def share(self, name, notes):
+        notebook = self.corpus.addNotebook('Owned by someone ' + name)
+        for i in range(notes):
+            self.corpus.addNote('%s %d' % (name, i),
+                                '<en-note><div>Line %d</div></en-note>' % i,
+                                notebook.guid)
+        self.corpus.shareNotebook(notebook.guid, name)
+        return notebook
+
+    def sync(self, **options):
+        self.server.calls.clear()
+        with patch('geeknote.executor.Storage', Mock(return_value=self.storage)), \
+                patch.object(localserver, 'PAGE_SIZE', 5):
+            return sync_linked(self.test_dir, jobs=2, format='plain', **options)
+
+    def files(self, name):
+        return sorted(os.listdir(os.path.join(self.test_dir, name)))
+
+    def test_linked_notebooks_synced(self):
+        self.corpus.addNote('Own', '<en-note>own</en-note>')
+        self.share('Team', 12)
+        self.share('Project', 3)
+
+        summary = self.sync(download_only=True)
+
+        self.assertEqual(self.files('Team'),
+                         sorted('Team %d.txt' % i for i in range(12)))
+        self.assertEqual(self.files('Project'),
+                         ['Project 0.txt', 'Project 1.txt', 'Project 2.txt'])
+        self.assertEqual(summary['downloaded'], 15)
+        self.assertEqual(summary['notebooks'], 2)
+        # listed a page at a time
+        self.assertEqual(self.server.calls['findNotesMetadata'], 3 + 1)
+
+    def test_incremental_sync(self):
+        notebook = self.share('Team', 3)
+        self.sync(download_only=True)
+        self.corpus.addNote('Team new', '<en-note>new</en-note>', notebook.guid)
+
+        summary = self.sync(download_only=True)
+
+        self.assertIn('Team new.txt', self.files('Team'))
+        self.assertEqual(summary['downloaded'], 1)
+        self.assertNotIn('findNotesMetadata', self.server.calls)
+        self.assertEqual(self.server.calls['getLinkedNotebookSyncChunk'], 1)
+        # the shared auth token is cached
+        self.assertNotIn('authenticateToSharedNotebook', self.server.calls)
+
+    def test_upload_to_linked_notebook(self):
+        notebook = self.share('Team', 1)
+        os.mkdir(os.path.join(self.test_dir, 'Team'))
+        with open(os.path.join(self.test_dir, 'Team', 'Draft.txt'), 'w') as f:
+            f.write('draft')
+
+        self.sync(twoway=True)
+
+        notes = [n for n in self.corpus.notes.values()
+                 if n.notebookGuid == notebook.guid]
+        self.assertEqual(sorted(n.title for n in notes), ['Draft', 'Team 0'])
+        self.assertEqual(self.files('Team'), ['Draft.txt', 'Team 0.txt'])
+
+
+class testGnsyncTree(LocalServerCase, unittest.TestCase):
+    def write(self, path, content='text'):
+        path = os.path.join(self.test_dir, path)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_tree_notebooks(self):
+        for path in ['top.txt', 'Work/a.txt', 'Work/Ideas/b.txt',
+                     'Work/Ideas/Old/c.txt', 'Skip/d.txt']:
+            self.write(path)
+        self.write('.gnsyncignore', 'Skip/\n')
+        notebooks = [(notebook, os.path.relpath(path, self.test_dir),
+                      options.get('stack'))
+                     for notebook, path, options
+                     in tree_notebooks(self.test_dir, 'Top')]
+        self.assertEqual(notebooks, [
+            ('Top', '.', None),
+            ('Work', 'Work', None),
+            ('Ideas', os.path.join('Work', 'Ideas'), 'Work'),
+            ('Ideas-Old', os.path.join('Work', 'Ideas', 'Old'), 'Work')])
+
+    def test_notebook_collision(self):
+        for path in ['Work/Ideas/b.txt', 'ideas/a.txt']:
+            self.write(path)
+        with self.assertRaises(Exception) as raised:
+            sync_tree(self.test_dir, 'Notebook 0', mask=['*.txt'],
+                      format='plain')
+        self.assertIn('notebook "', str(raised.exception))
+        self.assertNotIn('createNote', self.server.calls)
+
+    def test_sync_tree(self):
+        for path in ['top.txt', 'other.md', 'Work/a.txt', 'Work/a.tmp',
+                     'Work/Ideas/b.md']:
+            self.write(path)
+        self.write('.gnsyncignore', '*.tmp\n')
+
+        summary = sync_tree(self.test_dir, 'Notebook 0', jobs=2,
+                            mask=['*.txt', '*.md'], format='plain')
+
+        self.assertEqual(summary['uploaded'], 4)
+        notebooks = dict((n.guid, n) for n in self.corpus.notebooks.values())
+        located = sorted((notebooks[n.notebookGuid].stack or '',
+                          notebooks[n.notebookGuid].name, n.title)
+                         for n in self.corpus.notes.values())
+        self.assertEqual(located, [('', 'Notebook 0', 'other'),
+                                   ('', 'Notebook 0', 'top'),
+                                   ('', 'Work', 'a'),
+                                   ('Work', 'Ideas', 'b')])
+        self.assertEqual(self.server.calls['listNotebooks'], 1)
+
+    def test_split_masks(self):
+        self.assertEqual(split_masks(None), ['*.*'])
+        self.assertEqual(split_masks('*.txt'), ['*.txt'])
+        self.assertEqual(split_masks(['*.txt, *.md', '*.html']),
+                         ['*.txt', '*.md', '*.html'])
+
+
+class testGnsyncHtml(LocalServerCase, unittest.TestCase):
+    def write(self, name, content):
+        path = os.path.join(self.test_dir, name)
+        with open(path, 'wb' if isinstance(content, bytes) else 'w') as f:
+            f.write(content)
+        return path
+
+    def sync(self):
+        GNSync('Notebook 0', self.test_dir, '*.html', 'html').sync()
+        return [n for n in self.corpus.notes.values() if n.title == 'page'][0]
+
+    def test_unchanged_resources_not_sent(self):
+        image = b'\x89PNG' + os.urandom(256 * 1024)
+        picture = self.write('picture.png', image)
+        page = '<html><p>%s</p><img src="' + picture + '"/></html>'
+        path = self.write('page.html', page % 'First')
+        os.utime(path, (1, 1))
+        note = self.sync()
+        self.assertEqual(note.resources[0].data.body, image)
+        self.assertIn(hashlib.md5(image).hexdigest(), note.content)
+
+        self.write('page.html', page % 'Second')
+        os.utime(path, (note.updated / 1000 + 1, note.updated / 1000 + 1))
+        received = self.server.received
+        with patch('geeknote.gnsync.GNSync._get_file_hash',
+                   side_effect=GNSync._get_file_hash, autospec=True) as hashed:
+            note = self.sync()
+        self.assertNotIn(picture, [c[0][1] for c in hashed.call_args_list])
+        self.assertLess(self.server.received - received, 64 * 1024)
+        self.assertIn('Second', note.content)
+        self.assertEqual(len(note.resources), 1)
+        self.assertEqual(note.resources[0].data.body, image)
+        self.assertEqual(self.server.calls['updateNote'], 1)
+
+
+class testGnsyncJournal(LocalServerCase, unittest.TestCase):
+    def setUp(self):
+        super(testGnsyncJournal, self).setUp()
+        patcher = patch.object(journal, 'JOURNAL_DIR',
+                               os.path.join(self.test_dir, '.journal'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write(self, count):
+        for i in range(count):
+            with open(os.path.join(self.test_dir, 'Note %d.txt' % i), 'w') as f:
+                f.write('text %d' % i)
+
+    def interrupted(self, method, after, **options):
+        """ sync which is rate limited once `after` calls of method went """
+        throttle = self.server.throttle
+
+        def limited(name):
+            if name == method and self.server.calls[name] >= after:
+                raise EDAMSystemException(
+                    errorCode=EDAMErrorCode.RATE_LIMIT_REACHED,
+                    rateLimitDuration=60)
+            return throttle(name)
+
+        # sys.exit as it is, other tests replace it
+        with patch.object(self.server, 'throttle', limited), \
+                patch.object(ratelimit, 'limiter', ratelimit.RateLimiter()), \
+                patch('sys.exit', side_effect=SystemExit):
+            self.assertRaises(tools.ExitException, self.sync, **options)
+
+    def sync(self, **options):
+        self.server.calls.clear()
+        GNSync('Notebook 0', self.test_dir, '*.txt', 'plain', **options).sync()
+
+    def journals(self):
+        directory = os.path.join(self.test_dir, '.journal')
+        return os.listdir(directory) if os.path.exists(directory) else []
+
+    def test_finished_sync_forgotten(self):
+        self.write(2)
+        self.sync()
+        self.assertEqual(self.journals(), [])
+
+    def test_rate_limited_upload_resumed(self):
+        self.write(5)
+        self.interrupted('createNote', 2)
+        self.assertEqual(len(self.corpus.notes), 2)
+        self.assertEqual(len(self.journals()), 1)
+
+        self.sync()
+        self.assertEqual(sorted(n.title for n in self.corpus.notes.values()),
+                         ['Note %d' % i for i in range(5)])
+        self.assertEqual(self.server.calls['createNote'], 3)
+        # the creates which were recorded are done, the one which was
+        # sent is looked up and the notebook is not listed
+        self.assertEqual(self.server.calls['findNotesMetadata'], 1)
+        self.assertNotIn('getFilteredSyncChunk', self.server.calls)
+        self.assertEqual(self.journals(), [])
+        manifest = self.storage.manifest[os.path.realpath(self.test_dir)]
+        self.assertEqual(sorted(e['guid'] for e in manifest.values()),
+                         sorted(self.corpus.notes))
+
+    def test_rate_limited_parallel_upload_resumed(self):
+        self.write(6)
+        self.interrupted('createNote', 2, jobs=4)
+        self.assertLess(len(self.corpus.notes), 6)
+        self.assertEqual(len(self.journals()), 1)
+
+        self.sync(jobs=4)
+        self.assertEqual(sorted(n.title for n in self.corpus.notes.values()),
+                         ['Note %d' % i for i in range(6)])
+        self.assertEqual(self.journals(), [])
+
+    def test_failed_action_kept(self):
+        self.write(2)
+        create = GNSync._create_note
+
+        def failed(gnsync, file_note, *args, **kwargs):
+            if file_note['path'].endswith('Note 1.txt'):
+                return None
+            return create(gnsync, file_note, *args, **kwargs)
+
+        with patch.object(GNSync, '_create_note', failed):
+            self.sync()
+        self.assertEqual(len(self.journals()), 1)
+        self.sync()
+        self.assertEqual(sorted(n.title for n in self.corpus.notes.values()),
+                         ['Note 0', 'Note 1'])
+        self.assertEqual(self.server.calls['createNote'], 1)
+        self.assertEqual(self.journals(), [])
+
+    def test_sent_create_not_repeated(self):
+        self.write(3)
+        record = GNSync._record_file
+
+        def killed(gnsync, path, *args, **kwargs):
+            if path.endswith('Note 1.txt'):
+                raise SystemExit()
+            return record(gnsync, path, *args, **kwargs)
+
+        with patch.object(GNSync, '_record_file', killed):
+            self.assertRaises(SystemExit, self.sync)
+        self.sync()
+        self.assertEqual(sorted(n.title for n in self.corpus.notes.values()),
+                         ['Note 0', 'Note 1', 'Note 2'])
+        self.assertNotIn('updateNote', self.server.calls)
+        manifest = self.storage.manifest[os.path.realpath(self.test_dir)]
+        self.assertEqual(len(manifest), 3)
+
+    def test_interrupted_download_resumed(self):
+        notebook = [n.guid for n in self.corpus.notebooks.values()
+                    if n.name == 'Notebook 0'][0]
+        for i in range(5):
+            self.corpus.addNote('Note %d' % i,
+                                '<en-note><div>Line %d</div></en-note>' % i,
+                                notebook)
+        write = GNSync._write_file
+        written = []
+
+        def killed(gnsync, action, content):
+            if len(written) == 3:
+                raise SystemExit()
+            written.append(action.path)
+            return write(gnsync, action, content)
+
+        with patch.object(GNSync, '_write_file', killed):
+            self.assertRaises(SystemExit, self.sync, download_only=True)
+        self.sync(download_only=True)
+        self.assertEqual(self.server.calls['getNoteContent'], 2)
+        for i in range(5):
+            path = os.path.join(self.test_dir, 'Note %d.txt' % i)
+            with open(path) as f:
+                self.assertIn('Line %d' % i, f.read())
+        self.assertEqual(self.journals(), [])
+
+
+class testWriteAtomic(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+        self.path = os.path.join(self.test_dir, 'note.txt')
+
+    def test_replace(self):
+        write_atomic(self.path, b'old')
+        write_atomic(self.path, b'new', 1000.0)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), b'new')
+        self.assertEqual(os.path.getmtime(self.path), 1000.0)
+        self.assertEqual(os.listdir(self.test_dir), ['note.txt'])
+
+    def test_failed_write_keeps_file(self):
+        write_atomic(self.path, b'old')
+        with self.assertRaises(TypeError):
+            write_atomic(self.path, 'not bytes')
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), b'old')
+        self.assertEqual(os.listdir(self.test_dir), ['note.txt'])
+
+
+class testTitleIndex(unittest.TestCase):
+    def setUp(self):
+        self.notes = [Types.Note(guid='1', title='Same', updated=1),
+                      Types.Note(guid='2', title='Same ', updated=3),
+                      Types.Note(guid='3', title='Other', updated=2),
+                      Types.Note(guid='4', title='Café', updated=1)]
+        self.index = TitleIndex(self.notes, lambda n: n.title,
+                                lambda n: n.updated)
+
+    def test_get_newest(self):
+        self.assertEqual(self.index.get('Same').guid, '2')
+        self.assertEqual(self.index.get('Other').guid, '3')
+        self.assertIsNone(self.index.get('Missing'))
+
+    def test_normalized(self):
+        # decomposed é
+        self.assertEqual(self.index.get('Cafe\u0301').guid, '4')
+
+    def test_duplicates(self):
+        duplicates = self.index.duplicates()
+        self.assertEqual([(title, [n.guid for n in group])
+                          for title, group in duplicates],
+                         [('Same', ['2', '1'])])
+        self.assertEqual(sorted(n.guid for n in self.index.newest()),
+                         ['2', '3', '4'])
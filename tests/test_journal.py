@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+from geeknote import journal
+from geeknote.journal import Journal
+
+
+class testJournal(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+        patcher = patch.object(journal, 'JOURNAL_DIR',
+                               os.path.join(self.test_dir, 'journal'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.journal = Journal.forSync('/sync', 'guid', '*.txt')
+        self.addCleanup(self.journal.close)
+
+    def test_no_run(self):
+        self.assertIsNone(self.journal.load())
+
+    def test_progress(self):
+        self.journal.begin([{'kind': 'create-note'}, {'kind': 'update-note'}])
+        self.journal.started(0)
+        self.journal.completed(1)
+        self.journal.close()
+        self.assertEqual(Journal.forSync('/sync', 'guid', '*.txt').load(),
+                         ([{'kind': 'create-note'}, {'kind': 'update-note'}],
+                          {0}, {1}))
+
+    def test_finished(self):
+        self.journal.begin([{'kind': 'create-note'}, {'kind': 'update-note'}])
+        self.journal.completed(1)
+        self.assertFalse(self.journal.isFinished())
+        self.journal.completed(0)
+        self.assertTrue(self.journal.isFinished())
+
+    def test_begin_replaces_run(self):
+        self.journal.begin([{'kind': 'create-note'}])
+        self.journal.completed(0)
+        self.journal.begin([{'kind': 'update-note'}])
+        self.assertEqual(self.journal.load(),
+                         ([{'kind': 'update-note'}], set(), set()))
+
+    def test_torn_record_ignored(self):
+        self.journal.begin([{'kind': 'create-note'}, {'kind': 'update-note'}])
+        self.journal.completed(0)
+        self.journal.close()
+        with open(self.journal.path, 'a') as f:
+            f.write('{"do')
+        self.assertEqual(self.journal.load()[2], {0})
+
+    def test_keys(self):
+        self.assertNotEqual(self.journal.path,
+                            Journal.forSync('/sync', 'guid', '*.md').path)
+
+    def test_discard(self):
+        self.journal.begin([])
+        self.journal.discard()
+        self.assertIsNone(self.journal.load())
+        self.assertEqual(os.listdir(os.path.join(self.test_dir, 'journal')),
+                         [])
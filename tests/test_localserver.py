@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import time
+import unittest
+
+from mock import Mock
+import evernote.edam.notestore.NoteStore as NoteStore
+from evernote.edam.error.ttypes import EDAMSystemException
+from geeknote import memo, transport
+from geeknote.geeknote import GeekNote
+from geeknote.localserver import Corpus, LocalServer
+
+
+class GeekNoteLocal(GeekNote):
+    def __init__(self, userStoreUri):
+        self.userStoreUri = userStoreUri
+        self.authToken = "token"
+        self.sleepOnRateLimit = False
+        self.storage = Mock()
+        self.storage.getCache.return_value = None
+
+    def getStorage(self):
+        return self.storage
+
+
+class testLocalServer(unittest.TestCase):
+    def setUp(self):
+        self.corpus = Corpus.generate(notes=30, notebooks=2, tags=3,
+                                      resources=1, size=64)
+        self.server = LocalServer(self.corpus).start()
+        self.addCleanup(self.server.stop)
+        self.reset()
+        self.addCleanup(self.reset)
+        self.geeknote = GeekNoteLocal(self.server.userStoreUri)
+
+    def reset(self):
+        GeekNote.userStore = None
+        GeekNote.noteStore = None
+        memo.memo.invalidate()
+        transport.pool.clear()
+
+    def test_note_store_url(self):
+        self.assertEqual(self.geeknote.getNoteStoreUrl(), self.server.noteStoreUrl)
+        self.assertEqual(self.geeknote.getUserInfo().shardId, "s1")
+
+    def test_find_notes(self):
+        result = self.geeknote.findNotes("Note", 100)
+        self.assertEqual(result.totalNotes, 30)
+        self.assertEqual(len(result.notes), 30)
+
+        result = self.geeknote.findNotes('intitle:"Note 1"', 100)
+        self.assertEqual(len(result.notes), 11)
+
+    def test_notebooks_and_tags(self):
+        notebooks = self.geeknote.findNotebooks()
+        self.assertEqual([n.name for n in notebooks],
+                         ["Default", "Notebook 0", "Notebook 1"])
+        self.assertEqual(len(self.geeknote.findTags()), 3)
+
+    def test_create_update_note(self):
+        note = self.geeknote.createNote("New", "<en-note>new</en-note>",
+                                        tags=["fresh"])
+        stored = self.corpus.getNote(note.guid)
+        self.assertEqual(stored.title, "New")
+        self.assertEqual(self.corpus.findTag("fresh").guid, stored.tagGuids[0])
+
+        self.assertTrue(self.geeknote.updateNote(note.guid, title="Renamed"))
+        self.assertEqual(self.corpus.getNote(note.guid).title, "Renamed")
+        self.assertEqual(self.geeknote.getNoteContent(note.guid),
+                         "<en-note>new</en-note>")
+
+    def test_resource_by_hash(self):
+        note = list(self.corpus.notes.values())[0]
+        body = note.resources[0].data.body
+        resource = self.geeknote.getResourceByHash(
+            note.guid, hashlib.md5(body).digest())
+        self.assertEqual(resource.data.body, body)
+
+    def test_sync_chunks(self):
+        noteStore = self.geeknote.getNoteStore()
+        state = noteStore.getSyncState("token")
+        self.assertEqual(state.updateCount, self.corpus.updateCount)
+
+        syncFilter = NoteStore.SyncChunkFilter(includeNotes=True,
+                                               includeNotebooks=True)
+        chunk = noteStore.getFilteredSyncChunk("token", 0, 10, syncFilter)
+        self.assertEqual(len(chunk.notebooks), 3)
+        self.assertEqual(len(chunk.notes), 7)
+        self.assertIsNone(chunk.notes[0].content)
+
+        chunk = noteStore.getFilteredSyncChunk("token", chunk.chunkHighUSN,
+                                               1000, syncFilter)
+        self.assertEqual(len(chunk.notes), 23)
+        self.assertEqual(chunk.chunkHighUSN, state.updateCount)
+
+    def test_linked_notebook(self):
+        notebook = list(self.corpus.notebooks.values())[1]
+        self.corpus.shareNotebook(notebook.guid, "Shared")
+        noteStore = self.geeknote.getNoteStore()
+
+        linked, = self.geeknote.findLinkedNotebooks()
+        self.assertEqual(linked.shareName, "Shared")
+        self.assertEqual(linked.noteStoreUrl, self.server.noteStoreUrl)
+
+        auth = noteStore.authenticateToSharedNotebook(linked.shareKey, "token")
+        self.assertGreater(auth.expiration, auth.currentTime)
+        shared = noteStore.getSharedNotebookByAuth(auth.authenticationToken)
+        self.assertEqual(shared.notebookGuid, notebook.guid)
+
+        chunk = noteStore.getLinkedNotebookSyncChunk("token", linked, 0, 1000,
+                                                     False)
+        self.assertEqual(len(chunk.notes), 15)
+        self.assertEqual(set(n.notebookGuid for n in chunk.notes),
+                         {notebook.guid})
+
+    def test_latency(self):
+        self.server.latency = 0.05
+        start = time.time()
+        self.geeknote.getNoteStore().listTags("token")
+        self.assertTrue(time.time() - start >= 0.05)
+
+    def test_rate_limit(self):
+        noteStore = self.geeknote.getNoteStore()
+        self.server.rateLimit = 2
+        noteStore.getSyncState("token")
+        noteStore.getSyncState("token")
+        with self.assertRaises(EDAMSystemException) as context:
+            noteStore.getSyncState("token")
+        self.assertEqual(context.exception.errorCode, 19)
+        self.assertTrue(context.exception.rateLimitDuration > 0)
+        self.assertEqual(self.server.calls["getSyncState"], 3)
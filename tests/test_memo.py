@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+
+from geeknote.memo import Memo, MemoizedClient
+
+
+class FakeStore(object):
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+
+    def getTag(self, authToken, guid):
+        self.calls.append(("getTag", guid))
+        time.sleep(self.delay)
+        return "tag " + guid
+
+    def listNotebooks(self, authToken):
+        self.calls.append(("listNotebooks",))
+        if self.delay < 0:
+            raise IOError("failed")
+        return ["notebook"]
+
+    def createNotebook(self, authToken, notebook):
+        self.calls.append(("createNotebook", notebook))
+        return notebook
+
+    def getNote(self, authToken, guid):
+        self.calls.append(("getNote", guid))
+        return guid
+
+
+class testMemo(unittest.TestCase):
+    def setUp(self):
+        self.store = FakeStore()
+        self.memo = Memo(ttl=60)
+        self.client = MemoizedClient(self.store, self.memo)
+
+    def test_read_memoized(self):
+        self.assertEqual(self.client.getTag("token", "a"), "tag a")
+        self.assertEqual(self.client.getTag("token", "a"), "tag a")
+        self.client.getTag("token", "b")
+        self.assertEqual(self.store.calls, [("getTag", "a"), ("getTag", "b")])
+        self.assertEqual(self.memo.getStats()["hits"], 1)
+
+    def test_write_invalidates(self):
+        self.client.listNotebooks("token")
+        self.client.createNotebook("token", "new")
+        self.client.listNotebooks("token")
+        self.assertEqual(self.store.calls.count(("listNotebooks",)), 2)
+
+    def test_other_calls_pass_through(self):
+        self.client.listNotebooks("token")
+        self.client.getNote("token", "n1")
+        self.client.getNote("token", "n1")
+        self.client.listNotebooks("token")
+        self.assertEqual(self.store.calls.count(("getNote", "n1")), 2)
+        self.assertEqual(self.store.calls.count(("listNotebooks",)), 1)
+
+    def test_expired(self):
+        self.memo.ttl = 0
+        self.client.listNotebooks("token")
+        self.client.listNotebooks("token")
+        self.assertEqual(self.store.calls.count(("listNotebooks",)), 2)
+
+    def test_errors_not_memoized(self):
+        self.store.delay = -1
+        with self.assertRaises(IOError):
+            self.client.listNotebooks("token")
+        self.store.delay = 0
+        self.assertEqual(self.client.listNotebooks("token"), ["notebook"])
+
+    def test_concurrent_calls_coalesced(self):
+        self.store.delay = 0.1
+        results = []
+
+        def worker():
+            results.append(self.client.getTag("token", "a"))
+
+        threads = [threading.Thread(target=worker) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ["tag a"] * 5)
+        self.assertEqual(self.store.calls, [("getTag", "a")])
+        self.assertEqual(self.memo.getStats()["coalesced"], 4)
+
+    def test_write_during_read_not_memoized(self):
+        self.store.delay = 0.1
+        thread = threading.Thread(target=self.client.getTag, args=("token", "a"))
+        thread.start()
+        time.sleep(0.02)
+        self.client.createNotebook("token", "new")
+        thread.join()
+        self.client.getTag("token", "a")
+        self.assertEqual(self.store.calls.count(("getTag", "a")), 2)
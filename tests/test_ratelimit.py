@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+
+from mock import Mock
+from geeknote import ratelimit
+from geeknote.ratelimit import RateLimiter
+
+
+class testRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.limiter = RateLimiter(window=10)
+
+    def test_unlimited_until_rate_limited(self):
+        start = time.time()
+        for i in range(50):
+            self.limiter.acquire()
+        self.assertTrue(time.time() - start < 0.5)
+        self.assertIsNone(self.limiter.projectCompletion(10))
+
+    def test_learn_budget(self):
+        for i in range(100):
+            self.limiter.acquire()
+        self.limiter.limited(0)
+        # 100 requests in a 10 second window, minus the safety margin
+        self.assertAlmostEqual(self.limiter.rate, 9.0)
+
+    def test_small_sample_not_learned(self):
+        for i in range(3):
+            self.limiter.acquire()
+        self.limiter.limited(0.1)
+        self.assertIsNone(self.limiter.rate)
+        self.assertGreater(self.limiter.blockedUntil, time.time())
+
+    def test_pace_grows_after_block(self):
+        self.limiter.rate = 1.0
+        self.limiter.tokens = ratelimit.BURST
+        for i in range(ratelimit.BURST):
+            self.limiter.acquire()
+        self.assertGreater(self.limiter.rate, 1.0)
+
+    def test_pace_grows_with_rate(self):
+        # a window of requests at 0.5/s raises the rate by a tenth
+        self.limiter.rate = 0.5
+        self.limiter.tokens = ratelimit.BURST
+        for i in range(5):
+            self.limiter.acquire()
+        self.assertAlmostEqual(self.limiter.rate, 0.55)
+
+    def test_paced_after_limit(self):
+        for i in range(200):
+            self.limiter.acquire()
+        self.limiter.limited(0.1)
+        start = time.time()
+        for i in range(5):
+            self.limiter.acquire()
+        elapsed = time.time() - start
+        # blocked for 0.1s, then 5 requests at 18/s
+        self.assertTrue(0.3 < elapsed < 1.0, elapsed)
+
+    def test_limited_again_slows_down(self):
+        self.limiter.rate = 10.0
+        self.limiter.limited(0)
+        self.assertAlmostEqual(self.limiter.rate, 9.0)
+
+    def test_one_block_slows_down_once(self):
+        self.limiter.rate = 10.0
+        for i in range(8):
+            self.limiter.limited(0.5)
+        self.assertAlmostEqual(self.limiter.rate, 9.0)
+
+    def test_project_completion(self):
+        self.limiter.rate = 2.0
+        self.limiter.tokens = 0
+        finish = self.limiter.projectCompletion(10)
+        self.assertAlmostEqual(finish - time.time(), 5, places=1)
+
+    def test_persisted(self):
+        storage = Mock()
+        self.limiter.rate = 3.0
+        self.limiter.limited(30, storage)
+        state = storage.setCache.call_args[0][1]
+        self.assertEqual(storage.setCache.call_args[0][0], "rateLimit")
+
+        storage.getCache.return_value = state
+        limiter = RateLimiter(window=10)
+        limiter.load(storage)
+        self.assertEqual(limiter.rate, state["rate"])
+        self.assertEqual(limiter.blockedUntil, state["blockedUntil"])
+        # kept for the window, not for a day
+        self.assertAlmostEqual(storage.setCache.call_args[0][2], 30, delta=1)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import types
+import unittest
+
+from geeknote.scanner import IgnoreRules, scanFiles, walkDirectories
+
+
+class testIgnoreRules(unittest.TestCase):
+    def test_patterns(self):
+        rules = IgnoreRules(['# comment', '', '*.tmp', 'drafts/',
+                             '/todo.txt', '!keep.tmp'])
+        self.assertTrue(rules.isIgnored('note.tmp'))
+        self.assertTrue(rules.isIgnored('sub/note.tmp'))
+        self.assertFalse(rules.isIgnored('keep.tmp'))
+        self.assertTrue(rules.isIgnored('drafts', isDir=True))
+        self.assertFalse(rules.isIgnored('drafts'))
+        self.assertTrue(rules.isIgnored('todo.txt'))
+        self.assertFalse(rules.isIgnored('sub/todo.txt'))
+        self.assertFalse(rules.isIgnored('note.txt'))
+
+    def test_child_rules(self):
+        parent = IgnoreRules(['*.tmp', '/sub/private'])
+        child = IgnoreRules(['!keep.tmp'], parent, 'sub')
+        self.assertTrue(child.isIgnored('note.tmp'))
+        self.assertFalse(child.isIgnored('keep.tmp'))
+        self.assertTrue(child.isIgnored('private', isDir=True))
+        self.assertTrue(parent.isIgnored('keep.tmp'))
+
+
+class testScanner(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        for path in ['note.txt', 'note.md', 'note.tmp', '.hidden.txt',
+                     'a/one.txt', 'a/keep.tmp', 'a/b/two.txt',
+                     'a/b/c/three.txt', 'drafts/draft.txt', '.git/HEAD']:
+            self.write(path)
+        self.write('.gnsyncignore', 'drafts/\n*.tmp\n/a/b/c\n')
+        self.write('a/.gnsyncignore', '!keep.tmp\n')
+
+    def write(self, path, content='text'):
+        path = os.path.join(self.root, path)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def names(self, directory, masks, rules=None):
+        return sorted(e.name for e in scanFiles(directory, masks, rules))
+
+    def test_masks(self):
+        self.assertEqual(self.names(self.root, ['*.*']),
+                         ['note.md', 'note.txt'])
+        self.assertEqual(self.names(self.root, ['*.txt']), ['note.txt'])
+        self.assertEqual(self.names(self.root, ['*.txt', '*.md', '*.tmp']),
+                         ['note.md', 'note.txt'])
+
+    def test_directories(self):
+        walk = walkDirectories(self.root)
+        self.assertIsInstance(walk, types.GeneratorType)
+        self.assertEqual([(path, depth) for path, depth, rules in walk],
+                         [('a', 1), (os.path.join('a', 'b'), 2)])
+        self.assertEqual([path for path, depth, rules
+                          in walkDirectories(self.root, maxDepth=1)], ['a'])
+
+    def test_inherited_rules(self):
+        rules = dict((path, rules) for path, depth, rules
+                     in walkDirectories(self.root))
+        self.assertEqual(
+            self.names(os.path.join(self.root, 'a'), ['*.*'], rules['a']),
+            ['keep.tmp', 'one.txt'])
+
+    def test_entry_stat(self):
+        entry = list(scanFiles(self.root, ['note.txt']))[0]
+        self.assertEqual(entry.stat().st_size, 4)
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import unittest
+import datetime
 from sqlalchemy.engine import create_engine
 from sqlalchemy.orm.session import sessionmaker
 from geeknote import storage
@@ -147,6 +148,138 @@ class storageTest(unittest.TestCase):
     def test_set_search_true(self):
         self.assertTrue(self.storage.setSearch('my query'))
 
+    def test_get_cache_missing(self):
+        self.assertIsNone(self.storage.getCache('noteStoreUrl'))
+
+    def test_set_cache_success(self):
+        url = 'https://www.evernote.com/shard/s1/notestore'
+        self.assertTrue(self.storage.setCache('noteStoreUrl', url))
+        self.assertEqual(self.storage.getCache('noteStoreUrl'), url)
+
+    def test_get_cache_expired(self):
+        self.assertTrue(self.storage.setCache('shardInfo', (1, 's1'), ttl=-1))
+        self.assertIsNone(self.storage.getCache('shardInfo'))
+
+    def test_replace_cache_success(self):
+        self.storage.setCache('shardInfo', (1, 's1'))
+        self.storage.setCache('shardInfo', (1, 's2'))
+        self.assertEqual(self.storage.getCache('shardInfo'), (1, 's2'))
+
+    def test_del_cache_key(self):
+        self.storage.setCache('shardInfo', (1, 's1'))
+        self.storage.setCache('noteStoreUrl', 'url')
+        self.assertTrue(self.storage.delCache('shardInfo'))
+        self.assertIsNone(self.storage.getCache('shardInfo'))
+        self.assertEqual(self.storage.getCache('noteStoreUrl'), 'url')
+
+    def test_del_cache_prefix(self):
+        self.storage.setCache('versionOK:1.28', True)
+        self.storage.setCache('versionOK_1', True)
+        self.storage.setCache('rateLimit', {})
+        self.assertTrue(self.storage.delCache(prefix='versionOK:'))
+        self.assertIsNone(self.storage.getCache('versionOK:1.28'))
+        self.assertTrue(self.storage.getCache('versionOK_1'))
+        self.assertEqual(self.storage.getCache('rateLimit'), {})
+
+    def test_remove_user_clears_cache(self):
+        self.storage.setCache('noteStoreUrl', 'url')
+        self.storage.removeUser()
+        self.assertIsNone(self.storage.getCache('noteStoreUrl'))
+
+    def test_get_notebook_sync_missing(self):
+        self.assertIsNone(self.storage.getNotebookSync('1', 'nb'))
+
+    def test_set_notebook_sync_success(self):
+        notes = {'guid': 'note'}
+        self.assertTrue(self.storage.setNotebookSync('1', 'nb', 10, notes))
+        self.storage.setNotebookSync('1', 'nb', 12, notes)
+        updateCount, stored, timestamp = self.storage.getNotebookSync('1', 'nb')
+        self.assertEqual(updateCount, 12)
+        self.assertEqual(stored, notes)
+        self.assertIsNone(self.storage.getNotebookSync('2', 'nb'))
+
+    def test_del_notebook_sync(self):
+        self.storage.setNotebookSync('1', 'nb', 10, {})
+        self.storage.setNotebookSync('2', 'nb', 10, {})
+        self.assertTrue(self.storage.delNotebookSync('1'))
+        self.assertIsNone(self.storage.getNotebookSync('1', 'nb'))
+        self.storage.delSyncState()
+        self.assertIsNone(self.storage.getNotebookSync('2', 'nb'))
+
+    def test_get_sync_run_missing(self):
+        self.assertIsNone(self.storage.getSyncRun('1', '/notes'))
+
+    def test_set_sync_run_success(self):
+        self.assertTrue(self.storage.setSyncRun('1', '/notes', 10, 'abc'))
+        self.storage.setSyncRun('1', '/notes', 12, 'def')
+        self.assertEqual(self.storage.getSyncRun('1', '/notes'), (12, 'def'))
+        self.storage.delSyncState()
+        self.assertIsNone(self.storage.getSyncRun('1', '/notes'))
+
+    def test_manifest(self):
+        self.assertEqual(self.storage.getManifest('1', '/notes'), {})
+        entry = {'size': 4, 'mtime': 1000, 'content_hash': 'abc',
+                 'guid': 'guid', 'usn': 7, 'upload_hash': 'def',
+                 'title': 'note'}
+        self.assertTrue(
+            self.storage.setManifestEntry('1', '/notes', '/notes/note.txt', entry))
+        entry['usn'] = 8
+        self.storage.setManifestEntry('1', '/notes', '/notes/note.txt', entry)
+        self.assertEqual(self.storage.getManifest('1', '/notes'),
+                         {'/notes/note.txt': entry})
+        self.assertEqual(self.storage.getManifest('1', '/other'), {})
+        self.assertEqual(self.storage.getManifest('2', '/notes'), {})
+        self.assertTrue(
+            self.storage.delManifestEntry('1', '/notes', '/notes/note.txt'))
+        self.assertEqual(self.storage.getManifest('1', '/notes'), {})
+
+    def test_manifest_entries(self):
+        entry = {'size': 4, 'mtime': 1000, 'content_hash': 'abc',
+                 'guid': 'guid', 'usn': 7, 'upload_hash': 'def',
+                 'title': 'note'}
+        self.storage.setManifestEntry('1', '/notes', '/notes/old.txt', entry)
+        self.assertTrue(self.storage.setManifestEntries(
+            '1', '/notes', {'/notes/old.txt': None, '/notes/a.txt': entry,
+                            '/notes/b.txt': dict(entry, guid='other')}))
+        self.assertEqual(self.storage.getManifest('1', '/notes'),
+                         {'/notes/a.txt': entry,
+                          '/notes/b.txt': dict(entry, guid='other')})
+
+    def test_sync_state_kept_on_remove_user(self):
+        entry = {'size': 4, 'mtime': 1000, 'content_hash': 'abc',
+                 'guid': 'guid', 'usn': 7, 'upload_hash': 'def',
+                 'title': 'note'}
+        self.storage.setManifestEntry('1', '/notes', '/notes/note.txt', entry)
+        self.storage.setSyncRun('1', '/notes', 10, 'abc')
+        self.storage.removeUser()
+        self.assertEqual(self.storage.getManifest('1', '/notes'),
+                         {'/notes/note.txt': entry})
+        self.assertEqual(self.storage.getSyncRun('1', '/notes'), (10, 'abc'))
+        self.assertTrue(self.storage.delSyncState())
+        self.assertEqual(self.storage.getManifest('1', '/notes'), {})
+
+    def test_resource_hash(self):
+        self.assertIsNone(self.storage.getResourceHash('/img.png', 4, 1000))
+        self.assertTrue(self.storage.setResourceHash('/img.png', 4, 1000,
+                                                     'abc', 'image/png'))
+        self.assertEqual(self.storage.getResourceHash('/img.png', 4, 1000),
+                         ('abc', 'image/png'))
+        self.storage.setResourceHash('/img.png', 5, 2000, 'def', 'image/png')
+        self.assertIsNone(self.storage.getResourceHash('/img.png', 4, 1000))
+        self.assertEqual(self.storage.getResourceHash('/img.png', 5, 2000),
+                         ('def', 'image/png'))
+
+    def test_resource_hashes(self):
+        self.storage.setResourceHash('/notes/a_b/img.png', 4, 1000,
+                                     'abc', 'image/png')
+        self.storage.setResourceHash('/notes-old/img.png', 4, 1000,
+                                     'def', 'image/png')
+        self.storage.setResourceHash('/notes/a_c/img.png', 4, 1000,
+                                     'ghi', 'image/png')
+        self.assertEqual(self.storage.getResourceHashes('/notes/a_b'),
+                         {'/notes/a_b/img.png': (4, 1000, 'abc', 'image/png')})
+        self.assertEqual(len(self.storage.getResourceHashes('/notes')), 2)
+
 
 class modelsTest(unittest.TestCase):
     def test_rept_userprop(self):
@@ -172,7 +305,35 @@ class modelsTest(unittest.TestCase):
                           guid='testguid')
         self.assertEqual(tag.__repr__(), "<Tag('testtag')>")
 
+    def test_repr_cache(self):
+        expires = datetime.datetime(2020, 1, 1)
+        cache = storage.Cache(key='test', value='value', expires=expires)
+        self.assertEqual(cache.__repr__(), "<Cache('test','%s')>" % expires)
+
     def test_repr_search(self):
         search = storage.Search(search_obj='query')
         self.assertEqual(search.__repr__(),
                           "<Search('%s')>" % search.timestamp)
+
+    def test_repr_notebook_sync(self):
+        sync = storage.NotebookSync(account='1', notebook='nb',
+                                    update_count=10, notes={})
+        self.assertEqual(sync.__repr__(), "<NotebookSync('nb','10')>")
+
+    def test_repr_sync_run(self):
+        run = storage.SyncRun(account='1', path='/notes', update_count=10,
+                              fingerprint='abc')
+        self.assertEqual(run.__repr__(),
+                         "<SyncRun('/notes','%s')>" % run.timestamp)
+
+    def test_repr_manifest_entry(self):
+        entry = storage.ManifestEntry(account='1', directory='/notes',
+                                      path='/notes/note.txt')
+        entry.guid = 'guid'
+        self.assertEqual(entry.__repr__(),
+                         "<ManifestEntry('/notes/note.txt','guid')>")
+
+    def test_repr_resource_hash(self):
+        entry = storage.ResourceHash(path='/img.png', size=4, mtime=1000,
+                                     body_hash='abc', mime='image/png')
+        self.assertEqual(entry.__repr__(), "<ResourceHash('/img.png','abc')>")
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import thrift.protocol.TBinaryProtocol as TBinaryProtocol
+from thrift.Thrift import TMessageType
+from thrift.transport.TTransport import TTransportException
+from geeknote import transport
+from geeknote.transport import ConnectionPool, THttpPooledClient, TBytesBuffer
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    closeAfterResponse = False
+    dropRequests = False
+    host = None
+    received = 0
+
+    def do_POST(self):
+        EchoHandler.host = self.headers["Host"]
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        EchoHandler.received += 1
+        if EchoHandler.dropRequests:
+            # the request arrived, the connection drops before the response
+            self.close_connection = True
+            return
+        status = 500 if body == b"fail" else 200
+        self.send_response(status)
+        self.send_header("Content-Type", "application/x-thrift")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if EchoHandler.closeAfterResponse:
+            # drop the connection without telling the client
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+class testTransport(unittest.TestCase):
+    def setUp(self):
+        EchoHandler.closeAfterResponse = False
+        EchoHandler.dropRequests = False
+        EchoHandler.received = 0
+        self.server = HTTPServer(("127.0.0.1", 0), EchoHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.pool = ConnectionPool()
+        self.uri = "http://127.0.0.1:%d/edam/note" % self.server.server_port
+
+    def tearDown(self):
+        self.pool.clear()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def call(self, client, payload):
+        client.write(payload)
+        client.flush()
+        return client.readAll(len(payload))
+
+    def test_connection_reused(self):
+        client = THttpPooledClient(self.uri, self.pool)
+        for i in range(5):
+            self.assertEqual(self.call(client, b"call %d" % i), b"call %d" % i)
+
+        stats = self.pool.getStats()
+        self.assertEqual(stats["requests"], 5)
+        self.assertEqual(stats["opened"], 1)
+        self.assertEqual(stats["reused"], 4)
+
+    def test_connection_shared_between_clients(self):
+        self.call(THttpPooledClient(self.uri, self.pool), b"first")
+        self.call(THttpPooledClient(self.uri, self.pool), b"second")
+        self.assertEqual(self.pool.getStats()["opened"], 1)
+
+    def message(self, name):
+        buf = TBytesBuffer()
+        protocol = TBinaryProtocol.TBinaryProtocol(buf)
+        protocol.writeMessageBegin(name, TMessageType.CALL, 1)
+        protocol.writeMessageEnd()
+        return buf.getvalue()
+
+    def test_reconnect_after_server_close(self):
+        EchoHandler.closeAfterResponse = True
+        client = THttpPooledClient(self.uri, self.pool)
+        first, second = self.message("getNote"), self.message("findNotes")
+        self.assertEqual(self.call(client, first), first)
+        self.assertEqual(self.call(client, second), second)
+
+        stats = self.pool.getStats()
+        self.assertEqual(stats["opened"], 2)
+        self.assertEqual(stats["reconnects"], 1)
+
+    def test_write_not_sent_again(self):
+        client = THttpPooledClient(self.uri, self.pool)
+        self.call(client, self.message("getNote"))
+        EchoHandler.dropRequests = True
+        with self.assertRaises(transport.STALE_CONNECTION_ERRORS):
+            self.call(client, self.message("createNote"))
+        self.assertEqual(EchoHandler.received, 2)
+        self.assertEqual(self.pool.getStats()["reconnects"], 0)
+
+    def test_read_sent_again(self):
+        client = THttpPooledClient(self.uri, self.pool)
+        self.call(client, self.message("getNote"))
+        EchoHandler.dropRequests = True
+        with self.assertRaises(transport.STALE_CONNECTION_ERRORS):
+            self.call(client, self.message("getNote"))
+        # once on the reused connection, once on a fresh one
+        self.assertEqual(EchoHandler.received, 3)
+        self.assertEqual(self.pool.getStats()["reconnects"], 1)
+
+    def test_http_error_raises(self):
+        client = THttpPooledClient(self.uri, self.pool)
+        with self.assertRaises(TTransportException):
+            self.call(client, b"fail")
+
+    def test_host_header(self):
+        self.call(THttpPooledClient(self.uri, self.pool), b"call")
+        self.assertEqual(EchoHandler.host,
+                         "127.0.0.1:%d" % self.server.server_port)
+        self.assertEqual(
+            THttpPooledClient("https://www.evernote.com/edam/note").hostHeader,
+            "www.evernote.com")
+        self.assertEqual(
+            THttpPooledClient("https://[::1]:8443/edam/note").hostHeader,
+            "[::1]:8443")
+
+    def test_unsupported_scheme(self):
+        with self.assertRaises(ValueError):
+            THttpPooledClient("ftp://example.com/edam/note")
+
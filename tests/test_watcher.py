@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from geeknote import watcher
+from geeknote.watcher import InotifyWatcher, PollingWatcher
+
+
+class WatcherTests(object):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+        self.watcher = self.createWatcher()
+        self.addCleanup(self.watcher.close)
+
+    def write(self, name, content='text'):
+        with open(os.path.join(self.test_dir, name), 'w') as f:
+            f.write(content)
+
+    def test_nothing_changed(self):
+        self.assertEqual(self.watcher.wait(0.1, 0.05), set())
+
+    def test_created_and_deleted(self):
+        self.write('note.txt')
+        self.assertEqual(self.watcher.wait(2, 0.1), set(['note.txt']))
+        os.remove(os.path.join(self.test_dir, 'note.txt'))
+        self.assertEqual(self.watcher.wait(2, 0.1), set(['note.txt']))
+
+    def test_burst_debounced(self):
+        self.write('first.txt')
+        self.write('second.txt')
+        self.write('first.txt', 'more text')
+        self.assertEqual(self.watcher.wait(2, 0.2),
+                         set(['first.txt', 'second.txt']))
+        self.assertEqual(self.watcher.wait(0.1, 0.05), set())
+
+    def test_renamed(self):
+        self.write('old.txt')
+        self.watcher.wait(2, 0.1)
+        os.rename(os.path.join(self.test_dir, 'old.txt'),
+                  os.path.join(self.test_dir, 'new.txt'))
+        self.assertEqual(self.watcher.wait(2, 0.1),
+                         set(['old.txt', 'new.txt']))
+
+
+@unittest.skipUnless(InotifyWatcher.isAvailable(), 'inotify is not available')
+class testInotifyWatcher(WatcherTests, unittest.TestCase):
+    def createWatcher(self):
+        return InotifyWatcher(self.test_dir)
+
+    def test_created_by_default(self):
+        self.assertIsInstance(watcher.createWatcher(self.test_dir),
+                              InotifyWatcher)
+
+
+class testPollingWatcher(WatcherTests, unittest.TestCase):
+    def createWatcher(self):
+        return PollingWatcher(self.test_dir, interval=0.02)
+
+    def write(self, name, content='text'):
+        WatcherTests.write(self, name, content)
+        # mtimes of quick writes may be equal, the size tells them apart
+        time.sleep(0.01)